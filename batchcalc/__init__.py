@@ -1,6 +1,6 @@
 
 __version__ = "0.3.1"
 
-from . import controller
-from . import dialogs
+# the GUI modules (controller, dialogs, zbc) import wx and are not imported
+# here so that the calculation can be used without a GUI stack
 from . import model
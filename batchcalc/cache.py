@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import itertools
+import weakref
+from collections import OrderedDict
+
+__version__ = "0.3.1"
+
+
+class LRUCache(object):
+    '''
+    Mapping with a fixed maximal size that evicts the least recently used
+    entries first.
+    '''
+
+    def __init__(self, maxsize=64):
+
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        '''
+        Return the value stored under `key` and mark it as the most recently
+        used one, or `default` if the key is not present.
+        '''
+
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def put(self, key, value):
+        '''
+        Store the `value` under `key` evicting the least recently used entries
+        if the size limit is exceeded.
+        '''
+
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all the entries.
+        '''
+
+        self._data.clear()
+
+
+# batch matrices keyed on the database and the chemical/component selection
+batch_matrices = LRUCache(maxsize=64)
+
+# prepared solvers keyed in the same way as the batch matrices
+solvers = LRUCache(maxsize=64)
+
+# component id -> ids of the source chemicals, keyed on the database
+source_indexes = LRUCache(maxsize=8)
+
+# molecular weight of water keyed on the database
+water_molwts = LRUCache(maxsize=8)
+
+# weight fraction rows of the batch matrix keyed on the database, chemical
+# id, concentration and revision
+weight_fractions = LRUCache(maxsize=1024)
+
+# dense matrices of the moles of the stored syntheses keyed on the database
+synthesis_matrices = LRUCache(maxsize=8)
+
+# nearest neighbour indexes of the syntheses keyed on the database, updated
+# in place by the synthesis record functions
+composition_indexes = LRUCache(maxsize=8)
+
+# element counts of the parsed chemical formulas, these do not depend on the
+# database so they are never invalidated
+formulas = LRUCache(maxsize=4096)
+
+# incremented on every modification of the database
+revision = 0
+
+# tokens distinguishing the engines with the same URL, e.g. the in-memory
+# databases, the entries are dropped with the engines
+_bind_tokens = weakref.WeakKeyDictionary()
+_counter = itertools.count()
+
+
+def database_key(session):
+    '''
+    Return a hashable identifier of the database the `session` is bound to,
+    the URL and a token of the engine, so that the databases sharing the
+    URL, e.g. "sqlite://" of all the in-memory ones, are kept apart.
+    '''
+
+    bind = session.get_bind()
+    token = _bind_tokens.get(bind)
+    if token is None:
+        token = _bind_tokens.setdefault(bind, next(_counter))
+    return str(bind.url), token
+
+
+def invalidate():
+    '''
+    Clear all the cached data derived from the database records, this has to
+    be called after every modification of the database.
+    '''
+
+    global revision
+
+    revision += 1
+    batch_matrices.clear()
+    solvers.clear()
+    source_indexes.clear()
+    water_molwts.clear()
+    weight_fractions.clear()
+    synthesis_matrices.clear()
+    composition_indexes.clear()
+
+
+def invalidate_syntheses():
+    '''
+    Clear the cached data derived from the synthesis records, this has to be
+    called after every modification of the syntheses. The composition
+    indexes are updated in place instead.
+    '''
+
+    synthesis_matrices.clear()
@@ -29,14 +29,13 @@
 
 from __future__ import print_function, unicode_literals
 
+import numbers
 import operator
-import re
 
-from numpy.linalg import solve, lstsq
 import numpy as np
 
-from batchcalc import controller as ctrl
-from batchcalc.model import Chemical, Component, Batch
+from batchcalc import compositions, core
+from batchcalc.repository import Repository
 
 __version__ = "0.3.1"
 
@@ -59,6 +58,8 @@ class BatchCalculator(object):
         self.A = np.zeros(1)
         self.B = np.zeros(1)
         self.X = np.zeros(1)
+        self.residual = 0.0
+        self.solver = None
 
         self.scale_all = 100.0
         self.sample_scale = 1.0
@@ -80,6 +81,8 @@ class BatchCalculator(object):
         self.A = np.zeros(1)
         self.B = np.zeros(1)
         self.X = np.zeros(1)
+        self.residual = 0.0
+        self.solver = None
 
         self.scale_all = 100.0
         self.sample_scale = 1.0
@@ -111,60 +114,178 @@ class BatchCalculator(object):
         else:
             return None
 
-    def calculate_masses(self, session):
+    def check_selection(self, session):
         '''
-        Solve the linear system of equations  B * X = C
+        Check if the components and chemicals are selected and if all the
+        components have their sources among the chemicals.
         '''
 
-        db = ctrl.DB()
+        repository = Repository(session)
+        core.check_sources(self.components, self.chemicals,
+                           repository.sources([c.id for c in self.components]))
 
-        if len(self.components) == 0:
-            raise ValueError("No Zeolite components selected")
+    def calculate_masses(self, session, nonnegative=False):
+        '''
+        Solve the linear system of equations  B * X = C
 
-        if len(self.chemicals) == 0:
-            raise ValueError("No chemicals selected")
+        If `nonnegative` is True the non-negative least squares solution is
+        found starting from the previous one. The norm of the composition
+        error B * X - C is stored in `residual`.
+        '''
 
-        for comp in self.components:
-            temp = db.get_chemicals(components=[comp])
-            if len(set([t.id for t in temp]) & set([r.id for r in self.chemicals])) == 0:
-                raise ValueError("some components need their sources: {0:s}".format(comp.name))
+        solver = self.prepare_solver(session)
 
         self.A = self.get_A_matrix()
-        self.B = self.get_B_matrix(session)
+        self.B = solver.B.copy()
 
         try:
-            if self.B.shape[0] == self.B.shape[1]:
-                self.X = solve(np.transpose(self.B), self.A)
-            else:
-                self.X, resid, rank, s = lstsq(np.transpose(self.B), self.A)
-            # assign calculated masses to the chemicals
-            for chemical, x in zip(self.chemicals, self.X):
-                if chemical.kind == "reactant":
-                    chemical.mass = x / chemical.concentration
+            if nonnegative:
+                if np.shape(self.X) == (len(self.chemicals),):
+                    x0 = self.X
                 else:
-                    chemical.mass = x
+                    x0 = None
+                self.X, self.residual = solver.solve_nonnegative(self.A, X0=x0)
+                self.solver = None
+            else:
+                self.X = solver.solve(self.A)
+                self.residual = solver.residuals(self.A, self.X)
+                self.solver = solver
+            self.set_chemical_masses()
         except Exception as e:
             raise e
         else:
             self.calculated = True
 
-    def calculate_moles(self, session):
+    def calculate_masses_incremental(self, session):
         '''
-        Calculate the composition matrix by multiplying C = B * X
+        Update the masses of chemicals after the mole ratios of components
+        were changed.
+
+        Since [X] is linear in [C] the change of the composition is propagated
+        through the corresponding columns of the factorized B^T, which costs
+        O(n) per changed component. If the selection changed or the last
+        solution was not linear a full calculation is performed.
         '''
 
-        db = ctrl.DB()
+        solver = self.prepare_solver(session)
+        if not self.calculated or solver is not self.solver:
+            return self.calculate_masses(session)
 
-        if len(self.components) == 0:
-            raise ValueError("No Zeolite components selected")
+        A = self.get_A_matrix()
+        changed = np.nonzero(A != self.A)[0]
+        self.X = self.X + np.dot(solver.inverse[:, changed], A[changed] - self.A[changed])
+        self.A = A
+        self.residual = solver.residuals(self.A, self.X)
+        self.set_chemical_masses()
 
-        if len(self.chemicals) == 0:
-            raise ValueError("No chemicals selected")
+    def set_chemical_masses(self):
+        '''
+        Assign the masses of chemicals from the solution [X].
+        '''
 
-        for comp in self.components:
-            temp = db.get_chemicals(components=[comp])
-            if len(set([t.id for t in temp]) & set([r.id for r in self.chemicals])) == 0:
-                raise ValueError("some components need their sources: {0:s}".format(comp.name))
+        for chemical, x in zip(self.chemicals, self.X):
+            if chemical.kind == "reactant":
+                chemical.mass = x / chemical.concentration
+            else:
+                chemical.mass = x
+
+    def calculate_masses_batch(self, ratios, session, nonnegative=False):
+        '''
+        Solve the linear system B * X = C for many compositions at once.
+
+        All the compositions share the selected chemicals and components,
+        therefore the batch matrix [B] is factorized only once and all the
+        compositions are solved with a single matrix product. If `nonnegative`
+        is True the non-negative least squares solutions are found instead,
+        each one starting from the previous. The norms of the composition
+        errors are stored in `residual`.
+
+        Args:
+            ratios : array_like, shape (N, n_components)
+                Mole ratios of the components, one composition per row, with
+                the columns ordered as in `self.components`
+            session :
+                SQLAlchemy session
+            nonnegative : bool
+                Constrain the masses to non-negative values
+
+        Returns:
+            masses : numpy.ndarray, shape (N, n_chemicals)
+                Masses of the chemicals, one recipe per row, with the columns
+                ordered as in `self.chemicals`
+        '''
+
+        solver = self.prepare_solver(session)
+        self.B = solver.B.copy()
+
+        ratios = np.atleast_2d(ratios)
+        if nonnegative:
+            masses, self.residual = solver.masses_nonnegative(ratios)
+        else:
+            masses = solver.masses(ratios)
+            self.residual = solver.residuals(solver.component_masses(ratios),
+                                             masses * solver.concentrations)
+        return masses
+
+    def calculate_masses_scenarios(self, ratios, concentrations, session):
+        '''
+        Calculate the masses of the chemicals for varying concentrations of
+        the chemicals, e.g. for the different lots of a stock solution.
+
+        Only the rows of the batch matrix [B] that depend on the varied
+        concentrations are rebuilt and all the scenarios are solved at once.
+
+        Args:
+            ratios : array_like, shape (n_components,) or (N, n_components)
+                Mole ratios of the components with the columns ordered as in
+                `self.components`
+            concentrations : dict
+                Sequences of S concentrations keyed on the chemical id, the
+                chemicals not present keep their concentration, ValueError
+                is raised for the "mixture" kind chemicals
+            session :
+                SQLAlchemy session
+
+        Returns:
+            masses : numpy.ndarray, shape (S, n_chemicals) or (S, N, n_chemicals)
+                Masses of the chemicals in every scenario with the columns
+                ordered as in `self.chemicals`
+        '''
+
+        return core.calculate_masses_scenarios(self.chemicals, self.components,
+                                               ratios, concentrations,
+                                               Repository(session))
+
+    def sensitivity(self, session):
+        '''
+        Return the derivatives of the masses of the chemicals with respect to
+        the mole ratios of the components and the concentrations of the
+        chemicals at the current composition, see `core.sensitivity`.
+        '''
+
+        self.check_selection(session)
+        return core.sensitivity(self.chemicals, self.components,
+                                [c.moles for c in self.components],
+                                Repository(session))
+
+    def prepare_solver(self, session):
+        '''
+        Return the PreparedSolver for the current selection of chemicals and
+        components.
+
+        The solvers are cached together with the batch matrices so changing
+        only the mole ratios does not require a new factorization.
+        '''
+
+        return core.prepare_solver(self.chemicals, self.components,
+                                   Repository(session))
+
+    def calculate_moles(self, session):
+        '''
+        Calculate the composition matrix by multiplying C = B * X
+        '''
+
+        self.check_selection(session)
 
         masses = []
         for chemical in self.chemicals:
@@ -185,6 +306,60 @@ class BatchCalculator(object):
         else:
             self.calculated = True
 
+    def calculate_moles_batch(self, masses, session, reference=None, value=1.0):
+        '''
+        Calculate the moles of components for many recipes at once, e.g. the
+        weighings imported from a lab notebook, without modifying the
+        components.
+
+        Args:
+            masses : array_like, shape (N, n_chemicals)
+                Masses of the chemicals, one recipe per row, with the columns
+                ordered as in `self.chemicals`
+            session :
+                SQLAlchemy session
+            reference : Component or int
+                Component, or its index in `self.components`, the mole ratios
+                are normalized to, by default the ratios are the moles
+            value : float
+                Mole ratio of the reference component
+
+        Returns:
+            moles : numpy.ndarray, shape (N, n_components)
+                Moles of the components
+            ratios : numpy.ndarray, shape (N, n_components)
+                Mole ratios normalized to the reference component
+        '''
+
+        masses = np.atleast_2d(np.asarray(masses, dtype=float))
+        if masses.shape[1] != len(self.chemicals):
+            raise ValueError("expected {0:d} masses per recipe, got {1:d}".format(
+                             len(self.chemicals), masses.shape[1]))
+
+        self.check_selection(session)
+        moles = core.calculate_moles(self.chemicals, self.components, masses,
+                                     Repository(session))
+
+        if reference is None:
+            return moles, moles.copy()
+        if not isinstance(reference, numbers.Integral):
+            ids = [c.id for c in self.components]
+            if reference.id not in ids:
+                raise ValueError("component not selected: {0:s}".format(reference.name))
+            reference = ids.index(reference.id)
+        return moles, core.normalize_moles(moles, int(reference), value)
+
+    def composition_reader(self, session, **kwargs):
+        '''
+        Return a CompositionReader converting composition strings into mole
+        ratios of the selected components, in the order of `self.components`,
+        so the chunks can be passed directly to the solver from
+        `prepare_solver`. The keyword arguments are passed to the reader.
+        '''
+
+        return compositions.CompositionReader.from_session(
+            session, [c.id for c in self.components], **kwargs)
+
     def get_A_matrix(self):
         '''
         Compose the [A] matrix with masses of zeolite components.
@@ -193,85 +368,50 @@ class BatchCalculator(object):
         return np.asarray([z.moles * z.molwt for z in self.components],
                           dtype=float)
 
-    def get_B_matrix(self, session):
+    def selection_key(self, session):
         '''
-        Construct and return the batch matrix [B].
+        Return a hashable key identifying the database and the selection of
+        chemicals, components and concentrations.
         '''
 
-        B = np.zeros((len(self.chemicals), len(self.components)), dtype=float)
-
-        for i, chemical in enumerate(self.chemicals):
-            comps = session.query(Batch, Component).\
-                    filter(Batch.chemical_id == chemical.id).\
-                    filter(Component.id == Batch.component_id).all()
-            wfs = self.get_weight_fractions(i, comps, session)
-            for j, comp in enumerate(self.components):
-                for cid, wf in wfs:
-                    if comp.id == cid:
-                        B[i, j] = wf
-        return B
+        return core.selection_key(self.chemicals, self.components,
+                                  Repository(session))
 
-    def get_weight_fractions(self, rindex, comps, session):
+    def get_B_matrix(self, session):
         '''
-        Calculate the weight fractions corresponding to a specific reactant
-        and coupled zolite componts.
+        Construct and return the batch matrix [B].
 
-        lower case "m": mass in grmas
-        upper case "M": molecular weight [gram/mol]
+        The matrices are cached for each selection of chemicals, components
+        and concentrations, the cache is cleared whenever the database records
+        are modified.
         '''
 
-        res = []
-
-        if self.chemicals[rindex].kind == "mixture":
-            for batch, comp in comps:
-                res.append((comp.id, batch.coefficient))
-            return res
-
-        elif self.chemicals[rindex].kind == "solution":
-            if len(comps) > 2:
-                raise ValueError("cannot handle cases of zeoindexes > 2")
-
-            rct = self.chemicals[rindex]
-
-            h2o = session.query(Chemical).filter(Chemical.formula == "H2O").one()
-            M_solv = h2o.molwt
-
-            M_solu = rct.molwt
-
-            if abs(rct.concentration - 1.0) > 0.0001:
-                n_solu = M_solu * M_solv / (M_solv + (1.0 - rct.concentration) * M_solu / rct.concentration) / M_solu
-                n_solv = M_solu * M_solv / (M_solu + rct.concentration * M_solv / (1.0 - rct.concentration)) / M_solv
-            else:
-                n_solu = 1.0
-                n_solv = 0.0
+        return core.get_batch_matrix(self.chemicals, self.components,
+                                     Repository(session))
 
-            masses = list()
+    def build_B_matrix(self, session):
+        '''
+        Construct the batch matrix [B] from the database records.
+        '''
 
-            for batch, comp in comps:
-                if comp.formula != "H2O":
-                    masses.append(batch.coefficient * n_solu * comp.molwt)
-                else:
-                    masses.append((batch.coefficient * n_solu + n_solv) * comp.molwt)
+        return core.build_batch_matrix(self.chemicals, self.components,
+                                       Repository(session))
 
-            tot_mass = sum(masses)
-            for batch, comp in comps:
-                if comp.formula != "H2O":
-                    res.append((comp.id, batch.coefficient * n_solu * comp.molwt / tot_mass))
-                else:
-                    res.append((comp.id, (batch.coefficient * n_solu + n_solv) * comp.molwt / tot_mass))
-            return res
-
-        elif self.chemicals[rindex].kind == "reactant":
-            if len(comps) > 1:
-                tot_mass = sum([b.coefficient * c.molwt for b, c in comps])
-                for batch, comp in comps:
-                    res.append((comp.id, batch.coefficient * comp.molwt / tot_mass))
-            else:
-                res.append((comps[0][1].id, 1.0))
-            return res
+    def get_weight_fractions(self, rindex, comps, session):
+        '''
+        Calculate the weight fractions corresponding to a specific reactant
+        and coupled zolite componts given as a list of (Batch, Component)
+        tuples.
+        '''
 
+        chemical = self.chemicals[rindex]
+        rows = [core.BatchRecord(b.chemical_id, c.id, b.coefficient, c.formula, c.molwt)
+                for b, c in comps]
+        if chemical.kind == "solution":
+            water_molwt = Repository(session).water_molwt()
         else:
-            raise ValueError("Unknown chemical kind: {}".format(self.chemicals[rindex].kind))
+            water_molwt = None
+        return core.weight_fractions(chemical, rows, water_molwt)
 
     def rescale_all(self):
         '''
@@ -312,6 +452,50 @@ class BatchCalculator(object):
         res = [s.moles / self.item_scale for s in self.components]
         return res
 
+    def round_masses(self, session, precision=0.01, scale=1.0):
+        '''
+        Round the masses rescaled by `scale` to the balance `precision` in
+        grams and calculate the composition achieved with the rounded masses.
+
+        Returns:
+            RoundedRecipes with a single recipe, see `core.round_recipes`
+        '''
+
+        return core.round_recipes(self.prepare_solver(session),
+                                  [c.moles for c in self.components],
+                                  precision, scale)
+
+    def find_rounding_scale(self, session, scales, precision=0.01, max_mass=None):
+        '''
+        Find the scale factor among the candidate `scales` for which the
+        masses rounded to the balance `precision` give the smallest
+        composition error, e.g. to choose `scale_all` or the sample size.
+
+        The rounding error falls with the batch size, so without `max_mass`
+        the largest batch, i.e. the smallest scale factor, usually wins.
+
+        Args:
+            max_mass : float
+                Largest total mass of the rounded batch, the larger
+                candidates are skipped
+
+        Returns:
+            scale : float
+                Best scale factor
+            recipes : RoundedRecipes
+                Rounded recipes of all the candidates
+        '''
+
+        recipes = core.round_recipes(self.prepare_solver(session),
+                                     [c.moles for c in self.components],
+                                     precision, scales)
+        errors = recipes.errors
+        if max_mass is not None:
+            errors = np.where(recipes.masses.sum(axis=1) <= max_mass, errors, np.inf)
+            if np.all(np.isinf(errors)):
+                raise ValueError("no batch below the mass of {0} g".format(max_mass))
+        return recipes.scales[np.argmin(errors)], recipes
+
     def print_A(self):
         '''
         Print the components vector in a readable form.
@@ -348,14 +532,4 @@ class BatchCalculator(object):
         2-tuples.
         '''
 
-        cre = re.compile(r'(?P<nmol>(-?\d+\.\d+|-?\d+))?\s*(?P<formula>[A-Za-z0-9\(\)]+)')
-        result = []
-        for comp in string.replace(" ", "").split(delimiter):
-            m = cre.match(comp)
-            if m:
-                if m.group('nmol') is None:
-                    nmol = 1.0
-                else:
-                    nmol = float(m.group('nmol'))
-                result.append((m.group('formula'), nmol))
-        return result
+        return compositions.parse_composition(string, delimiter=delimiter)
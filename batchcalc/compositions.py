@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import csv
+import io
+import itertools
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import six
+from six.moves import intern
+
+from batchcalc.model import Component
+
+__version__ = "0.3.1"
+
+# single term of a composition string, e.g. "0.05Al2O3" or "SiO2"
+TERM = re.compile(r'(?P<nmol>(-?\d+\.\d+|-?\d+))?\s*(?P<formula>[A-Za-z0-9\(\)]+)')
+
+CompositionChunk = namedtuple("CompositionChunk", ["labels", "ratios", "valid"])
+
+# field delimiters of the supported file formats
+FORMATS = {"csv": ",", "tsv": "\t", "text": None}
+
+# interned unicode strings on Python 2, where `intern` only accepts bytes
+_interned = {}
+
+
+def _intern(string):
+    '''
+    Return the interned copy of the `string`.
+    '''
+
+    try:
+        return intern(string)
+    except TypeError:
+        return _interned.setdefault(string, string)
+
+
+def _decode(field):
+    '''
+    Decode the fields read by the Python 2 csv module, which works on bytes.
+    '''
+
+    return field.decode("utf-8") if isinstance(field, bytes) else field
+
+
+def parse_composition(string, delimiter=':'):
+    '''
+    Parse a string corresponding to the zeolite composition, e.g.
+    "1.0SiO2 : 0.05Al2O3 : 30H2O", into a list of (formula, moles) tuples.
+    Terms that do not match the grammar are skipped.
+    '''
+
+    result = []
+    for term in string.replace(" ", "").split(delimiter):
+        m = TERM.match(term)
+        if m:
+            if m.group('nmol') is None:
+                nmol = 1.0
+            else:
+                nmol = float(m.group('nmol'))
+            result.append((m.group('formula'), nmol))
+    return result
+
+
+def component_lookup(session):
+    '''
+    Return the dictionary mapping the formulas and short names of all the
+    components to their ids, the lowest id wins for repeated formulas and
+    the formulas take precedence over the short names.
+    '''
+
+    lookup = {}
+    query = session.query(Component.id, Component.formula, Component.short_name).\
+        order_by(Component.id.desc())
+    rows = query.all()
+    for cid, formula, short_name in rows:
+        if not Component.is_undefined(short_name):
+            lookup[_intern(short_name)] = cid
+    for cid, formula, short_name in rows:
+        lookup[_intern(formula)] = cid
+    return lookup
+
+
+class CompositionReader(object):
+    '''
+    Read composition strings in bulk and convert them into arrays of mole
+    ratios ready to be solved for the masses of chemicals.
+
+    The formulas are resolved to the columns once, through an interned
+    table, so the cost per string is a regular expression match and a
+    dictionary lookup per term.
+
+    Args:
+        lookup : dict
+            Formulas and short names mapped to the component ids, as returned
+            by `component_lookup`
+        component_ids : list of int
+            Ids of the components defining the columns of the ratio arrays,
+            e.g. the components selected in the calculator
+        delimiter : str
+            Separator of the terms in the composition strings
+        strict : bool
+            If True a ValueError is raised for strings with unknown formulas,
+            otherwise such rows are marked as invalid
+        chunksize : int
+            Maximal number of compositions per chunk
+    '''
+
+    def __init__(self, lookup, component_ids, delimiter=':', strict=True,
+                 chunksize=10000):
+
+        self.lookup = lookup
+        self.component_ids = list(component_ids)
+        self.delimiter = delimiter
+        self.strict = strict
+        self.chunksize = chunksize
+        self._index = dict((cid, j) for j, cid in enumerate(self.component_ids))
+        # formula -> column index, None for the formulas not in the columns
+        self._columns = {}
+
+    @classmethod
+    def from_session(cls, session, component_ids, **kwargs):
+        '''
+        Create the reader with the lookup of all the components stored in the
+        database the `session` is bound to.
+        '''
+
+        return cls(component_lookup(session), component_ids, **kwargs)
+
+    def column(self, formula):
+        '''
+        Return the column index of the `formula` or None if it does not
+        correspond to any of the selected components.
+        '''
+
+        try:
+            return self._columns[formula]
+        except KeyError:
+            cid = self.lookup.get(formula)
+            column = self._index.get(cid) if cid is not None else None
+            self._columns[_intern(formula)] = column
+            return column
+
+    def parse(self, string, out):
+        '''
+        Parse the composition `string` into the row `out` of mole ratios.
+
+        Returns:
+            valid : bool
+                False if the string has no terms or some of its formulas are
+                not selected components
+        '''
+
+        valid = True
+        nterms = 0
+        for term in string.replace(" ", "").split(self.delimiter):
+            m = TERM.match(term)
+            if m is None:
+                continue
+            nterms += 1
+            column = self.column(m.group('formula'))
+            if column is None:
+                if self.strict:
+                    raise ValueError("unknown component '{0:s}' in '{1:s}'".format(
+                                     m.group('formula'), string.strip()))
+                valid = False
+                continue
+            nmol = m.group('nmol')
+            out[column] += 1.0 if nmol is None else float(nmol)
+        if nterms == 0:
+            if self.strict:
+                raise ValueError("no composition in '{0:s}'".format(string.strip()))
+            valid = False
+        return valid
+
+    def iter_chunks(self, records):
+        '''
+        Convert an iterable of (label, composition string) pairs into chunks.
+
+        Yields:
+            CompositionChunk with the labels, mole ratios with the columns
+            ordered as `component_ids` and a boolean array flagging the rows
+            parsed without errors
+        '''
+
+        records = iter(records)
+        while True:
+            block = list(itertools.islice(records, self.chunksize))
+            if len(block) == 0:
+                return
+            ratios = np.zeros((len(block), len(self.component_ids)), dtype=float)
+            valid = np.ones(len(block), dtype=bool)
+            for i, (label, string) in enumerate(block):
+                valid[i] = self.parse(string, ratios[i])
+            ratios[~valid] = np.nan
+            yield CompositionChunk([label for label, _ in block], ratios, valid)
+
+    def read(self, source, fmt=None, column=0, label=None):
+        '''
+        Read the compositions from a CSV, TSV or plain text file in chunks,
+        the file is never loaded into memory as a whole.
+
+        Args:
+            source : str or file
+                Path or an open text file
+            fmt : str
+                One of "csv", "tsv" or "text", by default guessed from the
+                file extension with plain text as the fallback
+            column : int or str
+                Index or header name of the column with the composition
+                strings, ignored for plain text
+            label : int or str
+                Index or header name of the column with the labels of the
+                rows, by default the line numbers are used
+
+        Yields:
+            CompositionChunk
+        '''
+
+        if fmt is None:
+            name = source if not hasattr(source, "read") else getattr(source, "name", "")
+            fmt = os.path.splitext(name or "")[1].lstrip(".").lower()
+            fmt = fmt if fmt in FORMATS else "text"
+        if fmt not in FORMATS:
+            raise ValueError("unknown format: {0:s}".format(fmt))
+
+        if hasattr(source, "read"):
+            for chunk in self.iter_chunks(self._records(source, fmt, column, label)):
+                yield chunk
+        elif six.PY2 and FORMATS[fmt] is not None:
+            # the Python 2 csv module reads bytes, the fields are decoded
+            with io.open(source, "rb") as fobj:
+                for chunk in self.iter_chunks(self._records(fobj, fmt, column, label)):
+                    yield chunk
+        else:
+            with io.open(source, "r", encoding="utf-8", newline="") as fobj:
+                for chunk in self.iter_chunks(self._records(fobj, fmt, column, label)):
+                    yield chunk
+
+    @staticmethod
+    def _records(fobj, fmt, column, label):
+        '''
+        Generate the (label, composition string) pairs from an open file.
+        '''
+
+        if FORMATS[fmt] is None:
+            for lineno, line in enumerate(fobj, start=1):
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield lineno, line
+            return
+
+        reader = (list(map(_decode, row))
+                  for row in csv.reader(fobj, delimiter=str(FORMATS[fmt])))
+        header = None
+        if not isinstance(column, int) or (label is not None and not isinstance(label, int)):
+            header = next(reader)
+            if not isinstance(column, int):
+                column = header.index(column)
+            if label is not None and not isinstance(label, int):
+                label = header.index(label)
+        start = 2 if header is not None else 1
+        for lineno, row in enumerate(reader, start=start):
+            if len(row) <= column or not row[column].strip():
+                continue
+            yield (lineno if label is None else row[label]), row[column]
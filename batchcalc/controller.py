@@ -38,9 +38,11 @@ import sys
 from collections import OrderedDict
 
 from ObjectListView import ObjectListView
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from batchcalc import cache
+from batchcalc.database import dispose_engines, get_scoped_session
 from batchcalc import dialogs
+from batchcalc import formula
+from batchcalc import syntheses
 from batchcalc.model import (Chemical, Component, Electrolyte, Kind, Category,
                              Reaction, PhysicalForm, Batch, Synthesis,
                              SynthesisComponent, SynthesisChemical)
@@ -65,11 +67,11 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-class DB(object):
-    __metaclass__ = Singleton
+class DB(Singleton(str("SingletonBase"), (object,), {})):
 
     def __init__(self):
 
+        self.path = self.dbpath
         self.session = self.get_session()
 
     @property
@@ -82,28 +84,35 @@ class DB(object):
 
     def get_session(self):
         '''
-        When the new database is chosen, close the old session and establish a
-        new one.
+        Return the session of the current thread bound to the current
+        database.
         '''
 
-        engine = create_engine("sqlite:///{path:s}".format(path=self.dbpath),
-                               echo=False)
-        Session = sessionmaker(bind=engine, expire_on_commit=False,
-                               autoflush=False)
-        return Session()
+        return get_scoped_session(self.path)()
+
+    def get_scoped_session(self):
+        '''
+        Return the `scoped_session` registry of the current database, worker
+        threads should call it to get their own session and call its
+        `remove` method when done.
+        '''
+
+        return get_scoped_session(self.path)
 
     def switch_session(self, dbpath):
+        '''
+        Switch to the database at `dbpath`, the engines and sessions are
+        reused if the database was already opened and the cached data is
+        keyed on the database so it does not have to be cleared.
+        '''
 
         try:
             self.session.close()
         except:
             pass
 
-        engine = create_engine("sqlite:///{path:s}".format(path=dbpath),
-                               echo=False)
-        Session = sessionmaker(bind=engine, expire_on_commit=False,
-                               autoflush=False)
-        self.session = Session()
+        self.path = dbpath
+        self.session = self.get_session()
 
     def get_batches(self):
         '''
@@ -350,6 +359,7 @@ class AddModifyBatchRecordDialog(wx.Dialog):
 
         self.txtc_coeff = wx.TextCtrl(self.panel, -1, value=v_coeff,
                                       size=(50, 20))
+        self.suggested_coeff = ""
 
         chemicals = self.db.get_chemicals(showall=True)
         components = self.db.get_components()
@@ -363,6 +373,9 @@ class AddModifyBatchRecordDialog(wx.Dialog):
         self.ch_component = wx.Choice(self.panel, -1, (50, 20), choices=[x.name[:35] for x in components])
         self.ch_reaction = wx.Choice(self.panel, -1, (50, 20), choices=[x.reaction[:70] for x in reactions])
 
+        self.ch_chemical.Bind(wx.EVT_CHOICE, self.OnSuggestCoefficient)
+        self.ch_component.Bind(wx.EVT_CHOICE, self.OnSuggestCoefficient)
+
         if record is not None:
             if self.record.chemical is not None:
                 self.ch_chemical.SetStringSelection(self.record.chemical)
@@ -401,6 +414,30 @@ class AddModifyBatchRecordDialog(wx.Dialog):
         sizer.AddGrowableCol(2)
         self.panel.SetSizerAndFit(sizer)
 
+    def OnSuggestCoefficient(self, event):
+        '''
+        Fill in the coefficient derived from the element balance of the
+        selected chemical unless it was typed in by hand. The coefficients
+        of the "mixture" kind chemicals are weight fractions and are not
+        suggested.
+        '''
+
+        if self.txtc_coeff.GetValue() not in ("", self.suggested_coeff):
+            return
+        self.suggested_coeff = ""
+        if self.ch_chemical.GetSelection() >= 0 and self.ch_component.GetSelection() >= 0:
+            chemical = self.chemicals[self.ch_chemical.GetSelection()]
+            component_id = self.components[self.ch_component.GetSelection()].id
+            if chemical.kind != "mixture":
+                try:
+                    proposal = formula.propose_batches(self.db.session, [chemical.id])[0]
+                except (ValueError, IndexError):
+                    proposal = None
+                if proposal is not None and component_id in proposal.component_ids:
+                    coefficient = proposal.coefficients[proposal.component_ids.index(component_id)]
+                    self.suggested_coeff = "{0:6.2f}".format(coefficient)
+        self.txtc_coeff.ChangeValue(self.suggested_coeff)
+
     def OnSaveRecord(self, event):
 
         if self.add_record:
@@ -488,6 +525,18 @@ class AddModifyBatchRecordDialog(wx.Dialog):
         self.Destroy()
 
 
+def formula_molwt(text):
+    '''
+    Return the molecular weight computed from the formula `text` formatted
+    for the TextCtrl's or an empty string if the formula cannot be parsed.
+    '''
+
+    try:
+        return "{0:8.4f}".format(formula.molecular_weight(text))
+    except ValueError:
+        return ""
+
+
 class AddModifyChemicalRecordDialog(wx.Dialog):
 
     def __init__(self, parent, record=None, title="Add",
@@ -552,6 +601,8 @@ class AddModifyChemicalRecordDialog(wx.Dialog):
         self.txtc_name = wx.TextCtrl(self.panel, -1, v_name)
         self.txtc_formula = wx.TextCtrl(self.panel, -1, v_formula)
         self.txtc_molwt = wx.TextCtrl(self.panel, -1, v_molwt, style=wx.TE_RIGHT)
+        self.computed_molwt = formula_molwt(v_formula)
+        self.txtc_formula.Bind(wx.EVT_TEXT, self.OnFormulaChanged)
         self.txtc_shname = wx.TextCtrl(self.panel, -1, v_short_name)
         self.txtc_conc = wx.TextCtrl(self.panel, -1, v_concentration)
         self.txtc_cas = wx.TextCtrl(self.panel, -1, v_cas)
@@ -635,6 +686,17 @@ class AddModifyChemicalRecordDialog(wx.Dialog):
         sizer.AddGrowableCol(1)
         self.panel.SetSizerAndFit(sizer)
 
+    def OnFormulaChanged(self, event):
+        '''
+        Fill in the molecular weight computed from the formula unless it was
+        typed in by hand.
+        '''
+
+        automatic = self.txtc_molwt.GetValue() in ("", self.computed_molwt)
+        self.computed_molwt = formula_molwt(self.txtc_formula.GetValue())
+        if automatic:
+            self.txtc_molwt.ChangeValue(self.computed_molwt)
+
     def is_empty(self, textctrl, message):
 
         if len(textctrl.GetValue()) == 0:
@@ -805,6 +867,8 @@ class AddModifyComponentRecordDialog(wx.Dialog):
         self.txtc_name = wx.TextCtrl(self.panel, -1, v_name)
         self.txtc_formula = wx.TextCtrl(self.panel, -1, v_formula)
         self.txtc_molwt = wx.TextCtrl(self.panel, -1, v_molwt)
+        self.computed_molwt = formula_molwt(v_formula)
+        self.txtc_formula.Bind(wx.EVT_TEXT, self.OnFormulaChanged)
         self.txtc_shname = wx.TextCtrl(self.panel, -1, v_shname)
 
         categ = self.db.get_categories()
@@ -851,6 +915,17 @@ class AddModifyComponentRecordDialog(wx.Dialog):
         sizer.AddGrowableCol(1)
         self.panel.SetSizerAndFit(sizer)
 
+    def OnFormulaChanged(self, event):
+        '''
+        Fill in the molecular weight computed from the formula unless it was
+        typed in by hand.
+        '''
+
+        automatic = self.txtc_molwt.GetValue() in ("", self.computed_molwt)
+        self.computed_molwt = formula_molwt(self.txtc_formula.GetValue())
+        if automatic:
+            self.txtc_molwt.ChangeValue(self.computed_molwt)
+
     def is_empty(self, textctrl, message):
 
         if len(textctrl.GetValue()) == 0:
@@ -1303,6 +1378,37 @@ def add_batch_record(session, data):
     batch = Batch(**data)
     session.add(batch)
     session.commit()
+    cache.invalidate()
+
+
+def add_derived_batch_records(session, statuses=("exact",), maxsize=3):
+    """
+    Derive the Batch records from the element balances for all the chemicals
+    that are not mixtures and have no Batch records yet. Only the proposals
+    with the status in `statuses` are added, the remaining ones are returned
+    and have to be entered by hand.
+    """
+
+    existing = set(cid for (cid,) in session.query(Batch.chemical_id).distinct())
+    chemical_ids = [cid for (cid,) in session.query(Chemical.id).
+                    join(Kind, Chemical._kind_id == Kind.id).
+                    filter(Kind.name != "mixture") if cid not in existing]
+    if len(chemical_ids) == 0:
+        return []
+
+    rejected = []
+    for proposal in formula.propose_batches(session, chemical_ids, maxsize=maxsize):
+        if proposal.status not in statuses:
+            rejected.append(proposal)
+            continue
+        for component_id, coefficient in zip(proposal.component_ids,
+                                             proposal.coefficients):
+            session.add(Batch(chemical_id=proposal.chemical_id,
+                              component_id=component_id,
+                              coefficient=coefficient))
+    session.commit()
+    cache.invalidate()
+    return rejected
 
 
 def delete_batch_record(session, id_num):
@@ -1313,6 +1419,7 @@ def delete_batch_record(session, id_num):
     batch = session.query(Batch).get(id_num)
     session.delete(batch)
     session.commit()
+    cache.invalidate()
 
 
 def modify_batch_record(session, id_num, data):
@@ -1330,6 +1437,7 @@ def modify_batch_record(session, id_num, data):
         batch._reaction = session.query(Reaction).get(data['reaction_id'])
     session.add(batch)
     session.commit()
+    cache.invalidate()
 
 
 # Chemical controller methods
@@ -1368,6 +1476,7 @@ def add_chemical_record(session, data):
 
     session.add(chemical)
     session.commit()
+    cache.invalidate()
 
 
 def delete_chemical_record(session, id_num):
@@ -1378,6 +1487,7 @@ def delete_chemical_record(session, id_num):
     chemical = session.query(Chemical).get(id_num)
     session.delete(chemical)
     session.commit()
+    cache.invalidate()
 
 
 def modify_chemical_record(session, id_num, data):
@@ -1410,6 +1520,7 @@ def modify_chemical_record(session, id_num, data):
 
     session.add(chemical)
     session.commit()
+    cache.invalidate()
 
 
 # Compoment controller methods
@@ -1435,6 +1546,7 @@ def add_component_record(session, data):
 
     session.add(component)
     session.commit()
+    cache.invalidate()
 
 
 def delete_component_record(session, id_num):
@@ -1445,6 +1557,7 @@ def delete_component_record(session, id_num):
     component = session.query(Component).get(id_num)
     session.delete(component)
     session.commit()
+    cache.invalidate()
 
 
 def modify_component_record(session, id_num, data):
@@ -1466,6 +1579,7 @@ def modify_component_record(session, id_num, data):
 
     session.add(component)
     session.commit()
+    cache.invalidate()
 
 
 # Reaction controller methods
@@ -1552,6 +1666,7 @@ def add_kind_record(session, data):
     kind = Kind(name=data)
     session.add(kind)
     session.commit()
+    cache.invalidate()
 
 
 def delete_kind_record(session, id_num):
@@ -1562,6 +1677,7 @@ def delete_kind_record(session, id_num):
     kind = session.query(Kind).get(id_num)
     session.delete(kind)
     session.commit()
+    cache.invalidate()
 
 
 def modify_kind_record(session, id_num, data):
@@ -1573,6 +1689,7 @@ def modify_kind_record(session, id_num, data):
     kind.name = data
     session.add(kind)
     session.commit()
+    cache.invalidate()
 
 
 # Physical_forms controller methods
@@ -1681,6 +1798,8 @@ def add_synthesis_record(session, data):
         synth.components = data['components']
     session.add(synth)
     session.commit()
+    cache.invalidate_syntheses()
+    syntheses.update_index(session, synth)
 
 
 def modify_synthesis_record(session, id_num, data):
@@ -1695,6 +1814,8 @@ def modify_synthesis_record(session, id_num, data):
 
     session.add(synth)
     session.commit()
+    cache.invalidate_syntheses()
+    syntheses.update_index(session, synth)
 
 
 def delete_synthesis_record(session, id_num):
@@ -1705,3 +1826,5 @@ def delete_synthesis_record(session, id_num):
     synth = session.query(Synthesis).get(id_num)
     session.delete(synth)
     session.commit()
+    cache.invalidate_syntheses()
+    syntheses.remove_from_index(session, id_num)
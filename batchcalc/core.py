@@ -0,0 +1,889 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+from collections import namedtuple
+
+from numpy.linalg import inv, pinv
+import numpy as np
+
+from batchcalc import cache
+
+__version__ = "0.3.1"
+
+
+# plain data counterparts of the database records used in the calculation,
+# any objects with the same attributes (e.g. the ORM objects) can be used
+ChemicalRecord = namedtuple("ChemicalRecord", ["id", "name", "kind", "concentration", "molwt"])
+ComponentRecord = namedtuple("ComponentRecord", ["id", "name", "formula", "molwt"])
+BatchRecord = namedtuple("BatchRecord", ["chemical_id", "component_id", "coefficient", "formula", "molwt"])
+
+# derivatives of the masses of chemicals with respect to the mole ratios of
+# the components and the concentrations of the chemicals
+Sensitivity = namedtuple("Sensitivity", ["ratios", "concentrations"])
+
+# recipes rounded to the balance precision for a number of scale factors
+# with the achieved and target mole ratios and the composition errors
+RoundedRecipes = namedtuple("RoundedRecipes", ["scales", "masses", "achieved", "target", "errors"])
+
+
+class PreparedSolver(object):
+    '''
+    Solver of the batch equations B * X = C for a fixed batch matrix [B].
+
+    The matrix B^T is factorized once on construction, the inverse is stored
+    for a square batch matrix and the pseudo-inverse, giving the least squares
+    solution, otherwise. Solving for any number of compositions then costs a
+    single matrix product.
+
+    Args:
+        B : numpy.ndarray, shape (n_chemicals, n_components)
+            Batch matrix
+        molwts : array_like, shape (n_components,)
+            Molecular weights of the components
+        concentrations : array_like, shape (n_chemicals,)
+            Factors converting the solution [X] into masses of chemicals
+    '''
+
+    def __init__(self, B, molwts, concentrations):
+
+        self.B = np.asarray(B, dtype=float)
+        self.molwts = np.asarray(molwts, dtype=float)
+        self.concentrations = np.asarray(concentrations, dtype=float)
+
+        self.square = self.B.shape[0] == self.B.shape[1]
+        if self.square:
+            self.inverse = inv(np.transpose(self.B))
+        else:
+            self.inverse = pinv(np.transpose(self.B))
+
+    def solve(self, A):
+        '''
+        Return the solution [X] for the masses of components `A`, either a
+        single vector of shape (n_components,) or an array of shape
+        (N, n_components) with one composition per row.
+        '''
+
+        return np.dot(A, np.transpose(self.inverse))
+
+    def masses(self, ratios):
+        '''
+        Return the masses of chemicals for the mole ratios of components
+        `ratios`, of shape (n_components,) or (N, n_components).
+        '''
+
+        return self.solve(self.component_masses(ratios)) / self.concentrations
+
+    def moles(self, masses):
+        '''
+        Return the mole ratios of components achieved by the masses of
+        chemicals `masses`, of shape (n_chemicals,) or (N, n_chemicals).
+        '''
+
+        X = np.asarray(masses, dtype=float) * self.concentrations
+        return np.dot(X, self.B) / self.molwts
+
+    def component_masses(self, ratios):
+        '''
+        Return the masses of components [C] for the mole ratios `ratios`.
+        '''
+
+        ratios = np.asarray(ratios, dtype=float)
+        if ratios.shape[-1] != self.molwts.size:
+            raise ValueError("expected {0:d} mole ratios per composition, got {1:d}".format(
+                             self.molwts.size, ratios.shape[-1]))
+        return ratios * self.molwts
+
+    def residuals(self, A, X):
+        '''
+        Return the norms of the residuals B^T * X - A, the composition error
+        in grams, for the solutions `X` of the component masses `A`.
+        '''
+
+        return np.linalg.norm(np.dot(X, self.B) - A, axis=-1)
+
+    def solve_nonnegative(self, A, X0=None):
+        '''
+        Return the non-negative least squares solution [X] and the norms of
+        the residuals for the masses of components `A` of shape
+        (n_components,) or (N, n_components).
+
+        Each composition is started from the solution of the previous one or
+        from `X0` for the first one, so neighbouring points of a sweep
+        converge in a few iterations.
+        '''
+
+        A = np.asarray(A, dtype=float)
+        BT = np.transpose(self.B)
+
+        X = np.zeros(A.shape[:-1] + (self.B.shape[0],))
+        rnorms = np.zeros(A.shape[:-1])
+        x = X0
+        for i in np.ndindex(*A.shape[:-1]):
+            x, rnorms[i] = nnls(BT, A[i], x0=x)
+            X[i] = x
+        return X, rnorms
+
+    def masses_nonnegative(self, ratios, masses0=None):
+        '''
+        Return the non-negative masses of chemicals and the norms of the
+        residuals for the mole ratios of components `ratios`, of shape
+        (n_components,) or (N, n_components).
+
+        `masses0` is an optional starting point, e.g. the previous solution.
+        '''
+
+        if masses0 is not None:
+            masses0 = np.asarray(masses0, dtype=float) * self.concentrations
+        X, rnorms = self.solve_nonnegative(self.component_masses(ratios), X0=masses0)
+        return X / self.concentrations, rnorms
+
+
+def nnls(A, b, x0=None, maxiter=None):
+    '''
+    Solve the non-negative least squares problem min ||A * x - b|| subject to
+    x >= 0 using the Lawson-Hanson active set method.
+
+    Args:
+        A : numpy.ndarray, shape (m, n)
+        b : numpy.ndarray, shape (m,)
+        x0 : numpy.ndarray, shape (n,)
+            Starting point, the positive entries define the initial passive
+            set, which usually saves most of the iterations when solving a
+            sequence of similar problems
+        maxiter : int
+            Maximal number of iterations, 3 * n by default
+
+    Returns:
+        (x, rnorm) : solution and the norm of the residual
+    '''
+
+    A = np.asarray(A, dtype=float)
+    b = np.asarray(b, dtype=float)
+    n = A.shape[1]
+
+    if maxiter is None:
+        maxiter = 3 * n
+    tol = 10.0 * np.finfo(float).eps * np.abs(A).sum(axis=0).max() * max(A.shape)
+
+    def lsq(passive):
+        z = np.zeros(n)
+        if passive.any():
+            z[passive] = np.linalg.lstsq(A[:, passive], b)[0]
+        return z
+
+    def restore_feasibility(x, z, passive):
+        # move from the feasible x towards z until the passive set is feasible
+        for _ in range(maxiter):
+            neg = passive & (z <= tol)
+            if not neg.any():
+                break
+            alpha = np.min(x[neg] / (x[neg] - z[neg]))
+            x = x + alpha * (z - x)
+            passive = passive & (x > tol)
+            z = lsq(passive)
+        return z, passive
+
+    if x0 is None:
+        x = np.zeros(n)
+        passive = np.zeros(n, dtype=bool)
+    else:
+        x = np.maximum(np.asarray(x0, dtype=float), 0.0)
+        passive = x > tol
+        x, passive = restore_feasibility(x, lsq(passive), passive)
+
+    w = np.dot(A.T, b - np.dot(A, x))
+    for _ in range(maxiter):
+        if passive.all() or np.max(w[~passive]) <= tol:
+            break
+        passive[np.argmax(np.where(passive, -np.inf, w))] = True
+        x, passive = restore_feasibility(x, lsq(passive), passive)
+        w = np.dot(A.T, b - np.dot(A, x))
+
+    return x, np.linalg.norm(np.dot(A, x) - b)
+
+
+def check_sources(components, chemicals, sources):
+    '''
+    Check if the components and chemicals are selected and if all the
+    components have their sources among the chemicals.
+
+    Args:
+        components : list
+            Selected components
+        chemicals : list
+            Selected chemicals
+        sources : dict
+            Ids of the chemicals being sources of a component keyed on the
+            component id
+    '''
+
+    if len(components) == 0:
+        raise ValueError("No Zeolite components selected")
+
+    if len(chemicals) == 0:
+        raise ValueError("No chemicals selected")
+
+    chemids = set(c.id for c in chemicals)
+    missing = [comp.name for comp in components
+               if len(sources.get(comp.id, frozenset()) & chemids) == 0]
+    if len(missing) > 0:
+        raise ValueError("some components need their sources: {0:s}".format(", ".join(missing)))
+
+
+def concentration_vector(chemicals):
+    '''
+    Return the factors converting the solution [X] into the masses of
+    chemicals, the concentration for reactants and 1.0 otherwise.
+    '''
+
+    return np.asarray([c.concentration if c.kind == "reactant" else 1.0
+                       for c in chemicals], dtype=float)
+
+
+def mixture_fractions(coefficients):
+    '''
+    Weight fractions of the "mixture" kind chemicals, the coefficients of the
+    batch records are the weight fractions.
+
+    Args:
+        coefficients : numpy.ndarray, shape (n_rows,)
+            Coefficients of the batch records
+
+    Returns:
+        numpy.ndarray, shape (n_rows,)
+    '''
+
+    return np.asarray(coefficients, dtype=float).copy()
+
+
+def solution_fractions(owner, coefficients, molwts, water, concentrations,
+                       solute_molwts, water_molwt):
+    '''
+    Weight fractions of the "solution" kind chemicals, the solute with the
+    molecular weight M_solu is dissolved in water with the molecular weight
+    M_solv at the weight fraction given by the concentration. Any number of
+    components per chemical is supported.
+
+    lower case "n": moles per mole of the solute
+    upper case "M": molecular weight [gram/mol]
+
+    Args:
+        owner : numpy.ndarray of int, shape (n_rows,)
+            Index of the chemical of every batch record
+        coefficients : numpy.ndarray, shape (n_rows,)
+            Coefficients of the batch records
+        molwts : numpy.ndarray, shape (n_rows,)
+            Molecular weights of the components of the batch records
+        water : numpy.ndarray of bool, shape (n_rows,)
+            True for the batch records of water as a component
+        concentrations : numpy.ndarray, shape (n_chemicals,)
+            Weight fractions of the solutes
+        solute_molwts : numpy.ndarray, shape (n_chemicals,)
+            Molecular weights of the solutes
+        water_molwt : float
+            Molecular weight of water
+
+    Returns:
+        numpy.ndarray, shape (n_rows,)
+    '''
+
+    conc = np.asarray(concentrations, dtype=float)
+    M_solu = np.asarray(solute_molwts, dtype=float)
+    M_solv = water_molwt
+
+    pure = np.abs(conc - 1.0) <= 0.0001
+    # the pure solutes are given a dummy concentration to avoid division by
+    # zero, the results are replaced below
+    c = np.where(pure, 0.5, conc)
+    n_solu = M_solv / (M_solv + (1.0 - c) * M_solu / c)
+    n_solv = M_solu / (M_solu + c * M_solv / (1.0 - c))
+    n_solu[pure] = 1.0
+    n_solv[pure] = 0.0
+
+    owner = np.asarray(owner, dtype=int)
+    masses = (np.asarray(coefficients, dtype=float) * n_solu[owner] +
+              np.where(water, n_solv[owner], 0.0)) * molwts
+    totals = np.bincount(owner, weights=masses, minlength=len(conc))
+    return masses / totals[owner]
+
+
+def solution_fraction_derivatives(owner, coefficients, molwts, water,
+                                  concentrations, solute_molwts, water_molwt):
+    '''
+    Derivatives of the weight fractions of the "solution" kind chemicals with
+    respect to their concentrations, the arguments are the same as for
+    `solution_fractions`.
+
+    With a = b * M_solv * M and w = [H2O] * M_solu * M for the batch records,
+    P = sum(b * M) * M_solv and Q = sum([H2O] * M) * M_solu for the chemicals
+    the weight fractions are (a c + w (1 - c)) / (P c + Q (1 - c)) and the
+    derivatives (a Q - w P) / (P c + Q (1 - c))**2.
+
+    Returns:
+        numpy.ndarray, shape (n_rows,)
+    '''
+
+    conc = np.asarray(concentrations, dtype=float)
+    M_solu = np.asarray(solute_molwts, dtype=float)
+    M_solv = water_molwt
+
+    owner = np.asarray(owner, dtype=int)
+    molwts = np.asarray(molwts, dtype=float)
+    solute = np.asarray(coefficients, dtype=float) * molwts
+    solvent = np.where(water, molwts, 0.0)
+
+    P = np.bincount(owner, weights=solute, minlength=len(conc)) * M_solv
+    Q = np.bincount(owner, weights=solvent, minlength=len(conc)) * M_solu
+    denom = P * conc + Q * (1.0 - conc)
+
+    a = solute * M_solv
+    w = solvent * M_solu[owner]
+    return (a * Q[owner] - w * P[owner]) / denom[owner]**2
+
+
+def reactant_fractions(owner, coefficients, molwts):
+    '''
+    Weight fractions of the "reactant" kind chemicals, the coefficients of the
+    batch records are the moles of the components per mole of the chemical.
+
+    Args:
+        owner : numpy.ndarray of int, shape (n_rows,)
+            Index of the chemical of every batch record
+        coefficients : numpy.ndarray, shape (n_rows,)
+            Coefficients of the batch records
+        molwts : numpy.ndarray, shape (n_rows,)
+            Molecular weights of the components of the batch records
+
+    Returns:
+        numpy.ndarray, shape (n_rows,)
+    '''
+
+    owner = np.asarray(owner, dtype=int)
+    masses = np.asarray(coefficients, dtype=float) * molwts
+    totals = np.bincount(owner, weights=masses)
+    counts = np.bincount(owner)
+    # a single component is the whole chemical irrespective of the coefficient
+    return np.where(counts[owner] == 1, 1.0, masses / totals[owner])
+
+
+def fraction_arrays(chemicals, rows, water_molwt=None):
+    '''
+    Calculate the weight fractions of all the `chemicals` with a single pass
+    of the kernel of each kind.
+
+    Args:
+        chemicals : list
+            Chemicals with the `id`, `kind`, `concentration` and `molwt`
+            attributes
+        rows : dict
+            Lists of BatchRecord keyed on the chemical id
+        water_molwt : float
+            Molecular weight of water, required for the "solution" kind
+
+    Returns:
+        owner : numpy.ndarray of int
+            Index of the chemical of every weight fraction
+        component_ids : numpy.ndarray of int
+            Component id of every weight fraction
+        fractions : numpy.ndarray
+            Weight fractions
+    '''
+
+    owner, cids, coefs, molwts, water = [], [], [], [], []
+    for i, chemical in enumerate(chemicals):
+        if chemical.kind not in ("mixture", "solution", "reactant"):
+            raise ValueError("Unknown chemical kind: {}".format(chemical.kind))
+        for row in rows.get(chemical.id, []):
+            owner.append(i)
+            cids.append(row.component_id)
+            coefs.append(row.coefficient)
+            molwts.append(row.molwt)
+            water.append(row.formula == "H2O")
+
+    owner = np.array(owner, dtype=int)
+    coefs = np.array(coefs, dtype=float)
+    molwts = np.array(molwts, dtype=float)
+    water = np.array(water, dtype=bool)
+    fractions = np.zeros(len(owner), dtype=float)
+
+    kinds = np.array([c.kind for c in chemicals])
+    for kind in set(kinds):
+        # chemicals of the kind and their batch records, the chemicals are
+        # renumbered consecutively for the kernel
+        chemidx = np.flatnonzero(kinds == kind)
+        sel = np.flatnonzero(kinds[owner] == kind)
+        local = np.searchsorted(chemidx, owner[sel])
+        if kind == "mixture":
+            fractions[sel] = mixture_fractions(coefs[sel])
+        elif kind == "solution":
+            fractions[sel] = solution_fractions(
+                local, coefs[sel], molwts[sel], water[sel],
+                [chemicals[i].concentration for i in chemidx],
+                [chemicals[i].molwt for i in chemidx], water_molwt)
+        else:
+            fractions[sel] = reactant_fractions(local, coefs[sel], molwts[sel])
+
+    return owner, np.array(cids, dtype=int), fractions
+
+
+def weight_fractions(chemical, rows, water_molwt=None):
+    '''
+    Calculate the weight fractions corresponding to a specific chemical and
+    coupled zeolite components.
+
+    Args:
+        chemical :
+            Chemical with the `kind`, `concentration` and `molwt` attributes
+        rows : list of BatchRecord
+            Batch records of the chemical
+        water_molwt : float
+            Molecular weight of water, required for the "solution" kind
+
+    Returns:
+        list of (component id, weight fraction) tuples
+    '''
+
+    owner, cids, fractions = fraction_arrays([chemical], {chemical.id: rows},
+                                             water_molwt)
+    return list(zip(cids.tolist(), fractions.tolist()))
+
+
+def scatter_batch_matrix(owner, component_ids, fractions, nchemicals,
+                         components):
+    '''
+    Construct the batch matrix [B] by scattering the weight fractions into
+    the rows of their chemicals and the columns of the selected components,
+    fractions of the components that are not selected are dropped.
+
+    Args:
+        owner : numpy.ndarray of int
+            Row of every weight fraction
+        component_ids : numpy.ndarray of int
+            Component id of every weight fraction
+        fractions : numpy.ndarray
+            Weight fractions
+        nchemicals : int
+            Number of rows of [B]
+        components : list
+            Selected components, columns of [B]
+    '''
+
+    B = np.zeros((nchemicals, len(components)), dtype=float)
+    if len(components) == 0 or len(fractions) == 0:
+        return B
+
+    ids = np.array([comp.id for comp in components], dtype=int)
+    order = np.argsort(ids, kind="mergesort")
+    pos = np.minimum(np.searchsorted(ids[order], component_ids), ids.size - 1)
+    sel = ids[order][pos] == component_ids
+
+    B[owner[sel], order[pos[sel]]] = fractions[sel]
+    return B
+
+
+def chemical_fractions(chemicals, repository):
+    '''
+    Return the weight fractions of the `chemicals` as a list of read-only
+    (component ids, weight fractions) array pairs, one per chemical.
+
+    The rows depend only on the chemical, its concentration and the batch
+    records, so they are memoized on the chemical id, concentration and the
+    database revision, and only the missing ones are calculated.
+    '''
+
+    keys = [(repository.key, c.id, c.concentration, cache.revision)
+            for c in chemicals]
+    fractions = [cache.weight_fractions.get(key) for key in keys]
+
+    missing = [i for i, wfs in enumerate(fractions) if wfs is None]
+    if len(missing) > 0:
+        chems = [chemicals[i] for i in missing]
+        rows = repository.batch_rows([c.id for c in chems])
+        if any(c.kind == "solution" for c in chems):
+            water_molwt = repository.water_molwt()
+        else:
+            water_molwt = None
+        owner, cids, wfs = fraction_arrays(chems, rows, water_molwt)
+        bounds = np.searchsorted(owner, np.arange(len(chems) + 1))
+        for k, i in enumerate(missing):
+            pair = (cids[bounds[k]:bounds[k + 1]].copy(),
+                    wfs[bounds[k]:bounds[k + 1]].copy())
+            for arr in pair:
+                arr.setflags(write=False)
+            fractions[i] = pair
+            cache.weight_fractions.put(keys[i], pair)
+    return fractions
+
+
+def selection_key(chemicals, components, repository):
+    '''
+    Return a hashable key identifying the database and the selection of
+    chemicals, components and concentrations.
+    '''
+
+    return (repository.key,
+            tuple(c.id for c in chemicals),
+            tuple(c.id for c in components),
+            tuple(c.concentration for c in chemicals))
+
+
+def build_batch_matrix(chemicals, components, repository):
+    '''
+    Construct the batch matrix [B] from the records provided by the
+    `repository`.
+    '''
+
+    fractions = chemical_fractions(chemicals, repository)
+    counts = [cids.size for cids, _ in fractions]
+    if sum(counts) == 0:
+        return np.zeros((len(chemicals), len(components)), dtype=float)
+    owner = np.repeat(np.arange(len(chemicals)), counts)
+    return scatter_batch_matrix(owner,
+                                np.concatenate([cids for cids, _ in fractions]),
+                                np.concatenate([wfs for _, wfs in fractions]),
+                                len(chemicals), components)
+
+
+def get_batch_matrix(chemicals, components, repository):
+    '''
+    Return the batch matrix [B], the matrices are cached for each selection
+    of chemicals, components and concentrations.
+    '''
+
+    key = selection_key(chemicals, components, repository)
+    B = cache.batch_matrices.get(key)
+    if B is None:
+        B = build_batch_matrix(chemicals, components, repository)
+        cache.batch_matrices.put(key, B)
+    return B.copy()
+
+
+def prepare_solver(chemicals, components, repository):
+    '''
+    Return the PreparedSolver for the selection of chemicals and components.
+
+    The solvers are cached together with the batch matrices so changing only
+    the mole ratios does not require a new factorization.
+    '''
+
+    check_sources(components, chemicals,
+                  repository.sources([c.id for c in components]))
+
+    key = selection_key(chemicals, components, repository)
+    solver = cache.solvers.get(key)
+    if solver is None:
+        solver = PreparedSolver(get_batch_matrix(chemicals, components, repository),
+                                [c.molwt for c in components],
+                                concentration_vector(chemicals))
+        cache.solvers.put(key, solver)
+    return solver
+
+
+def calculate_masses(chemicals, components, ratios, repository):
+    '''
+    Return the masses of `chemicals` for the mole ratios of `components`,
+    `ratios` can be a single composition or an array with one composition
+    per row.
+    '''
+
+    return prepare_solver(chemicals, components, repository).masses(ratios)
+
+
+def scenario_batch_matrices(chemicals, components, concentrations, repository):
+    '''
+    Return the batch matrices of the concentration scenarios.
+
+    Only the rows of the "solution" kind chemicals with varied concentration
+    depend on the scenario, these rows are rebuilt with a single pass of the
+    solution kernel and all the others are copied from the cached batch
+    matrix.
+
+    Args:
+        chemicals : list
+            Selected chemicals
+        components : list
+            Selected components
+        concentrations : dict
+            Sequences of S concentrations keyed on the chemical id, the
+            chemicals not present keep their concentration, the "mixture"
+            kind chemicals do not use the concentration and cannot be
+            varied
+        repository :
+            Source of the batch records
+
+    Returns:
+        Bs : numpy.ndarray, shape (S, n_chemicals, n_components)
+            Batch matrices, a single one with S = 1 if no row is affected
+        conc : numpy.ndarray, shape (S, n_chemicals)
+            Factors converting the solutions into the masses of chemicals
+    '''
+
+    ids = [c.id for c in chemicals]
+    unknown = [cid for cid in concentrations if cid not in ids]
+    if len(unknown) > 0:
+        raise ValueError("chemicals not in the selection: {}".format(
+                         ", ".join(str(cid) for cid in unknown)))
+    unused = [c.name for c in chemicals
+              if c.id in concentrations and c.kind == "mixture"]
+    if len(unused) > 0:
+        raise ValueError("concentration is not used for the mixtures: {}".format(
+                         ", ".join(unused)))
+
+    values = {cid: np.atleast_1d(np.asarray(v, dtype=float))
+              for cid, v in concentrations.items()}
+    sizes = set(v.size for v in values.values())
+    if len(sizes) > 1:
+        raise ValueError("all chemicals need the same number of scenarios")
+    nscen = sizes.pop() if len(sizes) > 0 else 1
+
+    conc = np.tile(concentration_vector(chemicals), (nscen, 1))
+    B = get_batch_matrix(chemicals, components, repository)
+
+    varied = [i for i, c in enumerate(chemicals)
+              if c.id in values and c.kind == "solution"]
+    for i, chemical in enumerate(chemicals):
+        if chemical.id in values and chemical.kind == "reactant":
+            conc[:, i] = values[chemical.id]
+
+    if len(varied) == 0:
+        return B[np.newaxis], conc
+
+    # variants of the affected chemicals ordered by scenario
+    variants = [ChemicalRecord(chemicals[i].id, chemicals[i].name, "solution",
+                               values[chemicals[i].id][s], chemicals[i].molwt)
+                for s in range(nscen) for i in varied]
+    rows = repository.batch_rows([chemicals[i].id for i in varied])
+    owner, cids, fractions = fraction_arrays(variants, rows, repository.water_molwt())
+
+    Bs = np.repeat(B[np.newaxis], nscen, axis=0)
+    Bs[:, varied, :] = scatter_batch_matrix(owner, cids, fractions, len(variants),
+                                            components).reshape(nscen, len(varied), -1)
+    return Bs, conc
+
+
+def calculate_masses_scenarios(chemicals, components, ratios, concentrations,
+                               repository):
+    '''
+    Return the masses of `chemicals` for the mole ratios of `components` in
+    every concentration scenario.
+
+    All the scenarios are solved at once, if only the concentrations of the
+    reactants vary the cached solver is reused and the scenarios differ only
+    by the conversion of the solution into masses.
+
+    Args:
+        chemicals : list
+            Selected chemicals
+        components : list
+            Selected components
+        ratios : array_like, shape (n_components,) or (N, n_components)
+            Mole ratios of the components
+        concentrations : dict
+            Sequences of S concentrations keyed on the chemical id
+        repository :
+            Source of the batch records
+
+    Returns:
+        numpy.ndarray, shape (S, n_chemicals) or (S, N, n_chemicals)
+    '''
+
+    solver = prepare_solver(chemicals, components, repository)
+    A = solver.component_masses(ratios)
+    Bs, conc = scenario_batch_matrices(chemicals, components, concentrations,
+                                       repository)
+
+    if not any(c.kind == "solution" and c.id in concentrations for c in chemicals):
+        X = solver.solve(A)[np.newaxis]
+    else:
+        BT = np.transpose(Bs, (0, 2, 1))
+        rhs = np.atleast_2d(A).T
+        if solver.square:
+            X = np.linalg.solve(BT, rhs)
+        else:
+            X = np.matmul(pinv(BT), rhs)
+        X = np.transpose(X, (0, 2, 1))
+        if A.ndim == 1:
+            X = X[:, 0, :]
+
+    if X.ndim == 3:
+        return X / conc[:, np.newaxis, :]
+    return X / conc
+
+
+def sensitivity(chemicals, components, ratios, repository):
+    '''
+    Return the derivatives of the masses of `chemicals` with respect to the
+    mole ratios of `components` and the concentrations of the chemicals for
+    the composition `ratios`.
+
+    The masses are linear in the masses of the components, so the derivatives
+    with respect to the mole ratios are the columns of the inverse of B^T
+    scaled by the molecular weights. A change of the concentration of a
+    reactant only changes the conversion of its solution into the mass,
+    -X/c**2, while a solution changes its row of [B] and the derivatives
+    dX = -(B^T)^-1 dB^T X of all the chemicals follow from a single product
+    with the stored inverse. For a non-square [B] the derivative of the
+    pseudo-inverse adds the change of the least squares residual and of the
+    minimum norm part of the solution.
+
+    Returns:
+        Sensitivity with the derivatives with respect to the mole ratios,
+        shape (n_chemicals, n_components), and the concentrations, shape
+        (n_chemicals, n_chemicals), the columns follow the order of
+        `components` and `chemicals`
+    '''
+
+    solver = prepare_solver(chemicals, components, repository)
+    X = solver.solve(solver.component_masses(ratios))
+    conc = solver.concentrations
+
+    dratios = solver.inverse * solver.molwts / conc[:, np.newaxis]
+
+    dconc = np.zeros((len(chemicals), len(chemicals)), dtype=float)
+    for i, chemical in enumerate(chemicals):
+        if chemical.kind == "reactant":
+            dconc[i, i] = -X[i] / chemical.concentration**2
+
+    varied = [i for i, c in enumerate(chemicals) if c.kind == "solution"]
+    if len(varied) > 0:
+        rows = repository.batch_rows([chemicals[i].id for i in varied])
+        owner, cids, coefs, molwts, water = [], [], [], [], []
+        for j, i in enumerate(varied):
+            for row in rows.get(chemicals[i].id, []):
+                owner.append(j)
+                cids.append(row.component_id)
+                coefs.append(row.coefficient)
+                molwts.append(row.molwt)
+                water.append(row.formula == "H2O")
+        derivs = solution_fraction_derivatives(
+            owner, coefs, molwts, water,
+            [chemicals[i].concentration for i in varied],
+            [chemicals[i].molwt for i in varied], repository.water_molwt())
+
+        # derivatives of the rows of [B] of the varied chemicals as columns
+        colidx = {comp.id: j for j, comp in enumerate(components)}
+        dB = np.zeros((len(components), len(varied)), dtype=float)
+        for j, cid, deriv in zip(owner, cids, derivs.tolist()):
+            if cid in colidx:
+                dB[colidx[cid], j] += deriv
+
+        dX = -np.dot(solver.inverse, dB * X[varied])
+        if not solver.square:
+            # derivative of the pseudo-inverse, the terms vanish for an
+            # invertible B^T
+            A = solver.component_masses(ratios)
+            res = A - np.dot(X, solver.B)
+            z = np.dot(np.transpose(solver.inverse), X)
+            proj = np.eye(len(chemicals)) - np.dot(solver.inverse, np.transpose(solver.B))
+            gram = np.dot(solver.inverse, np.transpose(solver.inverse))
+            dX += gram[:, varied] * np.dot(res, dB) + proj[:, varied] * np.dot(z, dB)
+        dconc[:, varied] = dX / conc[:, np.newaxis]
+
+    return Sensitivity(dratios, dconc)
+
+
+def normalize_moles(moles, reference, value=1.0):
+    '''
+    Return the mole ratios normalized so that the component with the index
+    `reference` has the mole ratio `value`, `moles` can be a single
+    composition or an array with one composition per row. The compositions
+    without the reference component give NaN or infinite ratios.
+    '''
+
+    moles = np.asarray(moles, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return moles * (value / moles[..., reference:reference + 1])
+
+
+def composition_errors(achieved, target):
+    '''
+    Return the largest relative deviations of the `achieved` mole ratios from
+    the `target`, the components with zero target contribute the absolute
+    deviation.
+    '''
+
+    target = np.asarray(target, dtype=float)
+    dev = np.abs(np.asarray(achieved, dtype=float) - target)
+    scale = np.where(target != 0.0, np.abs(target), 1.0)
+    return np.max(dev / scale, axis=-1)
+
+
+def round_recipes(solver, ratios, precision, scales=1.0):
+    '''
+    Round the masses of chemicals to the balance `precision` and calculate
+    the achieved composition.
+
+    The masses for the mole ratios `ratios` are divided by each of the scale
+    factors `scales`, rounded, and converted back into the mole ratios with
+    B^T X multiplied by the scale factor, so all the candidate scale factors
+    are evaluated with one matrix product.
+
+    Args:
+        solver : PreparedSolver
+            Solver of the selection
+        ratios : array_like, shape (n_components,)
+            Target mole ratios of the components
+        precision : float
+            Precision of the balance in grams, e.g. 0.01 or 0.0001
+        scales : float or array_like, shape (K,)
+            Scale factors the masses are divided by
+
+    Returns:
+        RoundedRecipes with the scale factors, the rounded masses of shape
+        (K, n_chemicals), the achieved mole ratios of shape (K, n_components),
+        the target mole ratios and the composition errors of shape (K,)
+    '''
+
+    if precision <= 0.0:
+        raise ValueError("precision has to be positive, got {0}".format(precision))
+
+    target = np.asarray(ratios, dtype=float)
+    scales = np.atleast_1d(np.asarray(scales, dtype=float))
+    masses = solver.masses(target)
+
+    rounded = np.round(masses / scales[:, np.newaxis] / precision) * precision
+    achieved = solver.moles(rounded) * scales[:, np.newaxis]
+    return RoundedRecipes(scales, rounded, achieved, target,
+                          composition_errors(achieved, target))
+
+
+def calculate_moles(chemicals, components, masses, repository):
+    '''
+    Return the moles of `components` for the masses of `chemicals`, `masses`
+    can be a single recipe or an array with one recipe per row.
+    '''
+
+    check_sources(components, chemicals,
+                  repository.sources([c.id for c in components]))
+
+    B = get_batch_matrix(chemicals, components, repository)
+    X = np.asarray(masses, dtype=float) * concentration_vector(chemicals)
+    return np.dot(X, B) / np.asarray([c.molwt for c in components], dtype=float)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from batchcalc import cache
+
+__version__ = "0.3.1"
+
+
+# engines and thread local session registries keyed on the database path
+_engines = {}
+_sessions = {}
+
+
+def get_engine(dbpath, pool_size=5, max_overflow=10):
+    '''
+    Return the engine for the SQLite database at `dbpath`, created on the
+    first call and shared afterwards.
+
+    The connections are kept in a pool so switching back to a database that
+    was already opened does not reconnect, they are not bound to the thread
+    that created them so worker threads can use the same pool.
+    '''
+
+    path = os.path.abspath(dbpath)
+    engine = _engines.get(path)
+    if engine is None:
+        engine = create_engine("sqlite:///{path:s}".format(path=path),
+                               echo=False, poolclass=QueuePool,
+                               pool_size=pool_size, max_overflow=max_overflow,
+                               connect_args={"check_same_thread": False})
+        _engines[path] = engine
+    return engine
+
+
+def get_scoped_session(dbpath):
+    '''
+    Return the `scoped_session` registry for the database at `dbpath`,
+    calling it returns the session of the current thread, all the threads
+    share the same engine.
+    '''
+
+    path = os.path.abspath(dbpath)
+    registry = _sessions.get(path)
+    if registry is None:
+        registry = scoped_session(sessionmaker(bind=get_engine(path),
+                                               expire_on_commit=False,
+                                               autoflush=False))
+        _sessions[path] = registry
+    return registry
+
+
+def dispose_engines(paths=None):
+    '''
+    Close the sessions and the pooled connections of the databases given by
+    `paths`, all the registered databases by default. This has to be called
+    before the database file is removed or replaced, the cached data
+    derived from the database records is cleared as well.
+    '''
+
+    if paths is None:
+        paths = list(_engines.keys())
+    for path in [os.path.abspath(p) for p in paths]:
+        registry = _sessions.pop(path, None)
+        if registry is not None:
+            registry.remove()
+        engine = _engines.pop(path, None)
+        if engine is not None:
+            engine.dispose()
+
+    # the cached data is keyed on the database url, which is the same for a
+    # new database created in place of the disposed one
+    cache.invalidate()
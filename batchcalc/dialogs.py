@@ -169,12 +169,14 @@ class ExportPdfDialog(wx.Dialog):
                                 label="Result vector X (rescaled to the sample size)")
         cb_rescaleItem = wx.CheckBox(panel,
                                 label="Result vector X (rescaled to an item)")
+        cb_sens = wx.CheckBox(panel, label="Sensitivity of the masses")
 
         cb_cmpm.SetValue(True)
         cb_bmat.SetValue(True)
         cb_rescaleAll.SetValue(True)
         cb_rescaleTo.SetValue(True)
         cb_rescaleItem.SetValue(True)
+        cb_sens.SetValue(False)
 
         sb_calculation = wx.StaticBox(panel, label="Include")
         sbc_bs = wx.StaticBoxSizer(sb_calculation, wx.VERTICAL)
@@ -183,6 +185,7 @@ class ExportPdfDialog(wx.Dialog):
         sbc_bs.Add(cb_rescaleAll, flag=wx.LEFT | wx.TOP, border=5)
         sbc_bs.Add(cb_rescaleTo, flag=wx.LEFT | wx.TOP, border=5)
         sbc_bs.Add(cb_rescaleItem, flag=wx.LEFT | wx.TOP, border=5)
+        sbc_bs.Add(cb_sens, flag=wx.LEFT | wx.TOP, border=5)
 
         self.widgets = {
             "title": title,
@@ -193,6 +196,7 @@ class ExportPdfDialog(wx.Dialog):
             "rescale_all": cb_rescaleAll,
             "rescale_to": cb_rescaleTo,
             "rescale_item": cb_rescaleItem,
+            "sensitivity": cb_sens,
         }
 
         # layout
@@ -262,11 +266,13 @@ class ExportTexDialog(wx.Dialog):
                             label="Result vector X (rescaled by a factor)")
         cb_rescaleTo = wx.CheckBox(panel,
                             label="Result vector X (rescaled to the sample size)")
+        cb_sens = wx.CheckBox(panel, label="Sensitivity of the masses")
 
         cb_cmpm.SetValue(True)
         cb_bmat.SetValue(True)
         cb_rescaleAll.SetValue(True)
         cb_rescaleTo.SetValue(True)
+        cb_sens.SetValue(False)
 
         cb_calo = wx.CheckBox(panel, label="Calcination I")
         cb_ione = wx.CheckBox(panel, label="Ion Exchange")
@@ -288,6 +294,7 @@ class ExportTexDialog(wx.Dialog):
         sbc_bs.Add(cb_bmat, flag=wx.LEFT | wx.TOP, border=5)
         sbc_bs.Add(cb_rescaleAll, flag=wx.LEFT | wx.TOP, border=5)
         sbc_bs.Add(cb_rescaleTo, flag=wx.LEFT | wx.TOP, border=5)
+        sbc_bs.Add(cb_sens, flag=wx.LEFT | wx.TOP, border=5)
 
         sb_synthesis = wx.StaticBox(panel, label="Synthesis")
         sbs_bs = wx.StaticBoxSizer(sb_synthesis, wx.VERTICAL)
@@ -309,6 +316,7 @@ class ExportTexDialog(wx.Dialog):
             "batch": cb_bmat,
             "rescale_all": cb_rescaleAll,
             "rescale_to": cb_rescaleTo,
+            "sensitivity": cb_sens,
             "calcination_i": cb_calo,
             "ion_exchange": cb_ione,
             "calcination_ii": cb_calt,
@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import itertools
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from batchcalc import cache
+from batchcalc.model import Chemical, Component, Kind
+
+__version__ = "0.3.1"
+
+# standard atomic weights of the elements, same as in utils/molwt.py
+ATOMIC_WEIGHTS = {
+    'H': 1.0079, 'He': 4.0026, 'Li': 6.94, 'Be': 9.01218, 'B': 10.81,
+    'C': 12.011, 'N': 14.0067, 'O': 15.9994, 'F': 18.998403, 'Ne': 20.17,
+    'Na': 22.98977, 'Mg': 24.305, 'Al': 26.98154, 'Si': 28.0855,
+    'P': 30.97376, 'S': 32.06, 'Cl': 35.453, 'Ar': 39.948, 'K': 39.0983,
+    'Ca': 40.08, 'Sc': 44.9559, 'Ti': 47.9, 'V': 50.9415, 'Cr': 51.996,
+    'Mn': 54.938, 'Fe': 55.847, 'Co': 58.9332, 'Ni': 58.71, 'Cu': 63.546,
+    'Zn': 65.38, 'Ga': 69.735, 'Ge': 72.59, 'As': 74.9216, 'Se': 78.96,
+    'Br': 79.904, 'Kr': 83.8, 'Rb': 85.467, 'Sr': 87.62, 'Y': 88.9059,
+    'Zr': 91.22, 'Nb': 92.9064, 'Mo': 95.94, 'Tc': 98.9062, 'Ru': 101.07,
+    'Rh': 102.9055, 'Pd': 106.4, 'Ag': 107.868, 'Cd': 112.41, 'In': 114.82,
+    'Sn': 118.69, 'Sb': 121.75, 'Te': 127.6, 'I': 126.9045, 'Xe': 131.3,
+    'Cs': 132.9054, 'Ba': 137.33, 'La': 138.9055, 'Ce': 140.12,
+    'Pr': 140.9077, 'Nd': 144.24, 'Pm': 145, 'Sm': 150.4, 'Eu': 151.96,
+    'Gd': 157.25, 'Tb': 158.9254, 'Dy': 162.5, 'Ho': 164.9304, 'Er': 167.26,
+    'Tm': 168.9342, 'Yb': 173.04, 'Lu': 174.96, 'Hf': 178.49, 'Ta': 180.947,
+    'W': 183.85, 'Re': 186.207, 'Os': 190.2, 'Ir': 192.22, 'Pt': 195.09,
+    'Au': 196.9665, 'Hg': 200.59, 'Tl': 204.37, 'Pb': 207.2, 'Bi': 208.9804,
+    'Po': 209, 'At': 210, 'Rn': 222, 'Fr': 223, 'Ra': 226.0254, 'Ac': 227,
+    'Th': 232.0381, 'Pa': 231.0359, 'U': 238.029, 'Np': 237.0482, 'Pu': 244,
+    'Am': 243, 'Cm': 247, 'Bk': 247, 'Cf': 251, 'Es': 254, 'Fm': 257,
+    'Md': 258, 'No': 259, 'Lr': 260, 'Unq': 260, 'Unp': 260, 'Unh': 263,
+    'Uns': 262
+}
+
+# hydrate separators, e.g. Al2(SO4)3*18H2O
+_separator = re.compile(r"[*·]")
+
+# optional leading multiplier of a hydrate part
+_multiplier = re.compile(r"\s*(\d+(?:\.\d+)?)?")
+
+# element symbols, repeat counts and parentheses
+_token = re.compile(r"\s*(?:([A-Z][a-z]*)|(\d+(?:\.\d+)?)|([(\[])|([)\]]))\s*")
+
+MolwtDrift = namedtuple('MolwtDrift', ['table', 'id', 'formula', 'stored',
+                                       'computed'])
+
+BatchProposal = namedtuple('BatchProposal', ['chemical_id', 'component_ids',
+                                             'coefficients', 'status',
+                                             'alternatives'])
+
+
+def _add(counts, other, factor):
+    '''
+    Add the element counts from `other` multiplied by `factor` to `counts`.
+    '''
+
+    for symbol, count in other.items():
+        counts[symbol] = counts.get(symbol, 0) + count * factor
+
+
+def _parse_part(part, formula):
+    '''
+    Parse a single part of a hydrate formula into element counts.
+    '''
+
+    match = _multiplier.match(part)
+    multiplier = float(match.group(1)) if match.group(1) else 1
+    pos = match.end()
+
+    stack = [{}]
+    last = None
+    while pos < len(part):
+        match = _token.match(part, pos)
+        if match is None:
+            raise ValueError("Unexpected character '{0:s}' in '{1:s}'".format(
+                             part[pos], formula))
+        symbol, number, lparen, rparen = match.groups()
+        pos = match.end()
+
+        if number is not None:
+            if last is None:
+                raise ValueError("Misplaced count in '{0:s}'".format(formula))
+            _add(stack[-1], last, float(number))
+            last = None
+            continue
+
+        if last is not None:
+            _add(stack[-1], last, 1)
+            last = None
+
+        if symbol is not None:
+            if symbol not in ATOMIC_WEIGHTS:
+                raise ValueError("'{0:s}' is not an element symbol in "
+                                 "'{1:s}'".format(symbol, formula))
+            last = {symbol: 1}
+        elif lparen is not None:
+            stack.append({})
+        else:
+            if len(stack) == 1:
+                raise ValueError("Unbalanced parentheses in '{0:s}'".format(formula))
+            last = stack.pop()
+
+    if last is not None:
+        _add(stack[-1], last, 1)
+    if len(stack) > 1:
+        raise ValueError("Unbalanced parentheses in '{0:s}'".format(formula))
+    if len(stack[0]) == 0:
+        raise ValueError("No elements in '{0:s}'".format(formula))
+
+    counts = {}
+    _add(counts, stack[0], multiplier)
+    return counts
+
+
+def element_counts(formula):
+    '''
+    Parse the chemical formula into the number of atoms of each element.
+
+    Groups can be enclosed in parentheses and followed by a count, e.g.
+    "Al(OC3H7)3", hydrates are separated with "*" and can have a leading
+    multiplier, e.g. "Al2(SO4)3*18H2O". The results are memoized since the
+    same formulas are parsed repeatedly.
+
+    Args:
+        formula : str
+            Chemical formula
+
+    Returns:
+        counts : dict
+            Element symbols as keys and the number of atoms as values
+
+    Raises:
+        ValueError if the formula cannot be parsed
+    '''
+
+    counts = cache.formulas.get(formula)
+    if counts is None:
+        counts = {}
+        for part in _separator.split(formula):
+            _add(counts, _parse_part(part, formula), 1)
+        cache.formulas.put(formula, counts)
+    return dict(counts)
+
+
+def molecular_weight(formula):
+    '''
+    Return the molecular weight of the compound given by the `formula`.
+    '''
+
+    return sum(ATOMIC_WEIGHTS[symbol] * count
+               for symbol, count in element_counts(formula).items())
+
+
+def element_matrix(formulas, strict=True):
+    '''
+    Build the matrix of element counts of the `formulas`.
+
+    Args:
+        formulas : list of str
+            Chemical formulas, duplicates are parsed only once
+        strict : bool
+            If True a ValueError is raised for formulas that cannot be parsed,
+            otherwise their rows are filled with NaN
+
+    Returns:
+        E : numpy.array
+            Number of atoms with the formulas as rows and elements as columns
+        symbols : list of str
+            Element symbols corresponding to the columns of `E`
+    '''
+
+    unique = {}
+    for formula in formulas:
+        if formula in unique:
+            continue
+        try:
+            unique[formula] = element_counts(formula)
+        except ValueError:
+            if strict:
+                raise
+            unique[formula] = None
+
+    symbols = sorted(set(s for counts in unique.values() if counts is not None
+                         for s in counts),
+                     key=lambda s: ATOMIC_WEIGHTS[s])
+    columns = dict((s, j) for j, s in enumerate(symbols))
+
+    E = np.zeros((len(formulas), len(symbols)), dtype=float)
+    for i, formula in enumerate(formulas):
+        counts = unique[formula]
+        if counts is None:
+            E[i] = np.nan
+        else:
+            for symbol, count in counts.items():
+                E[i, columns[symbol]] = count
+    return E, symbols
+
+
+def atomic_weights(symbols):
+    '''
+    Return the array of atomic weights of the elements given by `symbols`.
+    '''
+
+    return np.array([ATOMIC_WEIGHTS[s] for s in symbols], dtype=float)
+
+
+def molecular_weights(formulas, strict=True):
+    '''
+    Return the array of molecular weights of the `formulas` computed as a
+    single product of the element matrix and the atomic weights.
+    '''
+
+    E, symbols = element_matrix(formulas, strict=strict)
+    return E.dot(atomic_weights(symbols))
+
+
+def drifted(stored, computed, rtol=1.0e-4):
+    '''
+    Return the boolean mask of the `stored` molecular weights that differ
+    from the `computed` ones by more than the relative tolerance `rtol`, the
+    formulas that could not be parsed (NaN) are always flagged.
+    '''
+
+    stored = np.asarray(stored, dtype=float)
+    computed = np.asarray(computed, dtype=float)
+    with np.errstate(invalid='ignore'):
+        return ~(np.abs(stored - computed) <= rtol * np.abs(computed))
+
+
+def check_molwts(session, rtol=1.0e-4):
+    '''
+    Compare the molecular weights stored in the chemicals and components
+    tables with the ones computed from their formulas.
+
+    Args:
+        session :
+            SQLAlchemy session
+        rtol : float
+            Relative tolerance
+
+    Returns:
+        drifts : list of MolwtDrift
+            Records with a stored molecular weight different from the computed
+            one or with a formula that cannot be parsed
+    '''
+
+    records = []
+    for table, cls in (('chemicals', Chemical), ('components', Component)):
+        query = session.query(cls.id, cls.formula, cls.molwt).order_by(cls.id)
+        records.extend((table, rid, formula, molwt)
+                       for rid, formula, molwt in query)
+
+    if len(records) == 0:
+        return []
+
+    formulas = [r[2] if r[2] is not None else "" for r in records]
+    stored = np.array([r[3] if r[3] is not None else np.nan for r in records],
+                      dtype=float)
+    computed = molecular_weights(formulas, strict=False)
+
+    return [MolwtDrift(*(records[i] + (computed[i],)))
+            for i in np.flatnonzero(drifted(stored, computed, rtol=rtol))]
+
+
+def _denominators(coefficients, maxden=12, tol=1.0e-6):
+    '''
+    Return the smallest integers that turn all the coefficients in each row
+    into integers, `maxden` + 1 for rows without such integer up to `maxden`.
+    '''
+
+    result = np.full(coefficients.shape[0], maxden + 1, dtype=int)
+    for den in range(maxden, 0, -1):
+        scaled = coefficients * den
+        integral = np.all(np.abs(scaled - np.round(scaled)) < tol * den, axis=1)
+        result[integral] = den
+    return result
+
+
+def balance_coefficients(chemical_formulas, component_formulas, maxsize=3,
+                         tol=1.0e-8, chunksize=20000):
+    '''
+    Solve the element balances expressing each chemical as a combination of
+    the smallest possible number of components.
+
+    All the subsets of components of a given size are solved at once with a
+    stacked pseudo-inverse of their element count matrices, only the subsets
+    made of components containing no elements absent from the chemical are
+    tried for that chemical. The subset size is increased until an exact
+    solution is found or `maxsize` is reached. The solutions are ordered
+    preferring fewer negative coefficients, simpler stoichiometry and the
+    smallest mass of the components involved.
+
+    Args:
+        chemical_formulas : list of str
+            Formulas of the chemicals
+        component_formulas : list of str
+            Formulas of the components
+        maxsize : int
+            Maximal number of components a chemical is made of
+        tol : float
+            Tolerance on the element balance residual relative to the number
+            of atoms in the chemical
+
+    Returns:
+        solutions : list of lists
+            For every chemical the list of (component indices, coefficients)
+            tuples that balance the elements, best first, empty if no
+            balance was found
+
+    Raises:
+        ValueError if any of the formulas cannot be parsed
+    '''
+
+    # repeated chemical formulas are balanced only once
+    index = {}
+    for formula in chemical_formulas:
+        index.setdefault(formula, len(index))
+    formulas = sorted(index, key=index.get)
+
+    E, symbols = element_matrix(formulas + list(component_formulas))
+    chem = E[:len(formulas)]
+    comp = E[len(formulas):]
+    ncomp = comp.shape[0]
+    weights = comp.dot(atomic_weights(symbols))
+
+    # components made only of elements present in the chemical
+    compatible = ~np.any((comp[np.newaxis, :, :] > 0) &
+                         (chem[:, np.newaxis, :] == 0), axis=2)
+    scale = np.abs(chem).sum(axis=1)
+
+    solutions = [[] for _ in range(chem.shape[0])]
+    unsolved = np.arange(chem.shape[0])
+
+    for size in range(1, min(maxsize, ncomp) + 1):
+        if unsolved.size == 0:
+            break
+        found_chem, found_subsets, found_coeffs = [], [], []
+        subsets = itertools.combinations(range(ncomp), size)
+        while True:
+            block = np.array(list(itertools.islice(subsets, chunksize)),
+                             dtype=int).reshape(-1, size)
+            if block.shape[0] == 0:
+                break
+
+            # only the subsets that some unsolved chemical can be made of
+            usable = np.all(compatible[unsolved][:, block], axis=2)
+            keep = np.any(usable, axis=0)
+            if not np.any(keep):
+                continue
+            block, usable = block[keep], usable[:, keep]
+
+            # element count matrices (subsets, elements, size) of full rank
+            A = np.transpose(comp[block], (0, 2, 1))
+            u, sv, vt = np.linalg.svd(A, full_matrices=False)
+            full = sv[:, -1] > 1.0e-10 * sv[:, 0]
+            if not np.any(full):
+                continue
+            block, A, usable = block[full], A[full], usable[:, full]
+            pinv = np.einsum('tji,tj,tkj->tik', vt[full], 1.0 / sv[full],
+                             u[full])
+
+            ci, ti = np.nonzero(usable)
+            ci = unsolved[ci]
+            x = np.einsum('pik,pk->pi', pinv[ti], chem[ci])
+            residual = np.einsum('pki,pi->pk', A[ti], x) - chem[ci]
+            exact = np.abs(residual).sum(axis=1) <= tol * scale[ci]
+
+            found_chem.append(ci[exact])
+            found_subsets.append(block[ti[exact]])
+            found_coeffs.append(x[exact])
+
+        if len(found_chem) == 0:
+            continue
+        found_chem = np.concatenate(found_chem)
+        found_subsets = np.concatenate(found_subsets)
+        found_coeffs = np.concatenate(found_coeffs)
+
+        order = np.lexsort((np.abs(found_coeffs * weights[found_subsets]).sum(axis=1),
+                            _denominators(found_coeffs),
+                            np.sum(found_coeffs < 0, axis=1),
+                            found_chem))
+        for i in order:
+            solutions[found_chem[i]].append((tuple(int(j) for j in found_subsets[i]),
+                                             found_coeffs[i]))
+
+        unsolved = np.setdiff1d(unsolved, found_chem)
+
+    return [list(solutions[index[formula]]) for formula in chemical_formulas]
+
+
+def propose_batches(session, chemical_ids=None, maxsize=3):
+    '''
+    Propose the Batch coefficients of the chemicals from the element balances
+    of their formulas and the formulas of all the components.
+
+    Args:
+        session :
+            SQLAlchemy session
+        chemical_ids : list of int
+            Ids of the chemicals, by default all the chemicals that are not
+            mixtures, since the coefficients of mixtures are not determined by
+            their formula
+        maxsize : int
+            Maximal number of components a chemical is made of
+
+    Returns:
+        proposals : list of BatchProposal
+            For every chemical the best set of components and coefficients
+            with the status "exact" if it is the only solution, "ambiguous" if
+            there are alternatives or "unbalanced" if no solution was found,
+            the alternatives are lists of (component ids, coefficients)
+    '''
+
+    query = session.query(Chemical.id, Chemical.formula).\
+        join(Kind, Chemical._kind_id == Kind.id)
+    if chemical_ids is None:
+        query = query.filter(Kind.name != "mixture")
+    else:
+        query = query.filter(Chemical.id.in_(list(chemical_ids)))
+    chemicals = query.order_by(Chemical.id).all()
+    components = session.query(Component.id, Component.formula).\
+        order_by(Component.id).all()
+
+    component_ids = np.array([c.id for c in components], dtype=int)
+    solutions = balance_coefficients([c.formula for c in chemicals],
+                                     [c.formula for c in components],
+                                     maxsize=maxsize)
+
+    proposals = []
+    for chemical, sols in zip(chemicals, solutions):
+        alternatives = [([int(component_ids[i]) for i in idx],
+                         [float(x) for x in coeffs]) for idx, coeffs in sols]
+        if len(alternatives) == 0:
+            proposals.append(BatchProposal(chemical.id, [], [], "unbalanced", []))
+            continue
+        status = "exact" if len(alternatives) == 1 else "ambiguous"
+        ids, coeffs = alternatives[0]
+        proposals.append(BatchProposal(chemical.id, ids, coeffs, status,
+                                       alternatives[1:]))
+    return proposals
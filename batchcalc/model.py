@@ -39,6 +39,13 @@ from sqlalchemy.ext.hybrid import hybrid_property
 
 __version__ = "0.3.1"
 
+_digits = re.compile(r'(\d+)')
+
+# tex and html renderings of the formulas, they depend only on the formula
+# string so they are shared by all the instances and never invalidated
+_tex_formulas = {}
+_html_formulas = {}
+
 Base = declarative_base()
 
 
@@ -58,13 +65,21 @@ class BaseChemical(object):
         '''
         Convert the formula string to tex string.
         '''
-        return re.sub(r'(\d+)', r'$_{\1}$', self.formula)
+        try:
+            return _tex_formulas[self.formula]
+        except KeyError:
+            res = _tex_formulas[self.formula] = _digits.sub(r'$_{\1}$', self.formula)
+            return res
 
     def formula_to_html(self):
         '''
         Convert the formula string to html string.
         '''
-        return re.sub(r'(\d+)', r'<sub>\1</sub>', self.formula)
+        try:
+            return _html_formulas[self.formula]
+        except KeyError:
+            res = _html_formulas[self.formula] = _digits.sub(r'<sub>\1</sub>', self.formula)
+            return res
 
     def listctrl_label(self):
         '''
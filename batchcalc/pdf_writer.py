@@ -148,8 +148,9 @@ def batch_table(model):
 
     db = ctrl.DB()
 
-    temp = np.array(map(lambda x: "{0:8.4f}".format(x), model.get_B_matrix(db.session).reshape(model.B.size)))
-    data = temp.reshape(model.get_B_matrix(db.session).shape).tolist()
+    B = model.get_B_matrix(db.session)
+    temp = np.array(["{0:8.4f}".format(x) for x in B.ravel()])
+    data = temp.reshape(B.shape).tolist()
     for row, chemical in zip(data, model.chemicals):
         row.insert(0, chemical.formula + " ({0:6.2f}%)".format(chemical.concentration * 100))
     data.insert(0, ['Compound'] + [c.formula for c in model.components])
@@ -158,6 +159,32 @@ def batch_table(model):
     return tab
 
 
+def sensitivity_tables(model):
+    '''
+    Return the tables with the derivatives of the masses of chemicals with
+    respect to the mole ratios and the concentrations.
+    '''
+
+    db = ctrl.DB()
+
+    sens = model.sensitivity(db.session)
+    # only the concentrations of solutions and reactants affect the masses
+    cols = [j for j, c in enumerate(model.chemicals) if c.kind != "mixture"]
+
+    ratios = [['Chemical'] + ['d/d ' + c.formula for c in model.components]]
+    concs = [['Chemical'] + ['d/d c(' + model.chemicals[j].formula + ')' for j in cols]]
+    for chem, drow, crow in zip(model.chemicals, sens.ratios, sens.concentrations):
+        ratios.append([chem.formula] + ["{0:10.4f}".format(x) for x in drow])
+        concs.append([chem.formula] + ["{0:10.4f}".format(crow[j]) for j in cols])
+
+    tabs = []
+    for data in [ratios, concs]:
+        tab = Table(data)
+        tab.setStyle(tab_style)
+        tabs.append(tab)
+    return tabs
+
+
 def results_table(model, scale=None):
     '''
     Return a table with the results scaled according to the scale argument
@@ -237,6 +264,10 @@ def create_pdf(path, model, flags):
     if flags['batch']:
         story.append(KeepTogether([Paragraph("Batch Matrix [B]", styles['Section']),
                                    Spacer(1, 15), batch, Spacer(1, 10)]))
+    if flags.get('sensitivity', False):
+        dratios, dconcs = sensitivity_tables(model)
+        story.append(KeepTogether([Paragraph("Sensitivity of the masses [g]", styles['Section']),
+                                   Spacer(1, 15), dratios, Spacer(1, 10), dconcs, Spacer(1, 10)]))
     if flags['rescale_all']:
         story.append(KeepTogether([Paragraph("Results [X] (SF={0:8.4f})".format(model.scale_all), styles['Section']),
                                   Spacer(1, 15), results_table(model, scale="all"), Spacer(1, 10)]))
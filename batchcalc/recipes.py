@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+from collections import namedtuple
+
+import numpy as np
+
+from batchcalc import core
+
+__version__ = "0.3.1"
+
+
+Recipe = namedtuple("Recipe", ["chemicals", "masses", "score"])
+
+
+def has_matching(sources, available):
+    '''
+    Check if every component can be assigned a distinct chemical, i.e. if
+    the bipartite graph of the components and the `available` chemicals has
+    a matching covering all the components.
+
+    Args:
+        sources : list of set
+            Chemicals providing each of the components
+        available : set
+            Chemicals that can be used
+
+    Returns:
+        bool
+    '''
+
+    match = {}
+
+    def augment(comp, visited):
+        for chem in sources[comp]:
+            if chem in available and chem not in visited:
+                visited.add(chem)
+                if chem not in match or augment(match[chem], visited):
+                    match[chem] = comp
+                    return True
+        return False
+
+    return all(augment(comp, set()) for comp in range(len(sources)))
+
+
+def significant(values, digits=12):
+    '''
+    Round the `values` to the number of significant `digits`, so that the
+    values differing only by the round-off errors compare equal.
+    '''
+
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide="ignore"):
+        exponent = np.floor(np.log10(np.abs(values)))
+    exponent = np.where(np.isfinite(exponent), exponent, 0.0)
+    scale = 10.0 ** (digits - 1 - exponent)
+    return np.round(values * scale) / scale
+
+
+class RecipeSearch(object):
+    '''
+    Search for the best sets of chemicals providing the selected components.
+
+    The candidate sets have one chemical per component, so that the batch
+    matrix is square. A set can have a non-singular batch matrix only if the
+    components can be matched with distinct chemicals of the set, therefore
+    the sets are built by assigning the chemicals to the components, the
+    ones with the fewest sources first, and a partial assignment is dropped
+    as soon as the remaining components cannot be matched with the unused
+    chemicals. The batch matrices of the candidates are gathered from the
+    rows of all the candidate chemicals and solved in chunks with a single
+    stacked solve.
+
+    Args:
+        components : list
+            Selected components
+        repository :
+            Source of the chemicals and batch records
+        scores : dict or callable
+            Score per gram of every chemical, e.g. the price or a hazard
+            penalty, either keyed on the chemical id or a function of the
+            chemical, the chemicals missing from the dict score 1.0. By
+            default the score is the impurity, 1 - concentration, of the
+            "reactant" kind chemicals, so the recipes are ranked by the mass
+            of the impurities. The total mass cannot be used as the score,
+            it is the same for all the recipes of a composition. The recipes
+            with equal scores are ordered by the chemical ids.
+        strict : bool
+            Skip the chemicals providing components that are not selected
+        maxsources : int
+            Keep only this number of the sources with the lowest scores for
+            every component, by default all the sources are used
+        tolerance : float
+            Masses larger than `-tolerance` are considered non-negative
+        chunksize : int
+            Number of the candidate sets solved at once
+    '''
+
+    def __init__(self, components, repository, scores=None, strict=False,
+                 maxsources=None, tolerance=1.0e-10, chunksize=10000):
+
+        self.components = list(components)
+        self.tolerance = tolerance
+        self.chunksize = chunksize
+
+        index = repository.source_index()
+        missing = [c.name for c in self.components if len(index.get(c.id, [])) == 0]
+        if len(missing) > 0:
+            raise ValueError("no source of the components: {}".format(", ".join(missing)))
+
+        ids = set()
+        for comp in self.components:
+            ids.update(index[comp.id])
+        if strict:
+            selected = set(c.id for c in self.components)
+            rows = repository.batch_rows(list(ids))
+            ids = set(chid for chid in ids
+                      if all(r.component_id in selected for r in rows.get(chid, [])))
+
+        records = repository.chemicals(ids)
+        self.chemicals = [records[chid] for chid in sorted(records)]
+        position = {c.id: i for i, c in enumerate(self.chemicals)}
+        self.sources = [set(position[chid] for chid in index[comp.id] if chid in position)
+                        for comp in self.components]
+
+        self.concentrations = core.concentration_vector(self.chemicals)
+        if scores is None:
+            self.scores = 1.0 - self.concentrations
+        elif callable(scores):
+            self.scores = np.array([scores(c) for c in self.chemicals], dtype=float)
+        else:
+            self.scores = np.array([scores.get(c.id, 1.0) for c in self.chemicals],
+                                   dtype=float)
+
+        if maxsources is not None:
+            self.sources = [set(sorted(src, key=lambda i: (self.scores[i], i))[:maxsources])
+                            for src in self.sources]
+
+        self.B = core.build_batch_matrix(self.chemicals, self.components, repository)
+        self.molwts = np.array([c.molwt for c in self.components], dtype=float)
+
+    def candidates(self):
+        '''
+        Generate the candidate sets in blocks, integer arrays of shape
+        (m, n_components) with the sorted indices of the chemicals in
+        `self.chemicals`.
+
+        The chemicals of the last components, as many as give blocks of up to
+        `chunksize` sets, are combined as arrays for every assignment of the
+        others. A set with more than one matching is generated more than once,
+        the duplicates are removed when the recipes are ranked.
+        '''
+
+        # the most constrained components are assigned first
+        order = sorted(range(len(self.sources)), key=lambda i: len(self.sources[i]))
+        sources = [self.sources[i] for i in order]
+        nfixed = max(len(sources) - 1, 0)
+        while nfixed > 0 and np.prod([len(src) for src in sources[nfixed - 1:]]) <= self.chunksize:
+            nfixed -= 1
+        allchems = set(range(len(self.chemicals)))
+
+        def complete(prefix, used):
+            tails = [np.array(sorted(src - used), dtype=int) for src in sources[nfixed:]]
+            grids = np.meshgrid(*tails, indexing="ij")
+            sets = np.column_stack([np.repeat([prefix], grids[0].size, axis=0)] +
+                                   [g.ravel() for g in grids]).astype(int)
+            sets.sort(axis=1)
+            return sets[np.all(np.diff(sets, axis=1) != 0, axis=1)]
+
+        def assign(k, used, prefix):
+            if k == nfixed:
+                yield complete(prefix, used)
+                return
+            for chem in sorted(sources[k]):
+                if chem in used:
+                    continue
+                used.add(chem)
+                if has_matching(sources[k + 1:], allchems - used):
+                    for block in assign(k + 1, used, prefix + [chem]):
+                        yield block
+                used.remove(chem)
+
+        for block in assign(0, set(), []):
+            if block.shape[0] > 0:
+                yield block
+
+    def solve(self, sets, ratios):
+        '''
+        Solve the batch equations of the candidate `sets`, an integer array
+        of shape (K, n_components), for the mole `ratios`.
+
+        Returns:
+            masses : numpy.ndarray, shape (K, n_components)
+                Masses of the chemicals of the sets, NaN for the sets with a
+                singular batch matrix
+            feasible : numpy.ndarray of bool, shape (K,)
+                Flags of the non-singular sets with non-negative masses
+        '''
+
+        sets = np.asarray(sets, dtype=int)
+        B = self.B[sets]
+        A = np.asarray(ratios, dtype=float) * self.molwts
+
+        # determinants negligible compared to the Hadamard bound
+        bound = np.prod(np.linalg.norm(B, axis=2), axis=1)
+        regular = np.abs(np.linalg.det(B)) > 1.0e-12 * bound
+
+        masses = np.full(sets.shape, np.nan)
+        if np.any(regular):
+            BT = np.transpose(B[regular], (0, 2, 1))
+            rhs = np.repeat(A[np.newaxis, :, np.newaxis], BT.shape[0], axis=0)
+            X = np.linalg.solve(BT, rhs)[:, :, 0]
+            masses[regular] = X / self.concentrations[sets[regular]]
+        feasible = regular.copy()
+        feasible[regular] = np.all(masses[regular] > -self.tolerance, axis=1)
+        return masses, feasible
+
+    def search(self, ratios, limit=10, maxcandidates=None):
+        '''
+        Return the `limit` feasible recipes with the lowest score for the
+        mole `ratios` of the components, at most `maxcandidates` candidate
+        sets are evaluated.
+
+        Returns:
+            list of Recipe with the chemicals, their masses and the score,
+            sorted by the score
+        '''
+
+        best = {}
+
+        def rank(key):
+            return best[key][0], key
+
+        def evaluate(sets):
+            masses, feasible = self.solve(sets, ratios)
+            sets, masses = sets[feasible], masses[feasible]
+            sets, first = np.unique(sets, axis=0, return_index=True)
+            masses = masses[first]
+            scores = significant(np.sum(masses * self.scores[sets], axis=1))
+            # the sets are sorted by the chemical ids, which break the ties
+            top = np.lexsort(tuple(sets.T[::-1]) + (scores,))[:limit]
+            for i in top:
+                best[tuple(sets[i])] = (scores[i], masses[i])
+            for key in sorted(best, key=rank)[limit:]:
+                del best[key]
+
+        chunk, size, total = [], 0, 0
+        for block in self.candidates():
+            if maxcandidates is not None:
+                block = block[:maxcandidates - total]
+            chunk.append(block)
+            size += block.shape[0]
+            total += block.shape[0]
+            if size >= self.chunksize:
+                evaluate(np.vstack(chunk))
+                chunk, size = [], 0
+            if maxcandidates is not None and total >= maxcandidates:
+                break
+        if size > 0:
+            evaluate(np.vstack(chunk))
+
+        return [Recipe([self.chemicals[i] for i in key], best[key][1], float(best[key][0]))
+                for key in sorted(best, key=rank)]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+from batchcalc import cache
+from batchcalc.core import BatchRecord, ChemicalRecord
+from batchcalc.model import Batch, Chemical, Component, Kind
+
+__version__ = "0.3.1"
+
+
+class Repository(object):
+    '''
+    Read access to the database records needed by the calculation.
+
+    Args:
+        session :
+            SQLAlchemy session
+    '''
+
+    def __init__(self, session):
+
+        self.session = session
+
+    @property
+    def key(self):
+        '''
+        Hashable identifier of the database.
+        '''
+
+        return cache.database_key(self.session)
+
+    def batch_rows(self, chemical_ids):
+        '''
+        Return the batch records of the chemicals with `chemical_ids` as lists
+        of BatchRecord keyed on the chemical id, using a single query.
+        '''
+
+        rows = self.session.query(Batch.chemical_id, Batch.component_id,
+                                  Batch.coefficient, Component.formula,
+                                  Component.molwt).\
+            filter(Batch.chemical_id.in_(list(chemical_ids))).\
+            filter(Component.id == Batch.component_id).\
+            order_by(Batch.id).all()
+
+        res = {}
+        for row in rows:
+            res.setdefault(row[0], []).append(BatchRecord(*row))
+        return res
+
+    def chemicals(self, chemical_ids):
+        '''
+        Return the ChemicalRecord of the chemicals with `chemical_ids` keyed
+        on the chemical id.
+        '''
+
+        query = self.session.query(Chemical.id, Chemical.name, Kind.name,
+                                   Chemical.concentration, Chemical.molwt).\
+            join(Kind, Chemical._kind_id == Kind.id).\
+            filter(Chemical.id.in_(list(chemical_ids)))
+        return {row[0]: ChemicalRecord(*row) for row in query}
+
+    def water_molwt(self):
+        '''
+        Return the molecular weight of water, resolved once per database.
+        '''
+
+        molwt = cache.water_molwts.get(self.key)
+        if molwt is None:
+            molwt = self.session.query(Chemical.molwt).\
+                filter(Chemical.formula == "H2O").one()[0]
+            cache.water_molwts.put(self.key, molwt)
+        return molwt
+
+    def sources(self, component_ids):
+        '''
+        Return the sets of ids of the chemicals being sources of the
+        components with `component_ids` keyed on the component id.
+        '''
+
+        index = self.source_index()
+        return {cid: index[cid] for cid in component_ids if cid in index}
+
+    def source_index(self):
+        '''
+        Return the index of the sources of all the components, frozensets of
+        chemical ids keyed on the component id.
+
+        The index is built from the batch table once per database and kept
+        in memory until the database is modified.
+        '''
+
+        index = cache.source_indexes.get(self.key)
+        if index is None:
+            sources = {}
+            for cid, chid in self.session.query(Batch.component_id, Batch.chemical_id):
+                sources.setdefault(cid, set()).add(chid)
+            index = {cid: frozenset(chids) for cid, chids in sources.items()}
+            cache.source_indexes.put(self.key, index)
+        return index
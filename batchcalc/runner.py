@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from six.moves.urllib.request import pathname2url
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from batchcalc import core
+from batchcalc.model import (Chemical, Component, Synthesis,
+                             SynthesisChemical, SynthesisComponent)
+from batchcalc.repository import Repository
+
+__version__ = "0.3.1"
+
+
+SynthesisResult = namedtuple("SynthesisResult", ["synthesis_id", "chemical_ids", "masses", "error"])
+
+# session of the worker process and the path of its database, opened on the
+# first shard since the futures backport has no pool initializer
+_session = None
+_dbpath = None
+
+
+def _readonly_connect(dbpath):
+    '''
+    Return a read-only SQLite connection to the database at `dbpath`, where
+    URI filenames are not supported (Python 2) the connection is opened by
+    path and switched to the query only mode.
+    '''
+
+    uri = "file:{0:s}?mode=ro".format(pathname2url(dbpath))
+    try:
+        return sqlite3.connect(uri, uri=True)
+    except TypeError:
+        conn = sqlite3.connect(dbpath)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+
+def get_readonly_session(dbpath):
+    '''
+    Return a session using a read-only SQLite connection to the database at
+    `dbpath`.
+    '''
+
+    dbpath = os.path.abspath(dbpath)
+
+    engine = create_engine("sqlite:///{path:s}".format(path=dbpath),
+                           creator=lambda: _readonly_connect(dbpath),
+                           echo=False)
+    Session = sessionmaker(bind=engine, expire_on_commit=False,
+                           autoflush=False)
+    return Session()
+
+
+def recalculate(session, synthesis_ids):
+    '''
+    Recalculate the masses of chemicals for the stored syntheses with the
+    current concentrations and batch records.
+
+    The components and chemicals of all the syntheses are loaded with two
+    queries and the solvers are shared between the syntheses with the same
+    selection of chemicals and components.
+
+    Returns:
+        list of SynthesisResult, with the `error` message set and `masses`
+        equal to None if the calculation failed
+    '''
+
+    synthesis_ids = list(synthesis_ids)
+    repository = Repository(session)
+
+    components = {}
+    for scomp, comp in session.query(SynthesisComponent, Component).\
+            filter(SynthesisComponent.synthesis_id.in_(synthesis_ids)).\
+            filter(Component.id == SynthesisComponent.component_id).\
+            order_by(SynthesisComponent.id).all():
+        components.setdefault(scomp.synthesis_id, []).append((comp, scomp.moles))
+
+    chemicals = {}
+    for schem, chem in session.query(SynthesisChemical, Chemical).\
+            filter(SynthesisChemical.synthesis_id.in_(synthesis_ids)).\
+            filter(Chemical.id == SynthesisChemical.chemical_id).\
+            order_by(SynthesisChemical.id).all():
+        chemicals.setdefault(schem.synthesis_id, []).append(chem)
+
+    results = []
+    for sid in synthesis_ids:
+        comps = components.get(sid, [])
+        chems = chemicals.get(sid, [])
+        try:
+            masses = core.calculate_masses(chems, [c for c, _ in comps],
+                                           [m for _, m in comps], repository)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            results.append(SynthesisResult(sid, tuple(c.id for c in chems), None, str(e)))
+        else:
+            results.append(SynthesisResult(sid, tuple(c.id for c in chems), masses, None))
+    return results
+
+
+def _run_shard(dbpath, synthesis_ids):
+    '''
+    Recalculate a shard of syntheses in the worker process, the read-only
+    session is opened on the first call and reused afterwards.
+    '''
+
+    global _session, _dbpath
+    if _session is None or _dbpath != dbpath:
+        _session = get_readonly_session(dbpath)
+        _dbpath = dbpath
+    return recalculate(_session, synthesis_ids)
+
+
+def recalculate_syntheses(dbpath, synthesis_ids=None, processes=None,
+                          shardsize=200, progress=None):
+    '''
+    Recalculate the masses of chemicals for the stored syntheses using a pool
+    of worker processes, each with its own read-only connection.
+
+    Args:
+        dbpath : str
+            Path to the database
+        synthesis_ids : list of int
+            Ids of the syntheses to recalculate, all if None
+        processes : int
+            Number of worker processes, defaults to the number of CPUs
+        shardsize : int
+            Number of syntheses sent to a worker at once
+        progress : callable
+            Called as `progress(done, total)` after each finished shard
+
+    Returns:
+        list of SynthesisResult ordered by the synthesis id
+    '''
+
+    if synthesis_ids is None:
+        session = get_readonly_session(dbpath)
+        try:
+            synthesis_ids = [i for i, in session.query(Synthesis.id).order_by(Synthesis.id)]
+        finally:
+            session.close()
+
+    synthesis_ids = list(synthesis_ids)
+    total = len(synthesis_ids)
+    shards = [synthesis_ids[i:i + shardsize] for i in range(0, total, shardsize)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_run_shard, dbpath, shard) for shard in shards]
+        for future in as_completed(futures):
+            results.extend(future.result())
+            if progress is not None:
+                progress(len(results), total)
+
+    return sorted(results, key=lambda r: r.synthesis_id)
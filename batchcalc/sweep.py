@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+__version__ = "0.3.1"
+
+
+SweepChunk = namedtuple("SweepChunk", ["ratios", "masses", "residuals", "feasible"])
+
+
+def grid_design(levels, chunksize=10000):
+    '''
+    Generate the full factorial design over the given levels in chunks.
+
+    Args:
+        levels : list of array_like
+            Values of the mole ratios for each of the varied components
+        chunksize : int
+            Maximal number of points per chunk
+
+    Yields:
+        points : numpy.ndarray, shape (n, len(levels))
+    '''
+
+    levels = [np.asarray(lev, dtype=float) for lev in levels]
+    shape = tuple(lev.size for lev in levels)
+    npoints = int(np.prod(shape))
+
+    for start in range(0, npoints, chunksize):
+        idx = np.unravel_index(np.arange(start, min(start + chunksize, npoints)), shape)
+        yield np.column_stack([lev[i] for lev, i in zip(levels, idx)])
+
+
+def simplex_design(ndim, divisions, total=1.0, chunksize=10000):
+    '''
+    Generate the {ndim, divisions} simplex lattice design in chunks, all the
+    points have coordinates being multiples of `total / divisions` summing up
+    to `total`.
+
+    Args:
+        ndim : int
+            Number of the varied components
+        divisions : int
+            Number of divisions of the `total` amount
+        total : float
+            Sum of the mole ratios of the varied components
+        chunksize : int
+            Maximal number of points per chunk
+
+    Yields:
+        points : numpy.ndarray, shape (n, ndim)
+    '''
+
+    # stars and bars: positions of the ndim - 1 bars among the slots
+    bars = itertools.combinations(range(divisions + ndim - 1), ndim - 1)
+
+    while True:
+        chunk = list(itertools.islice(bars, chunksize))
+        if len(chunk) == 0:
+            return
+        chunk = np.array(chunk, dtype=int).reshape(len(chunk), ndim - 1)
+        edges = np.hstack([np.full((chunk.shape[0], 1), -1), chunk,
+                           np.full((chunk.shape[0], 1), divisions + ndim - 1)])
+        yield (np.diff(edges, axis=1) - 1) * (total / float(divisions))
+
+
+def latin_hypercube_design(bounds, npoints, seed=None, chunksize=10000):
+    '''
+    Generate a Latin hypercube sample of `npoints` points in chunks.
+
+    Only the stratum permutations, one integer per point and dimension, are
+    kept in memory, the points are drawn chunk by chunk.
+
+    Args:
+        bounds : list of tuples
+            (lower, upper) bounds of the mole ratios for each of the varied
+            components
+        npoints : int
+            Number of points
+        seed : int
+            Seed of the random number generator
+        chunksize : int
+            Maximal number of points per chunk
+
+    Yields:
+        points : numpy.ndarray, shape (n, len(bounds))
+    '''
+
+    rng = np.random.RandomState(seed)
+    bounds = np.asarray(bounds, dtype=float)
+    lower, upper = bounds[:, 0], bounds[:, 1]
+    strata = np.column_stack([rng.permutation(npoints) for _ in range(len(bounds))])
+
+    for start in range(0, npoints, chunksize):
+        perm = strata[start:start + chunksize]
+        unit = (perm + rng.random_sample(perm.shape)) / float(npoints)
+        yield lower + unit * (upper - lower)
+
+
+class CompositionSweep(object):
+    '''
+    Solve the batch equations over a design of compositions.
+
+    The selected `components` are varied according to the design while all
+    the other components of the `calculator` keep their current mole ratios.
+    The batch matrix is factorized once and every chunk of the design is
+    solved with a single matrix product.
+
+    Args:
+        calculator : BatchCalculator
+            Calculator with the selected components and chemicals
+        session :
+            SQLAlchemy session
+        components : list of Component
+            Components varied in the design, in the order of the design columns
+        tolerance : float
+            Masses larger than `-tolerance` are considered non-negative
+        nonnegative : bool
+            Use the non-negative least squares solver instead of the least
+            squares solution
+        rtol : float
+            Largest relative composition error of a feasible point, the
+            points with a non-negative least squares solution are not
+            feasible if the chemicals cannot produce the composition
+    '''
+
+    def __init__(self, calculator, session, components, tolerance=1.0e-10,
+                 nonnegative=False, rtol=1.0e-6):
+
+        self.calculator = calculator
+        self.solver = calculator.prepare_solver(session)
+        self.tolerance = tolerance
+        self.nonnegative = nonnegative
+        self.rtol = rtol
+
+        ids = [c.id for c in calculator.components]
+        for comp in components:
+            if comp.id not in ids:
+                raise ValueError("component not selected: {0:s}".format(comp.name))
+        self.columns = [ids.index(c.id) for c in components]
+        self.base = np.array([c.moles for c in calculator.components], dtype=float)
+
+    def get_ratios(self, points):
+        '''
+        Return the full mole ratio vectors for the design `points`.
+        '''
+
+        ratios = np.tile(self.base, (points.shape[0], 1))
+        ratios[:, self.columns] = points
+        return ratios
+
+    def run(self, design):
+        '''
+        Solve the sweep over the `design`, an iterable of point chunks as
+        returned by the `*_design` generators.
+
+        Yields:
+            SweepChunk with the mole ratios, masses of chemicals, norms of the
+            composition errors and a boolean array flagging the feasible
+            points
+        '''
+
+        last = None
+        for points in design:
+            ratios = self.get_ratios(np.atleast_2d(points))
+            A = self.solver.component_masses(ratios)
+            if self.nonnegative:
+                # warm start from the last point of the previous chunk
+                masses, residuals = self.solver.masses_nonnegative(ratios, masses0=last)
+                last = masses[-1]
+                feasible = np.ones(masses.shape[0], dtype=bool)
+            else:
+                masses = self.solver.masses(ratios)
+                residuals = self.solver.residuals(A, masses * self.solver.concentrations)
+                feasible = np.all(masses > -self.tolerance, axis=1)
+            feasible &= residuals <= self.rtol * np.linalg.norm(A, axis=1)
+            yield SweepChunk(ratios, masses, residuals, feasible)
+
+    def to_csv(self, path, design, delimiter=",", fmt="%.6g"):
+        '''
+        Solve the sweep over the `design` writing the results to a text file
+        chunk by chunk, so the whole design is never kept in memory.
+
+        Returns:
+            (npoints, nfeasible) : tuple of int
+        '''
+
+        header = [c.listctrl_label() for c in self.calculator.components] +\
+                 [c.listctrl_label() for c in self.calculator.chemicals] +\
+                 ["residual", "feasible"]
+
+        npoints = nfeasible = 0
+        with open(path, "wb") as fobj:
+            fobj.write((delimiter.join(header) + "\n").encode("utf-8"))
+            for chunk in self.run(design):
+                data = np.column_stack([chunk.ratios, chunk.masses,
+                                        chunk.residuals,
+                                        chunk.feasible.astype(float)])
+                np.savetxt(fobj, data, delimiter=delimiter, fmt=fmt)
+                npoints += data.shape[0]
+                nfeasible += int(chunk.feasible.sum())
+        return npoints, nfeasible
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+import numpy as np
+
+from batchcalc import cache, core
+from batchcalc.model import SynthesisComponent
+
+__version__ = "0.3.1"
+
+
+class SynthesisMatrix(object):
+    '''
+    Dense matrix of the moles of the components of all the stored syntheses.
+
+    Args:
+        synthesis_ids : numpy.ndarray of int, shape (n_syntheses,)
+            Ids of the syntheses, rows of the matrix
+        component_ids : numpy.ndarray of int, shape (n_components,)
+            Ids of the components, columns of the matrix
+        moles : numpy.ndarray, shape (n_syntheses, n_components)
+            Moles of the components, zero for the components not used in a
+            synthesis
+    '''
+
+    def __init__(self, synthesis_ids, component_ids, moles):
+
+        self.synthesis_ids = np.asarray(synthesis_ids, dtype=int)
+        self.component_ids = np.asarray(component_ids, dtype=int)
+        self.moles = np.asarray(moles, dtype=float)
+        self._rows = {sid: i for i, sid in enumerate(self.synthesis_ids.tolist())}
+        self._cols = {cid: j for j, cid in enumerate(self.component_ids.tolist())}
+
+    @classmethod
+    def from_records(cls, records):
+        '''
+        Build the matrix from (synthesis id, component id, moles) tuples, the
+        moles of repeated components of a synthesis are summed.
+        '''
+
+        records = list(records)
+        if len(records) == 0:
+            return cls([], [], np.zeros((0, 0)))
+        sids, cids, moles = zip(*records)
+        synthesis_ids, rows = np.unique(np.asarray(sids, dtype=int), return_inverse=True)
+        component_ids, cols = np.unique(np.asarray(cids, dtype=int), return_inverse=True)
+        matrix = np.zeros((synthesis_ids.size, component_ids.size), dtype=float)
+        np.add.at(matrix, (rows, cols), np.asarray(moles, dtype=float))
+        return cls(synthesis_ids, component_ids, matrix)
+
+    def column(self, component):
+        '''
+        Return the index of the column of `component`, a component or its id.
+        '''
+
+        cid = getattr(component, "id", component)
+        try:
+            return self._cols[cid]
+        except KeyError:
+            raise ValueError("component not used in any synthesis: {0}".format(cid))
+
+    def row(self, synthesis):
+        '''
+        Return the index of the row of `synthesis`, a synthesis or its id.
+        '''
+
+        sid = getattr(synthesis, "id", synthesis)
+        try:
+            return self._rows[sid]
+        except KeyError:
+            raise ValueError("no such synthesis: {0}".format(sid))
+
+    def normalize(self, reference, value=1.0):
+        '''
+        Return the mole ratios of all the syntheses normalized so that the
+        `reference` component, e.g. SiO2 or Al2O3, has the mole ratio
+        `value`. The syntheses without the reference component have NaN or
+        infinite ratios.
+
+        Returns:
+            numpy.ndarray, shape (n_syntheses, n_components)
+        '''
+
+        return core.normalize_moles(self.moles, self.column(reference), value)
+
+    def select(self, components, reference=None, value=1.0):
+        '''
+        Return the columns of the `components`, normalized to the `reference`
+        component if given.
+
+        Returns:
+            numpy.ndarray, shape (n_syntheses, len(components))
+        '''
+
+        cols = [self.column(c) for c in components]
+        if reference is None:
+            return self.moles[:, cols]
+        return self.normalize(reference, value)[:, cols]
+
+
+class CompositionIndex(object):
+    '''
+    Nearest neighbour index of the syntheses by their compositions.
+
+    The compositions are closed to unit sum and compared in the log-ratio
+    space, log(x + floor), with the `floor` standing for the components
+    absent from a composition. The nearest syntheses are found by a single
+    matrix-vector product with the stored features, which takes a few
+    milliseconds for tens of thousands of syntheses, and the index is
+    updated in place when a synthesis is added, modified or removed.
+
+    Args:
+        matrix : SynthesisMatrix
+            Moles of the stored syntheses
+        floor : float
+            Mole fraction assigned to the absent components
+    '''
+
+    def __init__(self, matrix, floor=1.0e-4):
+
+        self.floor = floor
+        self.synthesis_ids = list(matrix.synthesis_ids.tolist())
+        self.component_ids = list(matrix.component_ids.tolist())
+        self._rows = {sid: i for i, sid in enumerate(self.synthesis_ids)}
+        self._cols = {cid: j for j, cid in enumerate(self.component_ids)}
+        self.features = self.get_features(matrix.moles)
+        self.sqnorms = np.sum(self.features**2, axis=1)
+
+    def __len__(self):
+        return len(self.synthesis_ids)
+
+    def get_features(self, moles):
+        '''
+        Return the log-ratio features of the compositions `moles`, one per
+        row.
+        '''
+
+        moles = np.atleast_2d(np.asarray(moles, dtype=float))
+        totals = moles.sum(axis=1)[:, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fractions = np.where(totals > 0.0, moles / totals, 0.0)
+        return np.log(fractions + self.floor)
+
+    def vector(self, composition):
+        '''
+        Return the features of the `composition`, moles keyed on the
+        component id, over the indexed components and the squared distance
+        contributed by the components not in the index.
+        '''
+
+        ids = list(composition.keys())
+        feats = self.get_features([composition[cid] for cid in ids])[0]
+        vec = np.full(len(self.component_ids), np.log(self.floor))
+        extra = 0.0
+        for cid, f in zip(ids, feats):
+            if cid in self._cols:
+                vec[self._cols[cid]] = f
+            else:
+                extra += (f - np.log(self.floor))**2
+        return vec, extra
+
+    def query(self, composition, k=10):
+        '''
+        Return the `k` syntheses closest to the `composition`, moles keyed
+        on the component id, as a list of (synthesis id, distance) tuples
+        sorted by the distance.
+        '''
+
+        if len(self) == 0:
+            return []
+        vec, extra = self.vector(composition)
+        dist2 = self.sqnorms - 2.0 * np.dot(self.features, vec) + np.dot(vec, vec) + extra
+        k = min(k, len(self))
+        nearest = np.argpartition(dist2, k - 1)[:k]
+        nearest = nearest[np.argsort(dist2[nearest])]
+        return [(self.synthesis_ids[i], float(np.sqrt(max(dist2[i], 0.0)))) for i in nearest]
+
+    def update(self, synthesis_id, composition):
+        '''
+        Add or replace the synthesis `synthesis_id` with the `composition`,
+        moles keyed on the component id.
+        '''
+
+        new = [cid for cid in composition if cid not in self._cols]
+        if len(new) > 0:
+            for cid in new:
+                self._cols[cid] = len(self.component_ids)
+                self.component_ids.append(cid)
+            pad = np.full((len(self), len(new)), np.log(self.floor))
+            self.features = np.hstack([self.features, pad])
+            self.sqnorms = self.sqnorms + len(new) * np.log(self.floor)**2
+
+        vec, _ = self.vector(composition)
+        if synthesis_id in self._rows:
+            i = self._rows[synthesis_id]
+            self.features[i] = vec
+            self.sqnorms[i] = np.dot(vec, vec)
+        else:
+            self._rows[synthesis_id] = len(self.synthesis_ids)
+            self.synthesis_ids.append(synthesis_id)
+            self.features = np.vstack([self.features.reshape(-1, len(vec)), vec])
+            self.sqnorms = np.append(self.sqnorms, np.dot(vec, vec))
+
+    def remove(self, synthesis_id):
+        '''
+        Remove the synthesis `synthesis_id` from the index.
+        '''
+
+        i = self._rows.pop(synthesis_id, None)
+        if i is None:
+            return
+        del self.synthesis_ids[i]
+        self.features = np.delete(self.features, i, axis=0)
+        self.sqnorms = np.delete(self.sqnorms, i)
+        self._rows = {sid: j for j, sid in enumerate(self.synthesis_ids)}
+
+
+def synthesis_matrix(session):
+    '''
+    Return the SynthesisMatrix of all the syntheses stored in the database.
+
+    The matrix is loaded with a single query and kept in memory until the
+    syntheses or the database are modified, the array of moles is read-only.
+    '''
+
+    key = cache.database_key(session)
+    matrix = cache.synthesis_matrices.get(key)
+    if matrix is None:
+        query = session.query(SynthesisComponent.synthesis_id,
+                              SynthesisComponent.component_id,
+                              SynthesisComponent.moles)
+        matrix = SynthesisMatrix.from_records(query)
+        matrix.moles.setflags(write=False)
+        cache.synthesis_matrices.put(key, matrix)
+    return matrix
+
+
+def composition_index(session):
+    '''
+    Return the CompositionIndex of all the syntheses stored in the database,
+    built once per database and updated by the synthesis record functions.
+    '''
+
+    key = cache.database_key(session)
+    index = cache.composition_indexes.get(key)
+    if index is None:
+        index = CompositionIndex(synthesis_matrix(session))
+        cache.composition_indexes.put(key, index)
+    return index
+
+
+def update_index(session, synthesis):
+    '''
+    Update the cached composition index with the added or modified
+    `synthesis`, nothing is done if the index was not built yet.
+    '''
+
+    index = cache.composition_indexes.get(cache.database_key(session))
+    if index is not None:
+        composition = {}
+        for scomp in synthesis.components:
+            composition[scomp.component_id] = composition.get(scomp.component_id, 0.0) + scomp.moles
+        index.update(synthesis.id, composition)
+
+
+def remove_from_index(session, synthesis_id):
+    '''
+    Remove the deleted synthesis from the cached composition index.
+    '''
+
+    index = cache.composition_indexes.get(cache.database_key(session))
+    if index is not None:
+        index.remove(synthesis_id)
+
+
+def closest_syntheses(session, composition, k=10):
+    '''
+    Return the `k` stored syntheses closest to the `composition`, moles keyed
+    on the component id, as a list of (synthesis id, distance) tuples.
+    '''
+
+    return composition_index(session).query(composition, k)
@@ -39,9 +39,19 @@ from batchcalc.utils import get_resource_path
 __version__ = "0.3.1"
 
 
-def get_report_as_string(flags, model):
+def get_report_as_string(flags, model, sensitivity=None):
     '''
     Return a string with a report in the TeX format.
+
+    Args:
+        flags : dict
+            Options of the report
+        model : BatchCalculator
+            Calculator with the calculated masses
+        sensitivity : Sensitivity
+            Derivatives of the masses as returned by
+            `BatchCalculator.sensitivity`, required if the "sensitivity" flag
+            is set
     '''
 
     env = Environment('<*', '*>', '<<', '>>', '<#', '#>',
@@ -57,6 +67,10 @@ def get_report_as_string(flags, model):
         flags['a_matrix'] = tex_A(model)
     if flags["batch"]:
         flags['b_matrix'] = tex_B(model)
+    if flags.get("sensitivity", False):
+        if sensitivity is None:
+            raise ValueError("sensitivity report requested without the sensitivities")
+        flags['s_matrix'] = tex_sensitivity(model, sensitivity)
     if flags["rescale_all"]:
         flags['rescale_all_factor'] = u'{0:8.4f}'.format(model.scale_all)
         flags['x_matrix'] = tex_X(model)
@@ -91,6 +105,29 @@ def tex_B(model):
     return table + r'\bottomrule\end{tabularx}'+u'\n'+r'\end{center}'+u'\n'
 
 
+def tex_sensitivity(model, sens):
+    '''
+    Return the tables with the derivatives `sens` of the masses of chemicals
+    with respect to the mole ratios and the concentrations.
+    '''
+
+    cols = [j for j, c in enumerate(model.chemicals) if c.kind != "mixture"]
+
+    tshape = u'{l' + u'R' * len(model.components) + u'}'
+    table = r'\begin{center}'+u'\n'+r'\begin{tabularx}{\textwidth}'+tshape+r'\toprule'+u'\n'
+    table += u'Chemical &' + ' & '.join([r'\multicolumn{1}{c}{$\partial/\partial$'+c.tex_label()+r'}' for c in model.components]) + r'\\ \midrule' + u'\n'
+    for chem, row in zip(model.chemicals, sens.ratios):
+        table += chem.tex_label() + u' & ' + u' & '.join(["{0:10.4f}".format(x) for x in row]) + r'\\' + u'\n'
+    table += r'\bottomrule\end{tabularx}'+u'\n'+r'\end{center}'+u'\n'
+
+    tshape = u'{l' + u'R' * len(cols) + u'}'
+    table += r'\begin{center}'+u'\n'+r'\begin{tabularx}{\textwidth}'+tshape+r'\toprule'+u'\n'
+    table += u'Chemical &' + ' & '.join([r'\multicolumn{1}{c}{$\partial/\partial c$ '+model.chemicals[j].tex_label()+r'}' for j in cols]) + r'\\ \midrule' + u'\n'
+    for chem, row in zip(model.chemicals, sens.concentrations):
+        table += chem.tex_label() + u' & ' + u' & '.join(["{0:10.4f}".format(row[j]) for j in cols]) + r'\\' + u'\n'
+    return table + r'\bottomrule\end{tabularx}'+u'\n'+r'\end{center}'+u'\n'
+
+
 def tex_X(model):
 
     masssum = sum([s.mass for s in model.chemicals])
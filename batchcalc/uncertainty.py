@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+#    Zeolite Batch Calculator
+#
+# A program for calculating the correct amount of reagents (batch) for a
+# particular zeolite composition given by the molar ratio of its components.
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Lukasz Mentel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, unicode_literals
+
+from collections import namedtuple
+
+import numpy as np
+
+from batchcalc import core
+from batchcalc.repository import Repository
+
+__version__ = "0.3.1"
+
+
+UncertaintyResult = namedtuple("UncertaintyResult", ["percentiles", "values", "nominal", "std"])
+
+
+class UncertaintyPropagation(object):
+    '''
+    Propagate the weighing errors and the uncertainties of the concentrations
+    and molecular weights to the mole ratios of the components achieved by a
+    recipe, with a Monte Carlo sampling.
+
+    All the samples are drawn and evaluated as arrays. The rows of the batch
+    matrix of the "solution" kind chemicals depend on the concentration and
+    the rows of the "solution" and "reactant" kind chemicals on the
+    molecular weights, these rows are evaluated for every sample with the
+    kernels of their kind, all the other rows are shared by the samples.
+
+    Args:
+        calculator : BatchCalculator
+            Calculator with the selected components and chemicals, the
+            current mole ratios of the components define the recipe
+        session :
+            SQLAlchemy session
+        masses : array_like, shape (n_chemicals,)
+            Weighed masses of the chemicals, by default the masses calculated
+            for the current mole ratios
+        mass_sd : float
+            Standard deviation of the weighed masses in grams
+        mass_rsd : float
+            Relative standard deviation of the weighed masses
+        concentration_sd : float or dict
+            Standard deviation of the concentrations, a single value for all
+            the chemicals or values keyed on the chemical id
+        molwt_rsd : float
+            Relative standard deviation of the molecular weights of the
+            components, the molecular weights of the solutes and water
+            follow the ones of their components
+    '''
+
+    def __init__(self, calculator, session, masses=None, mass_sd=0.0,
+                 mass_rsd=0.0, concentration_sd=0.0, molwt_rsd=0.0):
+
+        chemicals = calculator.chemicals
+        components = calculator.components
+
+        solver = calculator.prepare_solver(session)
+        self.nominal = np.array([c.moles for c in components], dtype=float)
+        if masses is None:
+            masses = solver.masses(self.nominal)
+        self.masses = np.asarray(masses, dtype=float)
+        if self.masses.shape != (len(chemicals),):
+            raise ValueError("expected {0:d} masses, got {1:d}".format(
+                             len(chemicals), self.masses.size))
+
+        self.B = solver.B
+        self.molwts = solver.molwts
+        self.mass_sd = mass_sd
+        self.mass_rsd = mass_rsd
+        self.molwt_rsd = molwt_rsd
+
+        self.concentrations = np.array([c.concentration for c in chemicals], dtype=float)
+        if isinstance(concentration_sd, dict):
+            self.concentration_sd = np.array([concentration_sd.get(c.id, 0.0)
+                                              for c in chemicals], dtype=float)
+        else:
+            self.concentration_sd = np.repeat(float(concentration_sd), len(chemicals))
+
+        kinds = np.array([c.kind for c in chemicals])
+        self.reactant = kinds == "reactant"
+        # the solution rows with uncertain concentration vary and with the
+        # uncertain molecular weights all the rows except the mixture ones,
+        # which are weight fractions
+        varied = (kinds == "solution") & (self.concentration_sd > 0.0)
+        if molwt_rsd > 0.0:
+            varied |= kinds != "mixture"
+        self.varied = np.flatnonzero(varied)
+        self.fixed = np.setdiff1d(np.arange(len(chemicals)), self.varied)
+        self.kinds = kinds[self.varied]
+
+        owner, coefs, molwts, water, cids = [], [], [], [], []
+        if self.varied.size > 0:
+            repository = Repository(session)
+            self.water_molwt = repository.water_molwt()
+            rows = repository.batch_rows([chemicals[i].id for i in self.varied])
+            for j, i in enumerate(self.varied):
+                for row in rows.get(chemicals[i].id, []):
+                    owner.append(j)
+                    coefs.append(row.coefficient)
+                    molwts.append(row.molwt)
+                    water.append(row.formula == "H2O")
+                    cids.append(row.component_id)
+        self.owner = np.array(owner, dtype=int)
+        self.coefs = np.array(coefs, dtype=float)
+        self.rowmolwts = np.array(molwts, dtype=float)
+        self.water = np.array(water, dtype=bool)
+        self.solute_molwts = np.array([chemicals[i].molwt for i in self.varied],
+                                      dtype=float)
+
+        # components with the perturbed molecular weights and their positions
+        # for the selected components, the batch records and water
+        compids = [c.id for c in components]
+        self.molwt_ids = np.unique(np.array(compids + cids, dtype=int))
+        self.component_index = np.searchsorted(self.molwt_ids, compids)
+        self.row_index = np.searchsorted(self.molwt_ids, np.array(cids, dtype=int))
+        waterids = np.array(cids, dtype=int)[self.water]
+        self.water_index = None
+        if waterids.size > 0:
+            self.water_index = int(np.searchsorted(self.molwt_ids, waterids[0]))
+
+        # scatter of the batch records into the columns of the components
+        colidx = {cid: j for j, cid in enumerate(compids)}
+        cols = np.array([colidx.get(cid, -1) for cid in cids], dtype=int)
+        self.scatter = np.zeros((len(owner), len(components)), dtype=float)
+        keep = cols >= 0
+        self.scatter[np.flatnonzero(keep), cols[keep]] = 1.0
+
+    def sample_concentrations(self, rng, nsamples):
+        '''
+        Return the perturbed concentrations, limited to the (0, 1] interval.
+        '''
+
+        conc = self.concentrations + self.concentration_sd * rng.standard_normal(
+            (nsamples, self.concentrations.size))
+        return np.clip(conc, 1.0e-6, 1.0)
+
+    def sample_molwt_factors(self, rng, nsamples):
+        '''
+        Return the factors of the perturbed molecular weights of the
+        components in `self.molwt_ids` with shape (N, n_ids).
+        '''
+
+        if self.molwt_rsd == 0.0:
+            return np.ones((nsamples, self.molwt_ids.size))
+        return 1.0 + self.molwt_rsd * rng.standard_normal((nsamples, self.molwt_ids.size))
+
+    def varied_rows(self, conc, factors):
+        '''
+        Return the weight fractions of the batch records of the varied
+        chemicals for every sample, `conc` holds the concentrations of the
+        varied chemicals with shape (N, n_varied) and `factors` the factors of
+        the molecular weights returned by `sample_molwt_factors`.
+        '''
+
+        nsamples = conc.shape[0]
+        molwts = self.rowmolwts * factors[:, self.row_index]
+        fractions = np.zeros((nsamples, self.owner.size))
+
+        for kind in ("solution", "reactant"):
+            # chemicals of the kind and their batch records, the chemicals are
+            # renumbered consecutively for every sample
+            chemidx = np.flatnonzero(self.kinds == kind)
+            sel = np.flatnonzero(self.kinds[self.owner] == kind)
+            if sel.size == 0:
+                continue
+            local = np.searchsorted(chemidx, self.owner[sel])
+            owner = (np.arange(nsamples)[:, np.newaxis] * chemidx.size + local).ravel()
+            coefs = np.tile(self.coefs[sel], nsamples)
+            if kind == "solution":
+                # the solute molecular weights change with the ones of their
+                # components
+                weights = self.coefs[sel] * self.rowmolwts[sel]
+                onehot = (local[:, np.newaxis] == np.arange(chemidx.size)) * weights[:, np.newaxis]
+                solute = self.solute_molwts[chemidx] * np.dot(
+                    factors[:, self.row_index[sel]], onehot) / onehot.sum(axis=0)
+                water = np.full(nsamples, self.water_molwt)
+                if self.water_index is not None:
+                    water *= factors[:, self.water_index]
+                fractions[:, sel] = core.solution_fractions(
+                    owner, coefs, molwts[:, sel].ravel(), np.tile(self.water[sel], nsamples),
+                    conc[:, chemidx].ravel(), solute.ravel(),
+                    np.repeat(water, chemidx.size)).reshape(nsamples, sel.size)
+            else:
+                fractions[:, sel] = core.reactant_fractions(
+                    owner, coefs, molwts[:, sel].ravel()).reshape(nsamples, sel.size)
+        return fractions
+
+    def sample(self, nsamples, seed=None):
+        '''
+        Draw `nsamples` perturbed recipes and return the achieved moles of the
+        components.
+
+        Returns:
+            numpy.ndarray, shape (nsamples, n_components)
+        '''
+
+        rng = np.random.RandomState(seed)
+        nchem = self.masses.size
+
+        masses = self.masses * (1.0 + self.mass_rsd * rng.standard_normal((nsamples, nchem)))
+        masses += self.mass_sd * rng.standard_normal((nsamples, nchem))
+        conc = self.sample_concentrations(rng, nsamples)
+        factors = self.sample_molwt_factors(rng, nsamples)
+
+        X = np.where(self.reactant, masses * conc, masses)
+        A = np.dot(X[:, self.fixed], self.B[self.fixed])
+        if self.varied.size > 0:
+            fractions = self.varied_rows(conc[:, self.varied], factors)
+            A += np.dot(X[:, self.varied][:, self.owner] * fractions, self.scatter)
+
+        return A / (self.molwts * factors[:, self.component_index])
+
+    def percentiles(self, nsamples=10000, q=(2.5, 50.0, 97.5), reference=None,
+                    seed=None):
+        '''
+        Return the percentiles of the achieved mole ratios.
+
+        Args:
+            nsamples : int
+                Number of the Monte Carlo samples
+            q : sequence of float
+                Percentiles to compute, between 0 and 100
+            reference : int
+                Index of the component the mole ratios are normalized to, the
+                reference keeps its nominal mole ratio, by default the moles
+                are not normalized
+            seed : int
+                Seed of the random number generator
+
+        Returns:
+            UncertaintyResult with the percentiles, their values with shape
+            (len(q), n_components), the nominal mole ratios and the standard
+            deviations of the mole ratios
+        '''
+
+        moles = self.sample(nsamples, seed=seed)
+        if reference is not None:
+            moles *= self.nominal[reference] / moles[:, reference:reference + 1]
+        q = np.asarray(q, dtype=float)
+        return UncertaintyResult(q, np.percentile(moles, q, axis=0),
+                                 self.nominal.copy(), moles.std(axis=0))
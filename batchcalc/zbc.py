@@ -43,13 +43,15 @@ import wx
 import wx.grid as gridlib
 from wx.lib.wordwrap import wordwrap
 
-from ObjectListView import ObjectListView
+from ObjectListView import ObjectListView, EVT_CELL_EDIT_FINISHED
 
 from batchcalc.tex_writer import get_report_as_string
 from batchcalc.pdf_writer import create_pdf, create_pdf_composition
 from batchcalc.calculator import BatchCalculator
 from batchcalc import controller as ctrl
 from batchcalc import dialogs
+from batchcalc import syntheses
+from batchcalc.model import Synthesis
 
 from batchcalc.utils import get_columns
 
@@ -103,6 +105,7 @@ class AddModifyDBBaseFrame(wx.Frame):
         mainSizer.Add(self.olv, 1, wx.ALL | wx.EXPAND, 5)
         mainSizer.Add(btnSizer, 0, wx.CENTER)
         self.SetSizer(mainSizer)
+        self.btnSizer = btnSizer
 
     def onAddRecord(self, event):
         '''Add a record to the database'''
@@ -142,6 +145,11 @@ class AddModifyBatchTableFrame(AddModifyDBBaseFrame):
         self.model = parent.model
         self.cols = ["id", "chemical", "component", "coeff", "reaction"]
 
+        deriveRecordsBtn = wx.Button(self, label="Derive")
+        deriveRecordsBtn.Bind(wx.EVT_BUTTON, self.onDeriveRecords)
+        self.btnSizer.Add(deriveRecordsBtn, 0, wx.ALL, 5)
+        self.Layout()
+
         self.show_all()
 
     def onAddRecord(self, event):
@@ -181,6 +189,27 @@ class AddModifyBatchTableFrame(AddModifyDBBaseFrame):
         ctrl.delete_batch_record(db.session, sel_row.id)
         self.show_all()
 
+    def onDeriveRecords(self, event):
+        '''
+        Add the batch records derived from the element balances for the
+        chemicals that do not have any
+        '''
+
+        db = ctrl.DB()
+        try:
+            rejected = ctrl.add_derived_batch_records(db.session)
+        except ValueError as err:
+            dialogs.show_message_dlg(str(err), "Error")
+            return
+        if len(rejected) > 0:
+            chemicals = dict((c.id, c.name) for c in db.get_chemicals(showall=True))
+            message = "\n".join("{0:s}: {1:s}".format(chemicals[p.chemical_id], p.status)
+                                 for p in rejected)
+            dialogs.show_message_dlg("Batch records have to be entered by hand "
+                                     "for:\n" + message, "Warning",
+                                     wx.OK | wx.ICON_WARNING)
+        self.show_all()
+
     def onShowAllRecords(self, event):
         '''Update the record list to show all of them'''
 
@@ -591,6 +620,14 @@ class ShowSynthesesFrame(wx.Frame):
         exportRecordBtn.Bind(wx.EVT_BUTTON, self.onExportRecord)
         btnSizer.Add(exportRecordBtn, 0, wx.ALL, 5)
 
+        similarRecordBtn = wx.Button(self, label="Similar")
+        similarRecordBtn.Bind(wx.EVT_BUTTON, self.onSimilarRecords)
+        btnSizer.Add(similarRecordBtn, 0, wx.ALL, 5)
+
+        allRecordsBtn = wx.Button(self, label="All")
+        allRecordsBtn.Bind(wx.EVT_BUTTON, self.onShowAll)
+        btnSizer.Add(allRecordsBtn, 0, wx.ALL, 5)
+
         cancelBtn = wx.Button(self, label="Cancel")
         cancelBtn.Bind(wx.EVT_BUTTON, self.OnCloseFrame)
         self.Bind(wx.EVT_CLOSE, self.OnCloseFrame)
@@ -705,6 +742,27 @@ class ShowSynthesesFrame(wx.Frame):
         ctrl.delete_synthesis_record(db.session, sel_row.id)
         self.show_all()
 
+    def onSimilarRecords(self, event):
+        'Show the syntheses with the compositions closest to the selected one'
+
+        db = ctrl.DB()
+        sel_row = self.olv.GetSelectedObject()
+        if sel_row is None:
+            dialogs.show_message_dlg("No row selected", "Error")
+            return
+        composition = {}
+        for scomp in sel_row.components:
+            composition[scomp.component_id] = composition.get(scomp.component_id, 0.0) + scomp.moles
+        closest = syntheses.closest_syntheses(db.session, composition, k=10)
+        ids = [sid for sid, _ in closest]
+        records = {s.id: s for s in db.session.query(Synthesis).filter(Synthesis.id.in_(ids))}
+        self.set_olv([records[sid] for sid in ids if sid in records])
+
+    def onShowAll(self, event):
+        'Show all the synthesis records'
+
+        self.show_all()
+
     def onLoadRecord(self, event):
         'Load a record into the batch calculator'
 
@@ -941,6 +999,7 @@ class InputPanel(wx.Panel):
 
         zeobtn.Bind(wx.EVT_BUTTON, self.OnAddRemoveComponents)
         rctbtn.Bind(wx.EVT_BUTTON, self.OnAddRemoveChemicals)
+        self.comp_olv.Bind(EVT_CELL_EDIT_FINISHED, self.OnComponentEdited)
 
     def OnAddRemoveComponents(self, event):
         '''
@@ -958,6 +1017,16 @@ class InputPanel(wx.Panel):
         self.comp_olv.SetObjects(self.model.components)
         self.dlg.Destroy()
 
+    def OnComponentEdited(self, event):
+        '''
+        Update the results live after a mole ratio was edited.
+        '''
+
+        event.Skip()
+        outpanel = getattr(self.GetTopLevelParent(), "outpanel", None)
+        if isinstance(outpanel, OutputPanel):
+            outpanel.update_results()
+
     def OnAddRemoveChemicals(self, event):
         '''
         Show the dialog with the chemicals retrieved from the database.
@@ -1129,6 +1198,19 @@ class OutputPanel(wx.Panel):
         self.resultOlv.SetObjects(self.model.chemicals)
         self.Layout()
 
+    def update_results(self):
+        '''
+        Incrementally update and display the unscaled masses after a change of
+        the mole ratios, scaled results are updated on Calculate only.
+        '''
+
+        scale_type = next(x[0] for x in self.scaling_ctrls if x[1].GetValue())
+
+        if self.model.calculated and scale_type == 'none':
+            db = ctrl.DB()
+            self.model.calculate_masses_incremental(db.session)
+            self.resultOlv.SetObjects(self.model.chemicals)
+
     def rescale_all(self, statictext):
         '''
         Retrieve a float from a TextCtrl dialog, rescale the result and print
@@ -1672,6 +1754,7 @@ class MainFrame(wx.Frame):
     def OnExit(self, event):
         db = ctrl.DB()
         db.session.close()
+        ctrl.dispose_engines()
         self.Close()
 
     def OnExportTex(self, event):
@@ -1687,8 +1770,12 @@ class MainFrame(wx.Frame):
         result = etexdialog.ShowModal()
         if result == wx.ID_OK:
             flags = etexdialog.get_data()
+            if flags.get("sensitivity", False):
+                sensitivity = self.model.sensitivity(db.session)
+            else:
+                sensitivity = None
             # get the string with contents of the TeX report
-            tex = get_report_as_string(flags, self.model)
+            tex = get_report_as_string(flags, self.model, sensitivity)
             self.OnSaveTeX(tex, flags['typeset'], flags['pdflatex'])
 
     def OnExportPdf(self, event):
@@ -1759,6 +1846,9 @@ class MainFrame(wx.Frame):
 
         if dlg.ShowModal() == wx.ID_OK:
             path = dlg.GetPath()
+            # drop the connections and cached data of a database previously
+            # opened from the same path
+            ctrl.dispose_engines([path])
             if os.path.exists(path):
                 os.remove(path)
 
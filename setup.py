@@ -40,6 +40,7 @@ setup(
         'wxpython',
         'objectlistview',
         'six',
+        'futures; python_version < "3"',
     ],
     long_description=readme(),
     packages=["batchcalc"],
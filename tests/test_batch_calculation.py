@@ -0,0 +1,309 @@
+import os
+import unittest
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from batchcalc.calculator import BatchCalculator
+from batchcalc.core import PreparedSolver
+from batchcalc.repository import Repository
+from batchcalc.tex_writer import tex_sensitivity
+from batchcalc.model import Chemical, Component
+
+DBPATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'batchcalc', 'data', 'zeolite.db')
+
+
+def get_session():
+
+    engine = create_engine("sqlite:///{path:s}".format(path=DBPATH), echo=False)
+    return sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)()
+
+
+def get_calculator(session, components, chemicals):
+    '''
+    Return a BatchCalculator with the components given as a list of
+    (id, moles) tuples and the chemicals given as a list of ids.
+    '''
+
+    bc = BatchCalculator()
+    for cid, moles in components:
+        comp = session.query(Component).filter(Component.id == cid).one()
+        comp.moles = moles
+        bc.components.append(comp)
+    for cid in chemicals:
+        bc.chemicals.append(session.query(Chemical).filter(Chemical.id == cid).one())
+    return bc
+
+
+def finite_differences(bc, session, h=1.0e-6):
+    '''
+    Central differences of the masses with respect to the mole ratios and the
+    concentrations.
+    '''
+
+    ratios = np.array([c.moles for c in bc.components])
+    steps = np.vstack([ratios - h * np.eye(ratios.size), ratios + h * np.eye(ratios.size)])
+    masses = bc.calculate_masses_batch(steps, session)
+    dratios = (masses[ratios.size:] - masses[:ratios.size]).T / (2.0 * h)
+
+    dconcs = np.zeros((len(bc.chemicals), len(bc.chemicals)))
+    for k, chem in enumerate(bc.chemicals):
+        if chem.kind == "mixture":
+            continue
+        concs = {chem.id: [chem.concentration - h, chem.concentration + h]}
+        masses = bc.calculate_masses_scenarios(ratios, concs, session)
+        dconcs[:, k] = (masses[1] - masses[0]) / (2.0 * h)
+    return dratios, dconcs
+
+
+class TestCalculateMassesBatchZSM22(unittest.TestCase):
+    '''
+    K2O : Al2O3 : SiO2 : H2O : HMDA from KOH, Al2(SO4)3*18H2O, HS-40,
+    water and HMDA, square batch matrix.
+    '''
+
+    def setUp(self):
+        self.session = get_session()
+        self.bc = get_calculator(self.session,
+                                 [(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)],
+                                 [2, 6, 8, 10, 13])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_single_composition(self):
+        self.bc.calculate_masses(self.session)
+        masses = [c.mass for c in self.bc.chemicals]
+        ref = [1716.1712941, 680.0096735, 13669.17825, 57098.3801559, 3201.5883673]
+        for mass, r in zip(masses, ref):
+            self.assertAlmostEqual(mass, r, places=6)
+
+    def test_batch_matches_single(self):
+        ratios = np.array([[13.0, 1.0, 91.0, 3670.0, 27.0],
+                           [10.0, 1.0, 60.0, 2000.0, 20.0],
+                           [20.0, 2.0, 120.0, 5000.0, 30.0]])
+        masses = self.bc.calculate_masses_batch(ratios, self.session)
+        self.assertEqual(masses.shape, (3, 5))
+        for row, mrow in zip(ratios, masses):
+            for comp, moles in zip(self.bc.components, row):
+                comp.moles = moles
+            self.bc.calculate_masses(self.session)
+            np.testing.assert_allclose(mrow, [c.mass for c in self.bc.chemicals])
+
+    def test_concentration_scenarios(self):
+        ratios = [13.0, 1.0, 91.0, 3670.0, 27.0]
+        # KOH is a solution and aluminium sulfate a reactant
+        concs = {2: [0.85, 0.80, 0.90], 6: [0.98, 0.95, 1.0]}
+        masses = self.bc.calculate_masses_scenarios(ratios, concs, self.session)
+        self.assertEqual(masses.shape, (3, 5))
+        for i in range(3):
+            self.bc.chemicals[0].concentration = concs[2][i]
+            self.bc.chemicals[1].concentration = concs[6][i]
+            self.bc.calculate_masses(self.session)
+            np.testing.assert_allclose(masses[i], [c.mass for c in self.bc.chemicals])
+
+    def test_concentration_scenarios_many_compositions(self):
+        ratios = np.array([[13.0, 1.0, 91.0, 3670.0, 27.0],
+                           [10.0, 1.0, 60.0, 2000.0, 20.0]])
+        masses = self.bc.calculate_masses_scenarios(ratios, {13: [0.98, 0.9]},
+                                                    self.session)
+        self.assertEqual(masses.shape, (2, 2, 5))
+        np.testing.assert_allclose(masses[0], self.bc.calculate_masses_batch(ratios, self.session))
+        np.testing.assert_allclose(masses[1, :, 4] * 0.9, masses[0, :, 4] * 0.98)
+
+    def test_concentration_scenarios_unknown_chemical(self):
+        self.assertRaises(ValueError, self.bc.calculate_masses_scenarios,
+                          [13.0, 1.0, 91.0, 3670.0, 27.0], {1: [0.5]}, self.session)
+
+    def test_concentration_scenarios_mixture(self):
+        # HS-40 is a mixture, its concentration is not used
+        self.assertRaises(ValueError, self.bc.calculate_masses_scenarios,
+                          [13.0, 1.0, 91.0, 3670.0, 27.0], {8: [0.3, 0.4]}, self.session)
+
+    def test_rounding(self):
+        recipes = self.bc.round_masses(self.session, precision=0.01, scale=100.0)
+        self.assertEqual(recipes.masses.shape, (1, 5))
+        np.testing.assert_allclose(recipes.masses[0], [17.16, 6.8, 136.69, 570.98, 32.02])
+        self.assertTrue(0.0 < recipes.errors[0] < 1.0e-3)
+        exact = self.bc.round_masses(self.session, precision=1.0e-12)
+        np.testing.assert_allclose(exact.achieved[0], exact.target)
+
+    def test_rounding_scale_search(self):
+        scales = np.linspace(50.0, 5000.0, 1000)
+        best, recipes = self.bc.find_rounding_scale(self.session, scales, precision=0.1)
+        self.assertEqual(recipes.errors.shape, (1000,))
+        self.assertEqual(best, scales[np.argmin(recipes.errors)])
+        self.assertEqual(recipes.errors.min(), self.bc.round_masses(self.session, 0.1, best).errors[0])
+
+        best, recipes = self.bc.find_rounding_scale(self.session, np.linspace(500.0, 5000.0, 10),
+                                                    precision=0.1)
+        self.assertEqual(best, 500.0)
+
+    def test_rounding_scale_search_max_mass(self):
+        scales = [1.0, 10.0, 100.0, 1000.0]
+        best, recipes = self.bc.find_rounding_scale(self.session, scales, precision=0.1)
+        self.assertEqual(best, 1.0)
+        # total masses of 76365.4, 7636.5, 763.7 and 76.4 g
+        best, recipes = self.bc.find_rounding_scale(self.session, scales, precision=0.1,
+                                                    max_mass=1000.0)
+        self.assertEqual(best, 100.0)
+        self.assertRaises(ValueError, self.bc.find_rounding_scale, self.session, scales,
+                          precision=0.1, max_mass=50.0)
+
+    def test_moles_batch(self):
+        masses = np.array([[1716.1712941, 680.0096735, 13669.17825, 57098.3801559, 3201.5883673],
+                           [17.16, 6.80, 136.69, 570.98, 32.02]])
+        moles, ratios = self.bc.calculate_moles_batch(masses, self.session,
+                                                      reference=self.bc.components[2],
+                                                      value=91.0)
+        self.assertEqual(moles.shape, (2, 5))
+        np.testing.assert_allclose(moles[0], [13.0, 1.0, 91.0, 3670.0, 27.0])
+        np.testing.assert_allclose(ratios[1], [13.0, 1.0, 91.0, 3670.0, 27.0], rtol=1.0e-3)
+        self.assertEqual(ratios[1, 2], 91.0)
+
+        for chem, mass in zip(self.bc.chemicals, masses[1]):
+            chem.mass = mass
+        self.bc.calculate_moles(self.session)
+        np.testing.assert_allclose(moles[1], [c.moles for c in self.bc.components])
+
+    def test_moles_batch_numpy_index(self):
+        masses = np.array([[1716.1712941, 680.0096735, 13669.17825, 57098.3801559, 3201.5883673]])
+        moles, _ = self.bc.calculate_moles_batch(masses, self.session)
+        reference = np.argmax(moles[0] == moles[0, 2])
+        self.assertIsInstance(reference, np.integer)
+        _, ratios = self.bc.calculate_moles_batch(masses, self.session,
+                                                  reference=reference, value=91.0)
+        np.testing.assert_allclose(ratios[0], [13.0, 1.0, 91.0, 3670.0, 27.0])
+
+    def test_moles_batch_wrong_shape(self):
+        self.assertRaises(ValueError, self.bc.calculate_moles_batch,
+                          np.ones((2, 4)), self.session)
+
+    def test_cached_batch_matrix(self):
+        B = self.bc.get_B_matrix(self.session)
+        B[0, 0] = 100.0
+        np.testing.assert_allclose(self.bc.get_B_matrix(self.session),
+                                   self.bc.build_B_matrix(self.session))
+
+    def test_incremental(self):
+        self.bc.calculate_masses(self.session)
+        self.bc.components[2].moles = 60.0
+        self.bc.components[3].moles = 2000.0
+        self.bc.calculate_masses_incremental(self.session)
+        masses = [c.mass for c in self.bc.chemicals]
+        self.bc.calculate_masses(self.session)
+        np.testing.assert_allclose(masses, [c.mass for c in self.bc.chemicals])
+
+    def test_incremental_selection_changed(self):
+        self.bc.calculate_masses(self.session)
+        self.bc.chemicals[2] = get_calculator(self.session, [], [7]).chemicals[0]
+        self.bc.calculate_masses_incremental(self.session)
+        masses = [c.mass for c in self.bc.chemicals]
+        self.bc.calculate_masses(self.session)
+        np.testing.assert_allclose(masses, [c.mass for c in self.bc.chemicals])
+
+    def test_solver_is_reused(self):
+        solver = self.bc.prepare_solver(self.session)
+        self.assertIs(solver, self.bc.prepare_solver(self.session))
+
+    def test_source_index(self):
+        repo = Repository(self.session)
+        index = repo.source_index()
+        self.assertIs(index, repo.source_index())
+        self.assertEqual(index[3], frozenset([3, 4, 5, 6]))
+        self.assertEqual(repo.sources([3, 1000]), {3: frozenset([3, 4, 5, 6])})
+
+    def test_sensitivity(self):
+        sens = self.bc.sensitivity(self.session)
+        dratios, dconcs = finite_differences(self.bc, self.session)
+        np.testing.assert_allclose(sens.ratios, dratios, rtol=1.0e-6, atol=1.0e-4)
+        np.testing.assert_allclose(sens.concentrations, dconcs, rtol=1.0e-6, atol=1.0e-4)
+
+    def test_sensitivity_report(self):
+        table = tex_sensitivity(self.bc, self.bc.sensitivity(self.session))
+        for chem in self.bc.chemicals:
+            self.assertIn(chem.tex_label(), table)
+
+    def test_wrong_shape(self):
+        self.assertRaises(ValueError, self.bc.calculate_masses_batch,
+                          np.ones((2, 4)), self.session)
+
+
+class TestCalculateMassesBatchNonSquare(unittest.TestCase):
+    '''
+    Na2O : Al2O3 : SiO2 : H2O : TMAOH from NaOH, NaAlO2, fumed silica, water,
+    TMAOH and Al(OH)3, least squares solution.
+    '''
+
+    def setUp(self):
+        self.session = get_session()
+        self.bc = get_calculator(self.session,
+                                 [(1, 1.0), (3, 1.0), (4, 10.0), (5, 200.0), (7, 2.0)],
+                                 [1, 3, 9, 10, 12, 4])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_sensitivity(self):
+        sens = self.bc.sensitivity(self.session)
+        dratios, dconcs = finite_differences(self.bc, self.session)
+        np.testing.assert_allclose(sens.ratios, dratios, rtol=1.0e-6, atol=1.0e-4)
+        np.testing.assert_allclose(sens.concentrations, dconcs, rtol=1.0e-6, atol=1.0e-4)
+
+    def test_batch_matches_single(self):
+        self.bc.calculate_masses(self.session)
+        single = np.array([c.mass for c in self.bc.chemicals])
+        masses = self.bc.calculate_masses_batch([[1.0, 1.0, 10.0, 200.0, 2.0]],
+                                                self.session)
+        np.testing.assert_allclose(masses[0], single)
+
+    def test_nonnegative(self):
+        # sodium aluminate gets a negative mass in the least squares solution
+        self.bc.calculate_masses(self.session)
+        self.assertLess(self.bc.chemicals[1].mass, 0.0)
+        self.bc.calculate_masses(self.session, nonnegative=True)
+        masses = np.array([c.mass for c in self.bc.chemicals])
+        self.assertTrue(np.all(masses >= 0.0))
+        # the composition can be reproduced exactly with non-negative masses
+        self.assertLess(self.bc.residual, 1.0e-8)
+
+    def test_nonnegative_batch(self):
+        # without water TMAOH pentahydrate makes the composition unreachable
+        ratios = [[1.0, 1.0, 10.0, 200.0, 2.0], [1.0, 1.0, 10.0, 0.0, 2.0]]
+        masses = self.bc.calculate_masses_batch(ratios, self.session, nonnegative=True)
+        self.assertTrue(np.all(masses >= 0.0))
+        self.assertEqual(self.bc.residual.shape, (2,))
+        self.assertLess(self.bc.residual[0], 1.0e-8)
+        self.assertGreater(self.bc.residual[1], 1.0)
+
+class TestPreparedSolver(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.square = rng.rand(4, 4) + np.eye(4)
+        self.tall = rng.rand(6, 4)
+        self.A = rng.rand(10, 4)
+
+    def test_square(self):
+        solver = PreparedSolver(self.square, np.ones(4), np.ones(4))
+        ref = np.linalg.solve(self.square.T, self.A.T).T
+        np.testing.assert_allclose(solver.solve(self.A), ref)
+        np.testing.assert_allclose(solver.solve(self.A[0]), ref[0])
+
+    def test_least_squares(self):
+        solver = PreparedSolver(self.tall, np.ones(4), np.ones(6))
+        ref = np.linalg.lstsq(self.tall.T, self.A.T, rcond=None)[0].T
+        np.testing.assert_allclose(solver.solve(self.A), ref)
+
+    def test_masses(self):
+        molwts = np.array([1.0, 2.0, 3.0, 4.0])
+        concs = np.array([1.0, 0.5, 1.0, 0.25])
+        solver = PreparedSolver(self.square, molwts, concs)
+        ref = np.linalg.solve(self.square.T, (self.A * molwts).T).T / concs
+        np.testing.assert_allclose(solver.masses(self.A), ref)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import sqlite3
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from batchcalc import cache
+from batchcalc.cache import LRUCache
+from batchcalc.model import Chemical, Component
+
+from test_batch_calculation import DBPATH, get_calculator
+
+
+def get_memory_session(statements=()):
+    '''
+    Return a session of an in-memory copy of the test database with the
+    extra SQL `statements` executed.
+    '''
+
+    source = sqlite3.connect(DBPATH)
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.executescript("\n".join(source.iterdump()))
+    source.close()
+    for statement in statements:
+        conn.execute(statement)
+    conn.commit()
+    engine = create_engine("sqlite://", creator=lambda: conn, poolclass=StaticPool)
+    return sessionmaker(bind=engine)()
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(maxsize=2)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('a', 0), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_clear(self):
+        self.cache.put('a', 1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestLabels(unittest.TestCase):
+
+    def test_formula_labels_shared(self):
+        first = Component(name="Silica", formula="SiO2", short_name=None)
+        second = Component(name="Silica", formula="SiO2", short_name=None)
+        self.assertEqual(first.html_label(), "SiO<sub>2</sub>")
+        self.assertEqual(first.tex_label(), "SiO$_{2}$")
+        self.assertIs(second.formula_to_html(), first.formula_to_html())
+
+    def test_concentration(self):
+        chem = Chemical(name="KOH", formula="KOH", short_name="", concentration=0.85)
+        self.assertEqual(chem.html_label(), "KOH (85.0%)")
+        chem.concentration = 0.5
+        self.assertEqual(chem.html_label(), "KOH (50.0%)")
+        self.assertEqual(chem.listctrl_label(), "KOH")
+
+    def test_modified_record(self):
+        comp = Component(name="Water", formula="H2O", short_name="")
+        self.assertEqual(comp.html_label(), "H<sub>2</sub>O")
+        comp.formula = "D2O"
+        self.assertEqual(comp.html_label(), "D<sub>2</sub>O")
+        comp.short_name = "heavy water"
+        self.assertEqual(comp.tex_label(), "heavy water")
+
+
+class TestDatabaseKey(unittest.TestCase):
+
+    def test_memory_databases(self):
+        first = get_memory_session()
+        second = get_memory_session(["UPDATE batch SET coefficient = 1.0 "
+                                     "WHERE chemical_id = 2 AND component_id = 2"])
+        self.assertNotEqual(cache.database_key(first), cache.database_key(second))
+        self.assertEqual(cache.database_key(first), cache.database_key(first))
+
+        selection = ([(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)], [2, 6, 8, 10, 13])
+        old = get_calculator(first, *selection).get_B_matrix(first)
+        new = get_calculator(second, *selection).get_B_matrix(second)
+        self.assertTrue(new[0, 0] > old[0, 0])
+        first.close()
+        second.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from batchcalc.compositions import (CompositionReader, _intern, component_lookup,
+                                    parse_composition)
+
+from test_batch_calculation import get_calculator, get_session
+
+
+class TestParseComposition(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_composition("1.0SiO2 : 0.05Al2O3 : 30 H2O : (CH3)4NCl"),
+                         [("SiO2", 1.0), ("Al2O3", 0.05), ("H2O", 30.0), ("(CH3)4NCl", 1.0)])
+        self.assertEqual(parse_composition("18.0H2O,34SiO2", delimiter=","),
+                         [("H2O", 18.0), ("SiO2", 34.0)])
+
+
+class TestCompositionReader(unittest.TestCase):
+
+    def setUp(self):
+        self.session = get_session()
+        self.bc = get_calculator(self.session,
+                                 [(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)],
+                                 [2, 6, 8, 10, 13])
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with io.open(path, "w", encoding="utf-8") as fobj:
+            fobj.write(text)
+        return path
+
+    def test_lookup(self):
+        lookup = component_lookup(self.session)
+        self.assertEqual(lookup["SiO2"], 4)
+        # repeated formula resolves to the lowest id
+        self.assertEqual(lookup["C3H7OH"], 12)
+        # the keys are interned
+        key = [k for k in lookup if k == "SiO2"][0]
+        self.assertIs(_intern("".join(["Si", "O2"])), key)
+
+    def test_text(self):
+        path = self.write("batch.txt", "# ZSM-22\n13K2O:Al2O3:91SiO2:3670H2O:27NH2(CH2)6NH2\n\n"
+                                       "182 SiO2 : 26K2O : 2Al2O3 : 7340H2O : 54NH2(CH2)6NH2\n")
+        reader = self.bc.composition_reader(self.session)
+        chunks = list(reader.read(path))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].labels, [2, 4])
+        np.testing.assert_allclose(chunks[0].ratios, [[13.0, 1.0, 91.0, 3670.0, 27.0],
+                                                      [26.0, 2.0, 182.0, 7340.0, 54.0]])
+        # the rows are ready to be solved
+        masses = self.bc.prepare_solver(self.session).masses(chunks[0].ratios)
+        np.testing.assert_allclose(masses[1], 2.0 * masses[0])
+
+    def test_csv_chunks(self):
+        rows = ["name,composition"] + ["s{0:d},{1:d}K2O:Al2O3:91SiO2".format(i, i)
+                                       for i in range(25)]
+        path = self.write("batch.csv", "\n".join(rows) + "\n")
+        reader = self.bc.composition_reader(self.session, chunksize=10)
+        chunks = list(reader.read(path, column="composition", label="name"))
+        self.assertEqual([len(c.labels) for c in chunks], [10, 10, 5])
+        self.assertEqual(chunks[2].labels[-1], "s24")
+        np.testing.assert_allclose(chunks[1].ratios[:, 0], np.arange(10, 20))
+
+    def test_tsv_file_object(self):
+        fobj = io.StringIO("a\t13K2O:Al2O3\nb\t1SiO2:1H2O\n")
+        reader = self.bc.composition_reader(self.session)
+        chunk = next(reader.read(fobj, fmt="tsv", column=1, label=0))
+        self.assertEqual(chunk.labels, ["a", "b"])
+        np.testing.assert_allclose(chunk.ratios[1], [0.0, 0.0, 1.0, 1.0, 0.0])
+
+    def test_unknown(self):
+        strings = [(1, "13K2O:Al2O3"), (2, "1Na2O:1Al2O3"), (3, "nothing:here")]
+        reader = self.bc.composition_reader(self.session)
+        self.assertRaises(ValueError, list, reader.iter_chunks(strings))
+        reader = self.bc.composition_reader(self.session, strict=False)
+        chunk = next(reader.iter_chunks(strings))
+        # Na2O is a component but it is not selected
+        np.testing.assert_array_equal(chunk.valid, [True, False, False])
+        self.assertTrue(np.all(np.isnan(chunk.ratios[1:])))
@@ -0,0 +1,200 @@
+import unittest
+
+import numpy as np
+
+from batchcalc import cache, core
+from batchcalc.core import BatchRecord, ChemicalRecord, ComponentRecord
+
+
+class DictRepository(object):
+    '''
+    Repository serving the batch records from memory.
+    '''
+
+    key = "memory"
+
+    def __init__(self, rows, water_molwt=18.0152):
+        self.rows = rows
+        self._water_molwt = water_molwt
+
+    def batch_rows(self, chemical_ids):
+        res = {}
+        for row in self.rows:
+            if row.chemical_id in chemical_ids:
+                res.setdefault(row.chemical_id, []).append(row)
+        return res
+
+    def water_molwt(self):
+        return self._water_molwt
+
+    def sources(self, component_ids):
+        res = {}
+        for row in self.rows:
+            if row.component_id in component_ids:
+                res.setdefault(row.component_id, set()).add(row.chemical_id)
+        return res
+
+
+NA2O = ComponentRecord(1, "sodium oxide", "Na2O", 61.97894)
+SIO2 = ComponentRecord(4, "silicone dioxide", "SiO2", 60.0843)
+H2O = ComponentRecord(5, "water", "H2O", 18.0152)
+
+NAOH = ChemicalRecord(1, "sodium hydroxide", "solution", 0.98, 39.99707)
+SILICA = ChemicalRecord(8, "colloidal silica HS-40", "mixture", 1.0, 60.0843)
+WATER = ChemicalRecord(10, "water", "reactant", 1.0, 18.0152)
+
+ROWS = [BatchRecord(1, 1, 0.5, "Na2O", 61.97894),
+        BatchRecord(1, 5, 0.5, "H2O", 18.0152),
+        BatchRecord(8, 4, 0.4, "SiO2", 60.0843),
+        BatchRecord(8, 5, 0.6, "H2O", 18.0152),
+        BatchRecord(10, 5, 1.0, "H2O", 18.0152)]
+
+
+class TestWeightFractions(unittest.TestCase):
+
+    def test_mixture(self):
+        wfs = core.weight_fractions(SILICA, ROWS[2:4])
+        self.assertEqual(wfs, [(4, 0.4), (5, 0.6)])
+
+    def test_pure_solution(self):
+        naoh = NAOH._replace(concentration=1.0)
+        wfs = dict(core.weight_fractions(naoh, ROWS[:2], 18.0152))
+        self.assertAlmostEqual(wfs[1], 0.5 * 61.97894 / 39.99707, places=4)
+        self.assertAlmostEqual(wfs[1] + wfs[5], 1.0)
+
+    def test_solution_with_three_components(self):
+        # sodium aluminate dissolved in water, Na2O + Al2O3 + 2 H2O
+        aluminate = ChemicalRecord(20, "sodium aluminate", "solution", 0.5, 199.9903)
+        rows = [BatchRecord(20, 1, 1.0, "Na2O", 61.97894),
+                BatchRecord(20, 2, 1.0, "Al2O3", 101.96128),
+                BatchRecord(20, 5, 2.0, "H2O", 18.0152)]
+        wfs = dict(core.weight_fractions(aluminate, rows, 18.0152))
+        self.assertAlmostEqual(sum(wfs.values()), 1.0)
+        # half of the mass is the solute
+        self.assertAlmostEqual(wfs[1], 0.5 * 61.97894 / 199.9903, places=4)
+        self.assertAlmostEqual(wfs[2], 0.5 * 101.96128 / 199.9903, places=4)
+
+    def test_kernels_match_single_chemicals(self):
+        chemicals = [NAOH, SILICA, WATER, NAOH._replace(id=11, concentration=0.5)]
+        rows = {1: ROWS[:2], 8: ROWS[2:4], 10: ROWS[4:],
+                11: [r._replace(chemical_id=11) for r in ROWS[:2]]}
+        owner, cids, fractions = core.fraction_arrays(chemicals, rows, 18.0152)
+        for i, chemical in enumerate(chemicals):
+            wfs = list(zip(cids[owner == i].tolist(), fractions[owner == i].tolist()))
+            self.assertEqual(wfs, core.weight_fractions(chemical, rows[chemical.id], 18.0152))
+
+    def test_scatter_batch_matrix(self):
+        chemicals = [NAOH, SILICA, WATER]
+        rows = {1: ROWS[:2], 8: ROWS[2:4], 10: ROWS[4:]}
+        owner, cids, fractions = core.fraction_arrays(chemicals, rows, 18.0152)
+        # unordered selection without Na2O
+        B = core.scatter_batch_matrix(owner, cids, fractions, 3, [H2O, SIO2])
+        np.testing.assert_allclose(B, [[dict(core.weight_fractions(c, rows[c.id], 18.0152)).get(cid, 0.0)
+                                        for cid in (5, 4)] for c in chemicals])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, core.weight_fractions,
+                          NAOH._replace(kind="gas"), ROWS[:2])
+
+
+class TestNNLS(unittest.TestCase):
+
+    def setUp(self):
+        self.A = np.array([[1.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 0.0]])
+        self.b = np.array([2.0, -1.0, 1.0])
+
+    def test_solution(self):
+        x, rnorm = core.nnls(self.A, self.b)
+        self.assertTrue(np.all(x >= 0.0))
+        # KKT conditions: zero gradient on the positive entries and
+        # non-positive gradient on the zero entries
+        w = np.dot(self.A.T, self.b - np.dot(self.A, x))
+        np.testing.assert_allclose(w[x > 0.0], 0.0, atol=1.0e-10)
+        self.assertTrue(np.all(w[x == 0.0] <= 1.0e-10))
+        self.assertAlmostEqual(rnorm, np.linalg.norm(np.dot(self.A, x) - self.b))
+
+    def test_warm_start(self):
+        x, rnorm = core.nnls(self.A, self.b)
+        for x0 in [x, np.array([5.0, 5.0, 5.0]), np.array([-1.0, 2.0, 0.0])]:
+            xw, rw = core.nnls(self.A, self.b, x0=x0)
+            np.testing.assert_allclose(xw, x, atol=1.0e-12)
+
+    def test_unconstrained_solution_kept(self):
+        b = np.dot(self.A, [1.0, 2.0, 3.0])
+        x, rnorm = core.nnls(self.A, b)
+        np.testing.assert_allclose(x, [1.0, 2.0, 3.0])
+        self.assertAlmostEqual(rnorm, 0.0)
+
+
+class TestChemicalFractions(unittest.TestCase):
+
+    def setUp(self):
+        cache.invalidate()
+        self.repo = DictRepository(ROWS)
+        self.queried = []
+        batch_rows = self.repo.batch_rows
+
+        def counting_batch_rows(chemical_ids):
+            self.queried.append(list(chemical_ids))
+            return batch_rows(chemical_ids)
+
+        self.repo.batch_rows = counting_batch_rows
+
+    def test_only_missing_rows_queried(self):
+        first = core.chemical_fractions([NAOH, SILICA], self.repo)
+        second = core.chemical_fractions([NAOH, SILICA, WATER], self.repo)
+        self.assertEqual(self.queried, [[1, 8], [10]])
+        for (cids1, wfs1), (cids2, wfs2) in zip(first, second[:2]):
+            np.testing.assert_array_equal(cids1, cids2)
+            np.testing.assert_array_equal(wfs1, wfs2)
+        np.testing.assert_array_equal(second[2][0], [5])
+        np.testing.assert_array_equal(second[2][1], [1.0])
+        self.assertFalse(second[2][1].flags.writeable)
+
+    def test_concentration_in_key(self):
+        core.chemical_fractions([NAOH], self.repo)
+        wfs = core.chemical_fractions([NAOH._replace(concentration=0.5)], self.repo)
+        self.assertEqual(len(self.queried), 2)
+        self.assertAlmostEqual(wfs[0][1].sum(), 1.0)
+
+    def test_invalidate_bumps_revision(self):
+        revision = cache.revision
+        core.chemical_fractions([SILICA], self.repo)
+        cache.invalidate()
+        self.assertEqual(cache.revision, revision + 1)
+        core.chemical_fractions([SILICA], self.repo)
+        self.assertEqual(self.queried, [[8], [8]])
+
+
+class TestHeadlessCalculation(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = DictRepository(ROWS)
+        self.chemicals = [NAOH, SILICA, WATER]
+        self.components = [NA2O, SIO2, H2O]
+
+    def test_masses_reproduce_moles(self):
+        ratios = np.array([[1.0, 10.0, 200.0], [2.0, 10.0, 300.0]])
+        masses = core.calculate_masses(self.chemicals, self.components, ratios, self.repo)
+        self.assertTrue(np.all(masses > 0.0))
+        moles = core.calculate_moles(self.chemicals, self.components, masses, self.repo)
+        np.testing.assert_allclose(moles, ratios)
+
+    def test_missing_source(self):
+        self.assertRaises(ValueError, core.calculate_masses,
+                          self.chemicals[1:], self.components, [1.0, 10.0, 200.0],
+                          self.repo)
+
+    def test_all_missing_sources_reported(self):
+        try:
+            core.check_sources(self.components, [WATER],
+                               self.repo.sources([1, 4, 5]))
+        except ValueError as e:
+            self.assertIn("sodium oxide", str(e))
+            self.assertIn("silicone dioxide", str(e))
+        else:
+            self.fail("ValueError not raised")
+
+
+if __name__ == "__main__":
+    unittest.main()
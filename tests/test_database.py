@@ -0,0 +1,69 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from batchcalc import cache
+from batchcalc.database import _engines, dispose_engines, get_engine, get_scoped_session
+
+from test_batch_calculation import DBPATH, get_calculator
+
+
+class TestEngineRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "lab.db")
+        shutil.copy(DBPATH, self.path)
+
+    def tearDown(self):
+        dispose_engines([self.path])
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared_engine(self):
+        self.assertIs(get_engine(self.path), get_engine(os.path.join(self.tmpdir, ".", "lab.db")))
+        registry = get_scoped_session(self.path)
+        self.assertIs(registry(), registry())
+
+        sessions = []
+
+        def work():
+            sessions.append(registry())
+            registry.remove()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], registry())
+        self.assertIs(sessions[0].get_bind(), registry().get_bind())
+
+    def test_dispose(self):
+        get_engine(self.path)
+        dispose_engines([self.path])
+        self.assertNotIn(os.path.abspath(self.path), _engines)
+
+    def test_recreate_database(self):
+        session = get_scoped_session(self.path)()
+        bc = get_calculator(session, [(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)],
+                            [2, 6, 8, 10, 13])
+        old = bc.get_B_matrix(session)
+        self.assertTrue(len(cache.batch_matrices) > 0)
+
+        # new database created in place of the old one with a different
+        # coefficient of K2O in KOH
+        dispose_engines([self.path])
+        os.remove(self.path)
+        shutil.copy(DBPATH, self.path)
+        conn = sqlite3.connect(self.path)
+        conn.execute("UPDATE batch SET coefficient = 1.0 WHERE chemical_id = 2 AND component_id = 2")
+        conn.commit()
+        conn.close()
+
+        session = get_scoped_session(self.path)()
+        bc = get_calculator(session, [(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)],
+                            [2, 6, 8, 10, 13])
+        new = bc.get_B_matrix(session)
+        self.assertTrue(new[0, 0] > old[0, 0])
+        self.assertAlmostEqual(new[1, 1], old[1, 1])
@@ -0,0 +1,126 @@
+import unittest
+
+import numpy as np
+
+from batchcalc import cache
+from batchcalc.formula import (balance_coefficients, check_molwts, element_counts,
+                               element_matrix, molecular_weight, molecular_weights,
+                               propose_batches)
+from batchcalc.model import Batch, Chemical, Component
+
+from test_batch_calculation import get_session
+
+
+class TestElementCounts(unittest.TestCase):
+
+    def test_simple(self):
+        self.assertEqual(element_counts("NaOH"), {"Na": 1, "O": 1, "H": 1})
+        self.assertEqual(element_counts("Na2Al2O4"), {"Na": 2, "Al": 2, "O": 4})
+
+    def test_groups(self):
+        self.assertEqual(element_counts("Al(OC3H7)3"), {"Al": 1, "O": 3, "C": 9, "H": 21})
+        self.assertEqual(element_counts("(CH3)3N(Cl)CH2CH2OH"),
+                         {"C": 5, "H": 14, "N": 1, "Cl": 1, "O": 1})
+
+    def test_hydrates(self):
+        self.assertEqual(element_counts("Al2(SO4)3*18H2O"),
+                         {"Al": 2, "S": 3, "O": 30, "H": 36})
+        self.assertAlmostEqual(molecular_weight("(CH3)4NOH*5H2O"), 181.2288)
+
+    def test_invalid(self):
+        for text in ["Xx2", "Al(OH", "Al)3", "", "H2O*", "Na+"]:
+            self.assertRaises(ValueError, element_counts, text)
+
+    def test_memoized(self):
+        cache.formulas.clear()
+        counts = element_counts("SiO2")
+        self.assertIn("SiO2", cache.formulas)
+        # the returned dictionary is a copy of the cached one
+        counts["Si"] = 10
+        self.assertEqual(element_counts("SiO2"), {"Si": 1, "O": 2})
+
+
+class TestElementMatrix(unittest.TestCase):
+
+    def test_matrix(self):
+        E, symbols = element_matrix(["H2O", "SiO2", "H2O"])
+        self.assertEqual(symbols, ["H", "O", "Si"])
+        np.testing.assert_array_equal(E, [[2, 1, 0], [0, 2, 1], [2, 1, 0]])
+
+    def test_not_strict(self):
+        self.assertRaises(ValueError, element_matrix, ["H2O", "Qq"])
+        weights = molecular_weights(["H2O", "Qq"], strict=False)
+        self.assertAlmostEqual(weights[0], 18.0152)
+        self.assertTrue(np.isnan(weights[1]))
+
+
+class TestDatabaseMolwts(unittest.TestCase):
+
+    def setUp(self):
+        self.session = get_session()
+
+    def test_stored_molwts(self):
+        for cls in (Chemical, Component):
+            records = self.session.query(cls.formula, cls.molwt).all()
+            weights = molecular_weights([f for f, _ in records])
+            np.testing.assert_allclose(weights, [m for _, m in records], rtol=1.0e-4)
+
+    def test_check_molwts(self):
+        self.assertEqual(check_molwts(self.session), [])
+        # C5H12O4 is stored rounded to two decimals
+        drifts = check_molwts(self.session, rtol=1.0e-6)
+        self.assertEqual([(d.table, d.formula) for d in drifts], [("chemicals", "C5H12O4")])
+        self.assertAlmostEqual(drifts[0].computed, 136.1474)
+
+
+class TestBalanceCoefficients(unittest.TestCase):
+
+    def test_balance(self):
+        solutions = balance_coefficients(["NaOH", "Al2(SO4)3*18H2O", "NaOH", "KOH"],
+                                         ["Na2O", "Al2O3", "SO3", "H2O"])
+        self.assertEqual([len(s) for s in solutions], [1, 1, 1, 0])
+        self.assertEqual(solutions[0][0][0], (0, 3))
+        np.testing.assert_allclose(solutions[0][0][1], [0.5, 0.5])
+        self.assertEqual(solutions[1][0][0], (1, 2, 3))
+        np.testing.assert_allclose(solutions[1][0][1], [1.0, 3.0, 18.0])
+
+    def test_smallest_subset(self):
+        # Na2Al2O4 is given directly, no need for the oxides
+        solutions = balance_coefficients(["Na2Al2O4"], ["Na2O", "Al2O3", "Na2Al2O4"])
+        self.assertEqual([s[0] for s in solutions[0]], [(2,)])
+
+    def test_ranking(self):
+        solutions = balance_coefficients(["Al(OC3H7)3"],
+                                         ["Al2O3", "H2O", "C2H5OH", "C3H7OH"])
+        self.assertEqual(len(solutions[0]), 3)
+        self.assertEqual(solutions[0][0][0], (0, 1, 3))
+        np.testing.assert_allclose(solutions[0][0][1], [0.5, -1.5, 3.0])
+
+
+class TestProposeBatches(unittest.TestCase):
+
+    def setUp(self):
+        self.session = get_session()
+
+    def test_database(self):
+        proposals = propose_batches(self.session)
+        self.assertNotIn(7, [p.chemical_id for p in proposals])
+        for proposal in proposals:
+            stored = dict(self.session.query(Batch.component_id, Batch.coefficient).
+                          filter(Batch.chemical_id == proposal.chemical_id))
+            if len(stored) == 0:
+                continue
+            # the hand entered coefficients are the proposal or one of the
+            # alternatives for the chemicals with duplicated components
+            candidates = [(proposal.component_ids, proposal.coefficients)] + proposal.alternatives
+            derived = [dict(zip(ids, coeffs)) for ids, coeffs in candidates]
+            match = [d for d in derived if sorted(d) == sorted(stored)]
+            self.assertEqual(len(match), 1)
+            for cid in stored:
+                self.assertAlmostEqual(stored[cid], match[0][cid])
+            self.assertEqual(proposal.status == "exact", len(proposal.alternatives) == 0)
+
+    def test_selected(self):
+        proposals = propose_batches(self.session, [4, 7])
+        self.assertEqual([p.chemical_id for p in proposals], [4, 7])
+        self.assertEqual([p.status for p in proposals], ["exact", "exact"])
@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+
+from batchcalc.model import Component
+from batchcalc.recipes import RecipeSearch, has_matching
+from batchcalc.repository import Repository
+
+from test_batch_calculation import get_session
+
+
+class TestMatching(unittest.TestCase):
+
+    def test_matching(self):
+        self.assertTrue(has_matching([{0, 1}, {0}], {0, 1}))
+        self.assertFalse(has_matching([{0}, {0}], {0, 1}))
+        self.assertFalse(has_matching([{0, 1}, {0}], {1}))
+
+
+class TestRecipeSearch(unittest.TestCase):
+    '''
+    Na2O : Al2O3 : SiO2 : H2O : TMAOH from all the available sources.
+    '''
+
+    def setUp(self):
+        self.session = get_session()
+        self.repo = Repository(self.session)
+        self.components = self.session.query(Component).\
+            filter(Component.id.in_([1, 3, 4, 5, 7])).order_by(Component.id).all()
+        self.ratios = [1.0, 1.0, 10.0, 200.0, 2.0]
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_candidates_are_matched(self):
+        search = RecipeSearch(self.components, self.repo)
+        candidates = [tuple(c) for block in search.candidates() for c in block]
+        for cand in candidates:
+            self.assertEqual(len(cand), 5)
+            self.assertTrue(has_matching(search.sources, set(cand)))
+
+    def test_solutions_reproduce_composition(self):
+        search = RecipeSearch(self.components, self.repo)
+        for recipe in search.search(self.ratios, limit=20):
+            B = search.B[[search.chemicals.index(c) for c in recipe.chemicals]]
+            conc = np.array([c.concentration if c.kind == "reactant" else 1.0
+                             for c in recipe.chemicals])
+            moles = np.dot(recipe.masses * conc, B) / search.molwts
+            np.testing.assert_allclose(moles, self.ratios)
+            self.assertTrue(np.all(recipe.masses > -1.0e-10))
+
+    def test_ranking_by_scores(self):
+        # expensive sodium aluminate
+        search = RecipeSearch(self.components, self.repo, scores={3: 100.0})
+        recipes = search.search(self.ratios, limit=50)
+        scores = [r.score for r in recipes]
+        self.assertEqual(scores, sorted(scores))
+        self.assertNotIn(3, [c.id for c in recipes[0].chemicals])
+
+    def test_default_ranking_by_impurity(self):
+        search = RecipeSearch(self.components, self.repo)
+        recipes = search.search(self.ratios, limit=60)
+        impurity = [sum(m * (1.0 - c.concentration) for c, m in zip(r.chemicals, r.masses)
+                        if c.kind == "reactant") for r in recipes]
+        np.testing.assert_allclose([r.score for r in recipes], impurity)
+        keys = [(r.score, [c.id for c in r.chemicals]) for r in recipes]
+        self.assertEqual(keys, sorted(keys))
+        # aluminium isopropoxide and sulfate are less pure than sodium aluminate
+        self.assertEqual([c.id for c in recipes[0].chemicals], [1, 2, 3, 7, 12])
+        self.assertTrue(recipes[-1].score > recipes[0].score)
+
+    def test_scores_change_order(self):
+        default = RecipeSearch(self.components, self.repo).search(self.ratios, limit=1)
+        expensive = RecipeSearch(self.components, self.repo, scores={3: 100.0}).\
+            search(self.ratios, limit=1)
+        self.assertIn(3, [c.id for c in default[0].chemicals])
+        self.assertNotIn(3, [c.id for c in expensive[0].chemicals])
+
+    def test_maxsources(self):
+        search = RecipeSearch(self.components, self.repo, scores={3: 100.0}, maxsources=2)
+        self.assertTrue(all(len(src) <= 2 for src in search.sources))
+        # the expensive sodium aluminate is dropped from the sources of Al2O3
+        self.assertEqual(set(search.chemicals[i].id for i in search.sources[1]), {4, 5})
+        self.assertTrue(len(search.search(self.ratios)) > 0)
+
+    def test_strict(self):
+        components = self.session.query(Component).\
+            filter(Component.id.in_([2, 3, 4, 5])).all()
+        ids = set(c.id for c in RecipeSearch(components, self.repo).chemicals)
+        strict = set(c.id for c in RecipeSearch(components, self.repo, strict=True).chemicals)
+        # aluminium sulfate also provides SO3 and sodium aluminate Na2O
+        self.assertIn(6, ids)
+        self.assertNotIn(6, strict)
+        self.assertNotIn(3, strict)
+
+    def test_missing_source(self):
+        components = self.session.query(Component).filter(Component.id.in_([3, 4])).all()
+        components.append(Component(id=1000, name="unobtainium", formula="Uo", molwt=1.0))
+        self.assertRaises(ValueError, RecipeSearch, components, self.repo)
+
+
+if __name__ == "__main__":
+    unittest.main()
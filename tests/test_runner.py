@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from batchcalc import runner
+
+from test_batch_calculation import DBPATH
+
+
+# masses stored in the ZSM-22 synthesis record
+ZSM22 = [1716.1712941, 680.0096735, 13669.17825, 57098.3801559, 3201.5883673]
+
+
+class TestRunner(unittest.TestCase):
+
+    def test_recalculate(self):
+        session = runner.get_readonly_session(DBPATH)
+        try:
+            res = runner.recalculate(session, [1, 1000])
+        finally:
+            session.close()
+        self.assertEqual(res[0].chemical_ids, (2, 6, 8, 10, 13))
+        np.testing.assert_allclose(res[0].masses, ZSM22)
+        self.assertIsNone(res[0].error)
+        # no such synthesis
+        self.assertIsNone(res[1].masses)
+        self.assertIsNotNone(res[1].error)
+
+    def test_recalculate_syntheses(self):
+        progress = []
+        res = runner.recalculate_syntheses(DBPATH, [1, 1, 1], processes=2,
+                                           shardsize=1,
+                                           progress=lambda d, t: progress.append((d, t)))
+        self.assertEqual(len(res), 3)
+        for r in res:
+            np.testing.assert_allclose(r.masses, ZSM22)
+        self.assertEqual(progress[-1], (3, 3))
+
+    def test_readonly(self):
+        session = runner.get_readonly_session(DBPATH)
+        try:
+            self.assertRaises(Exception, session.execute,
+                              runner.Synthesis.__table__.delete())
+        finally:
+            session.close()
+
+    def test_readonly_without_uri(self):
+        # sqlite3 of Python 2 does not accept the uri argument
+        sqlite3 = runner.sqlite3
+
+        class NoURI(object):
+
+            @staticmethod
+            def connect(database, **kwargs):
+                if "uri" in kwargs:
+                    raise TypeError("'uri' is an invalid keyword argument")
+                return sqlite3.connect(database, **kwargs)
+
+        runner.sqlite3 = NoURI
+        try:
+            conn = runner._readonly_connect(DBPATH)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM chemicals").fetchone()[0], 21)
+            self.assertRaises(sqlite3.OperationalError, conn.execute,
+                              "DELETE FROM syntheses")
+            conn.close()
+        finally:
+            runner.sqlite3 = sqlite3
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from batchcalc import sweep
+
+from test_batch_calculation import get_session, get_calculator
+
+
+class TestDesigns(unittest.TestCase):
+
+    def test_grid_design(self):
+        chunks = list(sweep.grid_design([[1.0, 2.0, 3.0], [10.0, 20.0]], chunksize=4))
+        self.assertEqual([c.shape for c in chunks], [(4, 2), (2, 2)])
+        points = np.vstack(chunks)
+        self.assertEqual(set(map(tuple, points)),
+                         set((a, b) for a in [1.0, 2.0, 3.0] for b in [10.0, 20.0]))
+
+    def test_simplex_design(self):
+        points = np.vstack(list(sweep.simplex_design(3, 4, total=2.0, chunksize=5)))
+        # number of points in the {3, 4} simplex lattice is C(6, 2)
+        self.assertEqual(points.shape, (15, 3))
+        np.testing.assert_allclose(points.sum(axis=1), 2.0)
+        self.assertTrue(np.all(points >= 0.0))
+        self.assertEqual(len(set(map(tuple, points))), 15)
+
+    def test_latin_hypercube_design(self):
+        bounds = [(0.0, 1.0), (10.0, 20.0)]
+        points = np.vstack(list(sweep.latin_hypercube_design(bounds, 50, seed=3, chunksize=7)))
+        self.assertEqual(points.shape, (50, 2))
+        # exactly one point in each of the strata along every dimension
+        for j, (lo, hi) in enumerate(bounds):
+            strata = np.floor((points[:, j] - lo) / (hi - lo) * 50).astype(int)
+            self.assertEqual(sorted(strata), list(range(50)))
+
+
+class TestCompositionSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.session = get_session()
+        self.bc = get_calculator(self.session,
+                                 [(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)],
+                                 [2, 6, 8, 10, 13])
+        self.sweep = sweep.CompositionSweep(self.bc, self.session,
+                                            [self.bc.components[2], self.bc.components[3]])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_run(self):
+        design = sweep.grid_design([[30.0, 60.0, 91.0], [100.0, 3670.0]], chunksize=4)
+        chunks = list(self.sweep.run(design))
+        ratios = np.vstack([c.ratios for c in chunks])
+        masses = np.vstack([c.masses for c in chunks])
+        np.testing.assert_allclose(ratios[:, [0, 1, 4]], [[13.0, 1.0, 27.0]] * 6)
+        np.testing.assert_allclose(masses, self.bc.calculate_masses_batch(ratios, self.session))
+        feasible = np.concatenate([c.feasible for c in chunks])
+        np.testing.assert_array_equal(feasible, np.all(masses >= 0.0, axis=1))
+        # too little water for the water in KOH and aluminium sulfate
+        self.assertFalse(feasible[ratios[:, 3] == 100.0].any())
+
+    def test_run_nonnegative(self):
+        nnsweep = sweep.CompositionSweep(self.bc, self.session,
+                                         [self.bc.components[2], self.bc.components[3]],
+                                         nonnegative=True)
+        design = sweep.grid_design([[30.0, 60.0, 91.0], [100.0, 3670.0]], chunksize=4)
+        chunks = list(nnsweep.run(design))
+        masses = np.vstack([c.masses for c in chunks])
+        feasible = np.concatenate([c.feasible for c in chunks])
+        self.assertTrue(np.all(masses >= 0.0))
+        # the same points are feasible as in the unconstrained sweep
+        design = sweep.grid_design([[30.0, 60.0, 91.0], [100.0, 3670.0]])
+        ref = np.concatenate([c.feasible for c in self.sweep.run(design)])
+        np.testing.assert_array_equal(feasible, ref)
+
+    def test_run_overdetermined(self):
+        # Na2O and H2O both come from NaOH, only one water ratio is reachable
+        bc = get_calculator(self.session, [(1, 1.0), (4, 10.0), (5, 100.0)], [1, 9])
+        naoh = bc.calculate_moles_batch(bc.calculate_masses_batch([[1.0, 0.0, 0.0]], self.session),
+                                        self.session)[0][0]
+        reachable = naoh[2] / naoh[0]
+        oversweep = sweep.CompositionSweep(bc, self.session, [bc.components[2]])
+        design = sweep.grid_design([[reachable, 0.0, 1.0, 50.0, 500.0]])
+        chunk = next(oversweep.run(design))
+        self.assertTrue(np.all(chunk.masses >= 0.0))
+        np.testing.assert_array_equal(chunk.feasible, [True, False, False, False, False])
+
+    def test_to_csv(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            design = sweep.latin_hypercube_design([(30.0, 100.0), (1000.0, 5000.0)], 25, seed=1)
+            npoints, nfeasible = self.sweep.to_csv(path, design)
+            data = np.loadtxt(path, delimiter=',', skiprows=1)
+        finally:
+            os.remove(path)
+        self.assertEqual(npoints, 25)
+        self.assertEqual(data.shape, (25, 12))
+        self.assertEqual(nfeasible, int(data[:, -1].sum()))
+
+    def test_unselected_component(self):
+        comp = get_calculator(self.session, [(1, 1.0)], []).components[0]
+        self.assertRaises(ValueError, sweep.CompositionSweep, self.bc, self.session, [comp])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+import numpy as np
+
+from batchcalc import cache
+from batchcalc.model import Synthesis, SynthesisComponent
+from batchcalc.syntheses import (CompositionIndex, SynthesisMatrix, composition_index,
+                                 synthesis_matrix, update_index)
+
+from test_batch_calculation import get_session
+
+
+class TestSynthesisMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = SynthesisMatrix.from_records([(1, 4, 60.0), (1, 3, 1.0), (2, 4, 30.0),
+                                                    (2, 1, 2.0), (2, 1, 1.0), (3, 5, 10.0)])
+
+    def test_dense(self):
+        np.testing.assert_array_equal(self.matrix.synthesis_ids, [1, 2, 3])
+        np.testing.assert_array_equal(self.matrix.component_ids, [1, 3, 4, 5])
+        np.testing.assert_allclose(self.matrix.moles, [[0.0, 1.0, 60.0, 0.0],
+                                                       [3.0, 0.0, 30.0, 0.0],
+                                                       [0.0, 0.0, 0.0, 10.0]])
+
+    def test_normalize(self):
+        ratios = self.matrix.normalize(4, value=10.0)
+        np.testing.assert_allclose(ratios[:2], [[0.0, 1.0 / 6.0, 10.0, 0.0],
+                                                [1.0, 0.0, 10.0, 0.0]])
+        # no SiO2 in the third synthesis
+        self.assertFalse(np.any(np.isfinite(ratios[2, 2:])))
+
+    def test_select(self):
+        np.testing.assert_allclose(self.matrix.select([1, 4], reference=4)[:2],
+                                   [[0.0, 1.0], [0.1, 1.0]])
+        self.assertRaises(ValueError, self.matrix.select, [2])
+
+    def test_empty(self):
+        self.assertEqual(SynthesisMatrix.from_records([]).moles.shape, (0, 0))
+
+
+class TestCompositionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = CompositionIndex(SynthesisMatrix.from_records(
+            [(1, 4, 60.0), (1, 3, 1.0), (2, 4, 30.0), (2, 3, 1.0), (3, 5, 10.0)]))
+
+    def test_query(self):
+        res = self.index.query({4: 120.0, 3: 2.0}, k=2)
+        self.assertEqual([sid for sid, _ in res], [1, 2])
+        self.assertAlmostEqual(res[0][1], 0.0)
+        self.assertEqual(len(self.index.query({5: 1.0}, k=10)), 3)
+
+    def test_unknown_component(self):
+        res = self.index.query({4: 60.0, 3: 1.0, 1000: 5.0}, k=1)
+        self.assertEqual(res[0][0], 1)
+        self.assertTrue(res[0][1] > 0.0)
+
+    def test_update(self):
+        self.index.update(4, {4: 60.0, 3: 1.0, 1: 1.0})
+        self.index.update(2, {5: 10.0})
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.query({4: 60.0, 3: 1.0, 1: 1.0}, k=1)[0][0], 4)
+        self.assertEqual(set(sid for sid, _ in self.index.query({5: 1.0}, k=2)), {2, 3})
+        self.index.remove(1)
+        self.index.remove(1000)
+        self.assertNotIn(1, [sid for sid, _ in self.index.query({4: 60.0, 3: 1.0}, k=10)])
+
+    def test_brute_force(self):
+        rng = np.random.RandomState(0)
+        moles = rng.random_sample((500, 6)) * (rng.random_sample((500, 6)) > 0.3)
+        records = [(i, j, moles[i, j]) for i in range(500) for j in range(6) if moles[i, j] > 0]
+        index = CompositionIndex(SynthesisMatrix.from_records(records))
+        query = {0: 1.0, 2: 0.5, 5: 0.1}
+        res = index.query(query, k=10)
+        vec, _ = index.vector(query)
+        dist = np.linalg.norm(index.features - vec, axis=1)
+        ref = np.argsort(dist)[:10]
+        np.testing.assert_allclose([d for _, d in res], dist[ref])
+
+
+class TestStoredSyntheses(unittest.TestCase):
+
+    def setUp(self):
+        self.session = get_session()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_zsm22(self):
+        matrix = synthesis_matrix(self.session)
+        row = matrix.moles[matrix.row(1)]
+        np.testing.assert_allclose(row[[matrix.column(c) for c in [2, 3, 4, 5, 8]]],
+                                   [13.0, 1.0, 91.0, 3670.0, 27.0])
+        self.assertRaises(ValueError, matrix.row, 1000)
+
+    def test_cached(self):
+        matrix = synthesis_matrix(self.session)
+        self.assertIs(matrix, synthesis_matrix(self.session))
+        self.assertFalse(matrix.moles.flags.writeable)
+        cache.invalidate_syntheses()
+        self.assertIsNot(matrix, synthesis_matrix(self.session))
+
+    def test_index_update(self):
+        index = composition_index(self.session)
+        self.assertIs(index, composition_index(self.session))
+        synthesis = self.session.query(Synthesis).get(1)
+        zsm22 = {2: 13.0, 3: 1.0, 4: 91.0, 5: 3670.0, 8: 27.0}
+        self.assertEqual(index.query(zsm22, k=1)[0][0], 1)
+        # an unsaved copy registered under a new id
+        copy = Synthesis(id=1000)
+        copy.components = [SynthesisComponent(component_id=c.component_id, moles=c.moles)
+                           for c in synthesis.components]
+        update_index(self.session, copy)
+        self.assertEqual(set(sid for sid, _ in index.query(zsm22, k=2)), {1, 1000})
+        cache.invalidate()
+        self.assertEqual(len(composition_index(self.session)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from batchcalc.repository import Repository
+from batchcalc.uncertainty import UncertaintyPropagation
+
+from test_batch_calculation import get_session, get_calculator
+
+
+class TestUncertaintyPropagation(unittest.TestCase):
+
+    def setUp(self):
+        self.session = get_session()
+        self.bc = get_calculator(self.session,
+                                 [(2, 13.0), (3, 1.0), (4, 91.0), (5, 3670.0), (8, 27.0)],
+                                 [2, 6, 8, 10, 13])
+        self.nominal = np.array([13.0, 1.0, 91.0, 3670.0, 27.0])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_no_uncertainty(self):
+        mc = UncertaintyPropagation(self.bc, self.session)
+        np.testing.assert_allclose(mc.sample(10), np.tile(self.nominal, (10, 1)))
+
+    def test_solution_rows_reproduce_batch_matrix(self):
+        # a vanishing spread only switches on the per sample solution rows
+        mc = UncertaintyPropagation(self.bc, self.session, concentration_sd=1.0e-14)
+        self.assertEqual(list(mc.varied), [0])
+        np.testing.assert_allclose(mc.sample(10), np.tile(self.nominal, (10, 1)))
+
+    def test_weighing_error(self):
+        mc = UncertaintyPropagation(self.bc, self.session, mass_sd=0.1,
+                                    concentration_sd={2: 0.01})
+        res = mc.percentiles(20000, reference=2, seed=0)
+        self.assertEqual(res.values.shape, (3, 5))
+        self.assertTrue(np.all(np.diff(res.values, axis=0) >= 0.0))
+        self.assertAlmostEqual(res.std[2], 0.0)
+        np.testing.assert_allclose(res.values[1], self.nominal, rtol=1.0e-2)
+        np.testing.assert_allclose(mc.percentiles(100, seed=0).values,
+                                   mc.percentiles(100, seed=0).values)
+
+    def test_molecular_weights(self):
+        # a vanishing spread only switches on the per sample rows
+        mc = UncertaintyPropagation(self.bc, self.session, molwt_rsd=1.0e-14)
+        self.assertEqual(list(mc.varied), [0, 1, 3, 4])
+        np.testing.assert_allclose(mc.sample(10), np.tile(self.nominal, (10, 1)))
+
+        mc = UncertaintyPropagation(self.bc, self.session, molwt_rsd=0.01)
+        rsd = mc.percentiles(20000, seed=0).std / self.nominal
+        # SiO2 comes from a mixture of fixed weight fractions
+        self.assertAlmostEqual(rsd[2], 0.01, delta=5.0e-4)
+        # Al2O3 from aluminium sulfate, whose molecular weight follows the
+        # ones of Al2O3, SO3 and H2O
+        rows = Repository(self.session).batch_rows([6])[6]
+        weights = np.array([r.coefficient * r.molwt for r in rows])
+        expected = 0.01 * np.sqrt(np.sum(weights**2)) / weights.sum()
+        self.assertAlmostEqual(rsd[1], expected, delta=5.0e-4)
+
+    def test_wrong_number_of_masses(self):
+        self.assertRaises(ValueError, UncertaintyPropagation, self.bc, self.session,
+                          masses=[1.0, 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()